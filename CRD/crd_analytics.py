@@ -0,0 +1,274 @@
+import os
+import sys
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crd_model import CONDITION_KEYS, SOURCE_KEYS, YIELD_KEYS, load_store, unpack_fields
+
+# Unit spellings are compared lower-cased with spaces, dots and degree signs
+# removed. Times become hours and temperatures degrees Celsius.
+TIME_UNITS = {
+    "s": 1 / 3600, "sec": 1 / 3600, "secs": 1 / 3600, "second": 1 / 3600, "seconds": 1 / 3600,
+    "min": 1 / 60, "mins": 1 / 60, "minute": 1 / 60, "minutes": 1 / 60,
+    "h": 1.0, "hr": 1.0, "hrs": 1.0, "hour": 1.0, "hours": 1.0,
+    "d": 24.0, "day": 24.0, "days": 24.0,
+}
+CELSIUS_UNITS = ["", "c", "degc", "celsius", "oc"]
+KELVIN_UNITS = ["k", "kelvin"]
+FAHRENHEIT_UNITS = ["f", "degf", "fahrenheit"]
+PERCENT_UNITS = ["", "%", "percent"]
+FIELDS = ["time_h", "temperature_c", "temperature_start_c", "temperature_end_c", "yield_pct", "year"]
+
+
+def unit_key(unit):
+    # "°C", "deg. C" and "degree(s) Celsius" (what the archive writes) all
+    # come out as the bare unit.
+    key = unit.lower().replace(" ", "").replace(".", "").replace("°", "").replace("º", "")
+    for prefix in ["degrees", "degree"]:
+        if key.startswith(prefix) and len(key) > len(prefix):
+            return key[len(prefix):]
+    return key
+
+
+def parse_amount(text):
+    # "12", "12.5" or a range such as "2-3" (its midpoint); anything else is NaN.
+    text = text.strip().replace(",", ".")
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    low, sep, high = text.partition("-")
+    if sep and low:
+        try:
+            return (float(low) + float(high)) / 2
+        except ValueError:
+            pass
+    return np.nan
+
+
+def to_numbers(strings):
+    # Parses each distinct string once and scatters the values back.
+    if not len(strings):
+        return np.empty(0)
+    uniques, inverse = np.unique(np.asarray(strings, dtype=object).astype(str), return_inverse=True)
+    values = np.array([parse_amount(u) if u else np.nan for u in uniques], dtype=float)
+    return values[inverse]
+
+
+def scale_by_unit(units, table):
+    uniques, inverse = np.unique(np.asarray(units, dtype=object).astype(str), return_inverse=True)
+    factors = np.array([table.get(unit_key(u), np.nan) for u in uniques], dtype=float)
+    return factors[inverse]
+
+
+def to_celsius(amounts, units):
+    uniques, inverse = np.unique(np.asarray(units, dtype=object).astype(str), return_inverse=True)
+    kinds = np.array([
+        0 if unit_key(u) in CELSIUS_UNITS else
+        1 if unit_key(u) in KELVIN_UNITS else
+        2 if unit_key(u) in FAHRENHEIT_UNITS else 3
+        for u in uniques
+    ])[inverse]
+    celsius = np.full(len(amounts), np.nan)
+    celsius[kinds == 0] = amounts[kinds == 0]
+    celsius[kinds == 1] = amounts[kinds == 1] - 273.15
+    celsius[kinds == 2] = (amounts[kinds == 2] - 32) * 5 / 9
+    return celsius
+
+
+class ReactionTable:
+    # Column arrays over a CRD crawl: one row per reaction for conditions,
+    # yield and year (NaN where unknown), plus one row per molecule linking
+    # reaction index, role id and lower-cased name id.
+
+    def __init__(self, store):
+        self.store = store
+        count = len(store)
+        columns = {key: [""] * count for key in CONDITION_KEYS + ["yield", "yield_unit", "year", "doi"]}
+        for i, reaction in enumerate(store.reactions):
+            if reaction.raw is not None:
+                conditions = reaction.raw.get("reaction_conditions") or {}
+                yield_ = reaction.raw.get("yield") or {}
+                source = reaction.raw.get("source") or {}
+            else:
+                conditions = unpack_fields(reaction.conditions, CONDITION_KEYS, {})
+                yield_ = unpack_fields(reaction.yield_, YIELD_KEYS, "")
+                source = unpack_fields(reaction.source, SOURCE_KEYS, {})
+            for key in CONDITION_KEYS:
+                columns[key][i] = str(conditions.get(key) or "")
+            if isinstance(yield_, dict):
+                columns["yield"][i] = str(yield_.get("amount") or "")
+                columns["yield_unit"][i] = str(yield_.get("unit") or "")
+            if isinstance(source, dict):
+                columns["year"][i] = str(source.get("year") or "")
+                columns["doi"][i] = str(source.get("DOI") or "")
+
+        self.time_h = to_numbers(columns["time"]) * scale_by_unit(columns["time_unit"], TIME_UNITS)
+        # Start and end temperatures carry no unit of their own.
+        units = columns["temperature_unit"]
+        self.temperature_c = to_celsius(to_numbers(columns["temperature"]), units)
+        self.temperature_start_c = to_celsius(to_numbers(columns["temperature_start"]), units)
+        self.temperature_end_c = to_celsius(to_numbers(columns["temperature_end"]), units)
+        self.reflux = np.isin(np.char.lower(np.asarray(columns["reflux"], dtype=str)), ["1", "true", "yes", "y"])
+
+        yields = to_numbers(columns["yield"])
+        is_percent = np.isin(np.char.lower(np.asarray(columns["yield_unit"], dtype=str)), PERCENT_UNITS)
+        # "-1" (and any other negative amount) marks an unknown yield.
+        self.yield_pct = np.where(is_percent & (yields >= 0), yields, np.nan)
+        self.year = to_numbers(columns["year"])
+        self.doi = np.asarray(columns["doi"], dtype=object)
+
+        counts = np.array([r.count for r in store.reactions], dtype=np.int64)
+        self.mol_reaction = np.repeat(np.arange(count), counts)
+        self.mol_role = np.frombuffer(store.mol_role, dtype=np.uint16).copy() if len(store.mol_role) else np.empty(0, np.uint16)
+        names = np.asarray([(name or "").lower() for name in store.mol_name], dtype=str)
+        self.names, self.mol_name = np.unique(names, return_inverse=True)
+        self.role_names = list(store.roles.names)
+
+    def __len__(self):
+        return len(self.year)
+
+    def role_id(self, role):
+        return self.store.roles.ids.get(role.lower(), -1)
+
+    def with_role(self, role):
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.mol_reaction[self.mol_role == self.role_id(role)]] = True
+        return mask
+
+    def with_compound(self, name, role=None):
+        # Reactions that list a molecule called `name` (case-insensitive),
+        # optionally only in the given role.
+        mask = np.zeros(len(self), dtype=bool)
+        hit = np.searchsorted(self.names, name.lower())
+        if hit >= len(self.names) or self.names[hit] != name.lower():
+            return mask
+        rows = self.mol_name == hit
+        if role is not None:
+            rows &= self.mol_role == self.role_id(role)
+        mask[self.mol_reaction[rows]] = True
+        return mask
+
+    def in_years(self, first=None, last=None):
+        mask = ~np.isnan(self.year)
+        if first is not None:
+            mask &= self.year >= first
+        if last is not None:
+            mask &= self.year <= last
+        return mask
+
+    def field(self, name):
+        if name not in FIELDS:
+            raise ValueError(f"Unknown field '{name}'; choose from {', '.join(FIELDS)}")
+        return getattr(self, name)
+
+    def by_year(self):
+        groups = np.where(np.isnan(self.year), -1, self.year).astype(np.int64)
+        return np.arange(len(self)), groups, {int(y): str(int(y)) for y in np.unique(groups) if y >= 0}
+
+    def by_role(self):
+        # One row per (reaction, role) pair.
+        pairs = np.unique(np.stack([self.mol_reaction, self.mol_role.astype(np.int64)]), axis=1)
+        return pairs[0], pairs[1], dict(enumerate(self.role_names))
+
+    def by_compound(self, role):
+        # One row per (reaction, compound) pair for molecules in `role`.
+        rows = self.mol_role == self.role_id(role)
+        pairs = np.unique(np.stack([self.mol_reaction[rows], self.mol_name[rows].astype(np.int64)]), axis=1)
+        return pairs[0], pairs[1], {int(g): str(self.names[g]) for g in np.unique(pairs[1])}
+
+
+def grouped_stats(values, groups):
+    # Count, mean, std, min, median and max of `values` per group id, with
+    # NaN values and negative group ids left out.
+    values = np.asarray(values, dtype=float)
+    groups = np.asarray(groups)
+    keep = ~np.isnan(values) & (groups >= 0)
+    values, groups = values[keep], groups[keep]
+    empty = {"group": np.empty(0, groups.dtype), "count": np.empty(0, np.int64)}
+    if not len(values):
+        return dict(empty, **{k: np.empty(0) for k in ["mean", "std", "min", "median", "max"]})
+
+    order = np.lexsort((values, groups))
+    values, groups = values[order], groups[order]
+    keys, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+    means = np.add.reduceat(values, starts) / counts
+    deviations = values - np.repeat(means, counts)
+    stds = np.sqrt(np.add.reduceat(deviations * deviations, starts) / counts)
+    lower = starts + (counts - 1) // 2
+    upper = starts + counts // 2
+    return {
+        "group": keys,
+        "count": counts,
+        "mean": means,
+        "std": stds,
+        "min": values[starts],
+        "median": (values[lower] + values[upper]) / 2,
+        "max": values[starts + counts - 1],
+    }
+
+
+def histogram(values, bins=10, value_range=None):
+    values = np.asarray(values, dtype=float)
+    return np.histogram(values[~np.isnan(values)], bins=bins, range=value_range)
+
+
+def load_table(path):
+    return ReactionTable(load_store(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise CRD reaction conditions and yields.")
+    parser.add_argument("path", nargs="?", default="reaction_data.json",
+                        help="reaction_data.json, a reaction journal (.jsonl) or a reaction database")
+    parser.add_argument("--field", default="yield_pct", choices=FIELDS)
+    parser.add_argument("--role", help="Only reactions with a molecule in this role")
+    parser.add_argument("--compound", help="Only reactions with a molecule of this name")
+    parser.add_argument("--years", help="Year range, e.g. 2015-2020 or 2018-")
+    parser.add_argument("--group-by", default="year", help="year, role, or a role name to group by its compounds")
+    parser.add_argument("--top", type=int, default=20, help="Groups to print, largest first")
+    parser.add_argument("--bins", type=int, default=0, help="Print a histogram with this many bins")
+    args = parser.parse_args()
+
+    table = load_table(args.path)
+    mask = np.ones(len(table), dtype=bool)
+    if args.role:
+        mask &= table.with_role(args.role)
+    if args.compound:
+        mask &= table.with_compound(args.compound, args.role)
+    if args.years:
+        first, _, last = args.years.partition("-")
+        mask &= table.in_years(float(first) if first else None, float(last) if last else None)
+
+    values = table.field(args.field)
+    print(f"{len(table)} reactions loaded, {int(mask.sum())} selected, "
+          f"{int((~np.isnan(values[mask])).sum())} with {args.field}")
+
+    if args.group_by == "year":
+        rows, groups, labels = table.by_year()
+    elif args.group_by == "role":
+        rows, groups, labels = table.by_role()
+    else:
+        rows, groups, labels = table.by_compound(args.group_by)
+    keep = mask[rows]
+    stats = grouped_stats(values[rows[keep]], groups[keep])
+
+    order = np.argsort(-stats["count"], kind="stable")[:args.top]
+    print(f"\n{args.group_by:<30} {'count':>7} {'mean':>9} {'std':>9} {'min':>9} {'median':>9} {'max':>9}")
+    for i in order:
+        label = labels.get(int(stats["group"][i]), str(stats["group"][i]))
+        print(f"{label[:30]:<30} {stats['count'][i]:>7} {stats['mean'][i]:>9.2f} {stats['std'][i]:>9.2f} "
+              f"{stats['min'][i]:>9.2f} {stats['median'][i]:>9.2f} {stats['max'][i]:>9.2f}")
+
+    if args.bins:
+        counts, edges = histogram(values[mask], args.bins)
+        print(f"\nHistogram of {args.field}:")
+        scale = max(counts.max(), 1) if len(counts) else 1
+        for count, low, high in zip(counts, edges[:-1], edges[1:]):
+            print(f"  {low:9.2f} - {high:9.2f} {count:7d} {'#' * int(40 * count / scale)}")
+
+
+if __name__ == "__main__":
+    main()
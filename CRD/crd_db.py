@@ -0,0 +1,60 @@
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.reaction_db import ReactionDB, is_db_path
+from crd_journal import iter_journal_ordered, dump_reactions
+
+
+def write_reactions_db(reactions, db_path):
+    # Loads reaction dicts into the shared reaction database; reactions whose
+    # details_url is already stored are replaced. Their molecules are then
+    # linked to compounds deduplicated by InChIKey.
+    db = ReactionDB(db_path)
+    count = 0
+    try:
+        for data in reactions:
+            db.add_crd_reaction(data)
+            count += 1
+        db.resolve_compounds()
+    finally:
+        db.close()
+    return count
+
+
+def iter_db_reactions(db_path):
+    db = ReactionDB(db_path)
+    try:
+        yield from db.iter_crd_records()
+    finally:
+        db.close()
+
+
+def iter_reactions(path):
+    # Reaction dicts from a journal (.jsonl), a reaction database or
+    # reaction_data.json.
+    if path.endswith(".jsonl"):
+        return iter_journal_ordered(path)
+    if is_db_path(path):
+        return iter_db_reactions(path)
+    with open(path, encoding="utf-8") as f:
+        return iter(json.load(f))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy CRD reactions between JSON, journals and the reaction database.")
+    parser.add_argument("source", help="reaction_data.json, a reaction journal (.jsonl) or a reaction database")
+    parser.add_argument("output", help="A reaction database (.sqlite/.db) to load into, or a JSON file to write")
+    args = parser.parse_args()
+
+    if is_db_path(args.output):
+        count = write_reactions_db(iter_reactions(args.source), args.output)
+    else:
+        count, _ = dump_reactions(iter_reactions(args.source), args.output)
+    print(f"Wrote {count} reactions to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import METRICS
+from common.manifest import content_hash
+from crd_http import profile_xml_url
+
+DEFAULT_XML_WORKERS = 8
+
+
+def fetch_reaction(session, parse, details_url, xml_url=None, known_hash=None, timeout=10):
+    # Runs on a worker thread: resolves the XML link when only the profile
+    # page is known, downloads the document and parses it. A document whose
+    # hash equals `known_hash` is not parsed again.
+    if xml_url is None:
+        xml_url = profile_xml_url(session, details_url)
+    with METRICS.timer("fetch"):
+        response = session.get(xml_url, timeout=timeout)
+    if response.status_code != 200:
+        raise IOError(f"Failed to fetch XML: Status {response.status_code}")
+    digest = content_hash(response.text)
+    if digest == known_hash:
+        return xml_url, None, digest
+    return xml_url, parse(response.text, details_url), digest
+
+
+class ReactionFetcher:
+    # Fetches and parses reactions on a thread pool while the caller keeps
+    # harvesting links. Results come back in submission order as
+    # (details_url, xml_url, parsed, digest, error) tuples; digest is the
+    # hash of the XML document, and parsed is None when it matched the
+    # known_hash given to submit(). At most `max_pending` reactions are in
+    # flight before submit() waits for the oldest one.
+
+    def __init__(self, session, parse, workers=DEFAULT_XML_WORKERS, max_pending=None):
+        self.session = session
+        self.parse = parse
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.pending = deque()
+        self.max_pending = max_pending or workers * 4
+
+    def submit(self, details_url, xml_url=None, known_hash=None):
+        future = self.pool.submit(fetch_reaction, self.session, self.parse, details_url, xml_url, known_hash)
+        self.pending.append((details_url, xml_url, future))
+        return self.ready()
+
+    def ready(self):
+        results = []
+        while self.pending and (self.pending[0][2].done() or len(self.pending) > self.max_pending):
+            results.append(self._pop())
+        return results
+
+    def finish(self):
+        results = []
+        while self.pending:
+            results.append(self._pop())
+        return results
+
+    def _pop(self):
+        details_url, xml_url, future = self.pending.popleft()
+        try:
+            xml_url, parsed, digest = future.result()
+            METRICS.count("reactions")
+            return details_url, xml_url, parsed, digest, None
+        except Exception as e:
+            METRICS.count("errors")
+            return details_url, xml_url, None, None, e
+
+    def close(self):
+        for _, _, future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
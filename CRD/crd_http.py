@@ -0,0 +1,107 @@
+import os
+import sys
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import METRICS
+
+ARCHIVE_URL = "https://kmt.vander-lingen.nl/archive"
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+
+class NeedsBrowser(Exception):
+    # Raised when a page does not expose the links we need as plain hrefs.
+    pass
+
+
+class LinkParser(HTMLParser):
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+        self.current = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            self.current = [dict(attrs).get("href"), []]
+
+    def handle_data(self, data):
+        if self.current is not None:
+            self.current[1].append(data)
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self.current is not None:
+            href, text = self.current
+            self.links.append((" ".join("".join(text).split()), href))
+            self.current = None
+
+
+def parse_links(html, base_url):
+    parser = LinkParser()
+    parser.feed(html)
+    parser.close()
+    return [(text, urljoin(base_url, href) if usable_href(href) else None) for text, href in parser.links]
+
+
+def usable_href(href):
+    if not href:
+        return False
+    href = href.strip().lower()
+    return not (href.startswith("#") or href.startswith("javascript:"))
+
+
+def find_links(links, text, partial=False):
+    # Same matching as Selenium's LINK_TEXT / PARTIAL_LINK_TEXT.
+    if partial:
+        return [link for link in links if text in link[0]]
+    return [link for link in links if link[0] == text]
+
+
+def require_hrefs(links, what, page_url):
+    if any(href is None for _, href in links):
+        raise NeedsBrowser(f"'{what}' links on {page_url} are not plain hrefs")
+    return [href for _, href in links]
+
+
+def fetch_html(session, url, timeout=30):
+    with METRICS.timer("fetch"):
+        response = session.get(url, timeout=timeout)
+    if response.status_code != 200:
+        raise IOError(f"Status {response.status_code} fetching {url}")
+    return response.text
+
+
+def archive_sets(session, archive_url=ARCHIVE_URL):
+    # Returns (link text, set url) for every "reaction data" link on the archive page.
+    links = parse_links(fetch_html(session, archive_url), archive_url)
+    set_links = find_links(links, "reaction data", partial=True)
+    require_hrefs(set_links, "reaction data", archive_url)
+    return set_links
+
+
+def iter_set_pages(session, set_url, max_pages=None):
+    # Yields (page_num, page_url, profile_urls) following the "Next" links.
+    page_url = set_url
+    page_num = 1
+    seen = set()
+    while page_url and page_url not in seen:
+        seen.add(page_url)
+        links = parse_links(fetch_html(session, page_url), page_url)
+        profile_urls = require_hrefs(find_links(links, "Details"), "Details", page_url)
+        yield page_num, page_url, profile_urls
+        if not profile_urls or (max_pages and page_num >= max_pages):
+            return
+        next_links = require_hrefs(find_links(links, "Next"), "Next", page_url)
+        page_url = next_links[0] if next_links else None
+        page_num += 1
+
+
+def profile_xml_url(session, profile_url):
+    # A link that is there but not a plain href needs the browser; a page
+    # without one is just a broken reaction.
+    links = parse_links(fetch_html(session, profile_url), profile_url)
+    xml_links = require_hrefs(find_links(links, "XML"), "XML", profile_url)
+    if not xml_links:
+        raise IOError(f"No XML link on {profile_url}")
+    return xml_links[0]
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.jsonl import iter_jsonl, truncate_log
+
+DEFAULT_JOURNAL = "reaction_journal.jsonl"
+# Records written by parallel browsers carry the rank of their set in the
+# selection under this key, so the output can be put back in that order.
+ORDER_KEY = "_set_order"
+SYNC_EVERY = 50
+SYNC_SECONDS = 5.0
+
+
+class ReactionJournal:
+    # Append-only log with one parsed reaction per line. Writes are fsynced in
+    # batches of `sync_every` records or every `sync_seconds`, whichever comes
+    # first. Reopening an existing journal drops a partly written last line
+    # and indexes the details_urls already recorded so they can be skipped.
+
+    def __init__(self, path=DEFAULT_JOURNAL, sync_every=SYNC_EVERY, sync_seconds=SYNC_SECONDS):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_seconds = sync_seconds
+        self.done_urls = set()
+        self.count = 0
+        self.lock = threading.Lock()
+
+        good_length = 0
+        for record, good_length in iter_jsonl(path):
+            self.done_urls.add(record.get("details_url"))
+            self.count += 1
+        truncate_log(path, good_length)
+        self.resumed = self.count
+
+        self.file = open(path, "a", encoding="utf-8")
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def __contains__(self, details_url):
+        return details_url in self.done_urls
+
+    def append(self, reaction, order=None):
+        if order is not None:
+            reaction = {**reaction, ORDER_KEY: order}
+        line = json.dumps(reaction, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.done_urls.add(reaction.get("details_url"))
+            self.count += 1
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_seconds:
+                self._sync()
+            return self.count
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self._sync()
+                self.file.close()
+
+
+def iter_journal(path):
+    for record, _ in iter_jsonl(path):
+        record.pop(ORDER_KEY, None)
+        yield record
+
+
+def iter_journal_ordered(path):
+    # Like iter_journal, but records tagged with a set order are sorted by
+    # it. The sort is stable, so each set keeps the order its reactions were
+    # found in and untagged records stay first. Only the offsets are held in
+    # memory; records are read back one at a time.
+    spans = []
+    start = 0
+    tagged = False
+    for record, end in iter_jsonl(path):
+        order = record.get(ORDER_KEY)
+        tagged = tagged or order is not None
+        spans.append((-1 if order is None else order, start, end))
+        start = end
+    if not tagged:
+        yield from iter_journal(path)
+        return
+    spans.sort(key=lambda span: span[0])
+    with open(path, "rb") as f:
+        for _, start, end in spans:
+            f.seek(start)
+            record = json.loads(f.read(end - start))
+            record.pop(ORDER_KEY, None)
+            yield record
+
+
+def dump_reactions(reactions, output_path):
+    # Writes reaction dicts in the same layout as
+    # json.dump(reactions, f, indent=4, ensure_ascii=False), one at a time,
+    # and returns the reaction count and the role keys seen.
+    count = 0
+    roles = set()
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for reaction in reactions:
+            f.write(",\n    " if count else "[\n    ")
+            f.write(json.dumps(reaction, indent=4, ensure_ascii=False).replace("\n", "\n    "))
+            count += 1
+            roles.update(reaction_roles([reaction]))
+        f.write("\n]" if count else "[]")
+    os.replace(tmp_path, output_path)
+    return count, roles
+
+
+def reaction_roles(reactions):
+    roles = set()
+    for reaction in reactions:
+        for key in reaction:
+            if key.endswith('_details'):
+                roles.add(key.replace('_details', ''))
+    return roles
+
+
+def write_reaction_json(journal_path, output_path):
+    return dump_reactions(iter_journal_ordered(journal_path), output_path)
+
+
+def merge_reaction_json(journal_path, output_path):
+    # Folds the journal into an existing reaction_data.json: reactions with
+    # the same details_url are replaced in place, new ones are appended.
+    updates = {record.get("details_url"): record for record in iter_journal_ordered(journal_path)}
+    existing = []
+    if os.path.exists(output_path):
+        with open(output_path, encoding="utf-8") as f:
+            existing = json.load(f)
+
+    def merged():
+        for reaction in existing:
+            yield updates.pop(reaction.get("details_url"), reaction)
+        yield from updates.values()
+
+    return dump_reactions(merged(), output_path)
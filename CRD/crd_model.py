@@ -0,0 +1,239 @@
+import os
+import sys
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crd_journal import dump_reactions
+from crd_db import iter_reactions
+
+FIXED_KEYS = ["sequence_origin", "details_url", "smiles", "reaction_conditions", "yield", "source"]
+CONDITION_KEYS = ["time", "time_unit", "temperature", "temperature_unit", "temperature_start", "temperature_end", "reflux"]
+SOURCE_KEYS = ["literature", "DOI", "year", "date_added"]
+YIELD_KEYS = ["amount", "unit"]
+MOLECULE_KEYS = ["name", "smiles", "inchiKey", "ratio", "role", "notes"]
+
+
+class RoleTable:
+    # Role names in order of first appearance; molecules store the index.
+
+    def __init__(self):
+        self.names = []
+        self.keys = []
+        self.ids = {}
+
+    def id(self, name):
+        role_id = self.ids.get(name)
+        if role_id is None:
+            role_id = len(self.names)
+            name = sys.intern(name)
+            self.ids[name] = role_id
+            self.names.append(name)
+            self.keys.append(sys.intern(name.replace(" ", "_")))
+        return role_id
+
+    def __len__(self):
+        return len(self.names)
+
+
+class Molecule:
+    __slots__ = ("name", "smiles", "inchi_key", "ratio", "role", "extras")
+
+    def __init__(self, name, smiles, inchi_key, ratio, role, extras=None):
+        self.name = name
+        self.smiles = smiles
+        self.inchi_key = inchi_key
+        self.ratio = ratio
+        self.role = role
+        self.extras = extras
+
+
+class Reaction:
+    # `first` and `count` locate the reaction's molecules in the store
+    # columns, grouped by role in the order the roles appear. `raw` holds the
+    # original dict for the rare reaction that does not fit this layout.
+    __slots__ = ("details_url", "sequence_origin", "smiles", "conditions", "yield_", "source",
+                 "first", "count", "raw")
+
+    def __init__(self, details_url, sequence_origin, smiles, conditions, yield_, source, first, count, raw=None):
+        self.details_url = details_url
+        self.sequence_origin = sequence_origin
+        self.smiles = smiles
+        self.conditions = conditions
+        self.yield_ = yield_
+        self.source = source
+        self.first = first
+        self.count = count
+        self.raw = raw
+
+
+def pack_fields(value, keys, empty, intern):
+    # A dict with exactly `keys` and string values becomes a tuple; the empty
+    # value becomes None; anything else is kept as it is.
+    if value == empty and type(value) is type(empty):
+        return None
+    if isinstance(value, dict) and list(value) == keys and all(isinstance(v, str) for v in value.values()):
+        return tuple(intern(v) for v in value.values())
+    return value
+
+
+def unpack_fields(value, keys, empty):
+    if value is None:
+        return type(empty)()
+    if isinstance(value, tuple):
+        return dict(zip(keys, value))
+    return value
+
+
+def primary_name(molecules):
+    # parse_xml_data keeps the first name that is neither "Unknown" nor empty.
+    for mol in molecules:
+        if mol.get("name") and mol.get("name") != "Unknown":
+            return mol["name"]
+    return ""
+
+
+class ReactionStore:
+    # Compact in-memory copy of a CRD crawl. Molecule fields live in one
+    # column per field (role ids in an array), repeated strings are shared,
+    # and to_dict() rebuilds exactly the dict parse_xml_data produced.
+
+    def __init__(self):
+        self.roles = RoleTable()
+        self.strings = {}
+        self.reactions = []
+        self.mol_name = []
+        self.mol_smiles = []
+        self.mol_inchi_key = []
+        self.mol_ratio = []
+        self.mol_role = array("H")
+        self.mol_extras = []
+
+    def intern(self, value):
+        if value is None:
+            return None
+        return self.strings.setdefault(value, value)
+
+    def __len__(self):
+        return len(self.reactions)
+
+    def add(self, data):
+        groups = self.role_groups(data)
+        if groups is None:
+            self.reactions.append(Reaction(None, None, None, None, None, None, len(self.mol_role), 0, raw=data))
+            return len(self.reactions) - 1
+
+        first = len(self.mol_role)
+        for role, molecules in groups:
+            role_id = self.roles.id(role)
+            for mol in molecules:
+                extras = [(key, value) for key, value in mol.items() if key not in MOLECULE_KEYS]
+                if mol["notes"] is not None:
+                    extras.insert(0, ("notes", mol["notes"]))
+                self.mol_name.append(self.intern(mol["name"]))
+                self.mol_smiles.append(self.intern(mol["smiles"]))
+                self.mol_inchi_key.append(self.intern(mol["inchiKey"]))
+                self.mol_ratio.append(self.intern(mol["ratio"]))
+                self.mol_role.append(role_id)
+                self.mol_extras.append(tuple(extras) if extras else None)
+
+        details_url = data["details_url"]
+        sequence_origin = data["sequence_origin"]
+        self.reactions.append(Reaction(
+            details_url,
+            None if sequence_origin == details_url else sequence_origin,
+            data["smiles"],
+            pack_fields(data["reaction_conditions"], CONDITION_KEYS, {}, self.intern),
+            pack_fields(data["yield"], YIELD_KEYS, "", self.intern),
+            pack_fields(data["source"], SOURCE_KEYS, {}, self.intern),
+            first,
+            len(self.mol_role) - first,
+        ))
+        return len(self.reactions) - 1
+
+    def role_groups(self, data):
+        # Returns [(role, molecule dicts)] when `data` has the layout
+        # parse_xml_data writes, otherwise None.
+        keys = list(data)
+        if keys[:len(FIXED_KEYS)] != FIXED_KEYS or (len(keys) - len(FIXED_KEYS)) % 2:
+            return None
+        groups = []
+        for i in range(len(FIXED_KEYS), len(keys), 2):
+            details_key, role = keys[i], keys[i + 1]
+            molecules = data[details_key]
+            if details_key != role.replace(" ", "_") + "_details" or not isinstance(molecules, list) or not molecules:
+                return None
+            for mol in molecules:
+                if not isinstance(mol, dict) or list(mol)[:len(MOLECULE_KEYS)] != MOLECULE_KEYS or mol["role"] != role:
+                    return None
+            if data[role] != primary_name(molecules):
+                return None
+            groups.append((role, molecules))
+        return groups
+
+    def molecules(self, index):
+        reaction = self.reactions[index]
+        return [
+            Molecule(self.mol_name[i], self.mol_smiles[i], self.mol_inchi_key[i], self.mol_ratio[i],
+                     self.mol_role[i], self.mol_extras[i])
+            for i in range(reaction.first, reaction.first + reaction.count)
+        ]
+
+    def role_ids(self, index):
+        reaction = self.reactions[index]
+        return list(dict.fromkeys(self.mol_role[reaction.first:reaction.first + reaction.count]))
+
+    def role_counts(self):
+        counts = [0] * len(self.roles)
+        for role_id in self.mol_role:
+            counts[role_id] += 1
+        return {self.roles.names[role_id]: count for role_id, count in enumerate(counts)}
+
+    def to_dict(self, index):
+        reaction = self.reactions[index]
+        if reaction.raw is not None:
+            return reaction.raw
+
+        data = {
+            "sequence_origin": reaction.details_url if reaction.sequence_origin is None else reaction.sequence_origin,
+            "details_url": reaction.details_url,
+            "smiles": reaction.smiles,
+            "reaction_conditions": unpack_fields(reaction.conditions, CONDITION_KEYS, {}),
+            "yield": unpack_fields(reaction.yield_, YIELD_KEYS, ""),
+            "source": unpack_fields(reaction.source, SOURCE_KEYS, {}),
+        }
+        role_lists = {}
+        for mol in self.molecules(index):
+            role = self.roles.names[mol.role]
+            if role not in role_lists:
+                role_lists[role] = data[f"{self.roles.keys[mol.role]}_details"] = []
+                data[role] = ""
+            mol_info = {
+                "name": mol.name,
+                "smiles": mol.smiles,
+                "inchiKey": mol.inchi_key,
+                "ratio": mol.ratio,
+                "role": role,
+                "notes": None
+            }
+            if mol.extras:
+                mol_info.update(mol.extras)
+            role_lists[role].append(mol_info)
+        for role, molecules in role_lists.items():
+            data[role] = primary_name(molecules)
+        return data
+
+    def iter_dicts(self):
+        for index in range(len(self.reactions)):
+            yield self.to_dict(index)
+
+    def write_json(self, output_path):
+        return dump_reactions(self.iter_dicts(), output_path)
+
+
+def load_store(path):
+    # Reads reaction_data.json, a reaction journal (.jsonl) or the CRD
+    # reactions in a reaction database into a store.
+    store = ReactionStore()
+    for data in iter_reactions(path):
+        store.add(data)
+    return store
@@ -0,0 +1,283 @@
+import os
+import sys
+import logging
+import argparse
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import METRICS, LOG_LEVELS, configure_logging
+from crd_journal import DEFAULT_JOURNAL, ReactionJournal, write_reaction_json
+
+log = logging.getLogger("crd")
+
+MOLECULE_FIELDS = ["role", "name", "smiles", "inchiKey", "ratio"]
+SOURCE_FIELDS = [
+    ("literature", "literatureSource"),
+    ("DOI", "DOI"),
+    ("year", "year"),
+    ("date_added", "dateAdded"),
+]
+CONDITION_FIELDS = [
+    ("time", "reactionTime", "amount"),
+    ("time_unit", "reactionTime", "unit"),
+    ("temperature", "reactionTemperature", "amount"),
+    ("temperature_unit", "reactionTemperature", "unit"),
+    ("temperature_start", "reactionTemperatureStart", "amount"),
+    ("temperature_end", "reactionTemperatureEnd", "amount"),
+    ("reflux", "reflux", "amount"),
+]
+YIELD_FIELDS = ["amount", "unit"]
+# Only the first element with each of these tags in a reaction is read, as
+# root.find(".//tag") did.
+SECTIONS = ["reactionSmiles", "source", "reactionConditions", "yield", "participants"]
+
+REACTANT_ROLES = ["reactant", "building block", "starting material"]
+PRODUCT_ROLES = ["product"]
+
+
+def create_minimal_data(source_url):
+    return {
+        "sequence_origin": source_url,
+        "details_url": source_url,
+        "smiles": "",
+        "reaction_conditions": {},
+        "yield": "",
+        "source": {}
+    }
+
+
+def child_texts(elem, names):
+    # First direct child text for each name, read in one pass over the children.
+    texts = {}
+    for child in elem:
+        if child.tag in names and child.tag not in texts:
+            texts[child.tag] = child.text
+    return texts
+
+
+def stripped(text, default=""):
+    return text.strip() if text else default
+
+
+def read_conditions(elem):
+    # Same lookup as findtext("group/field"): the first field found under any
+    # child named group.
+    groups = {}
+    for child in elem:
+        groups.setdefault(child.tag, []).append(child)
+    conditions = {}
+    for key, group, field in CONDITION_FIELDS:
+        text = None
+        for group_elem in groups.get(group, []):
+            texts = child_texts(group_elem, [field])
+            if field in texts:
+                text = texts[field]
+                break
+        conditions[key] = stripped(text)
+    return conditions
+
+
+def read_molecules(participants, data, all_roles):
+    molecules = list(participants.iter("molecule"))
+    log.debug(f"  Found {len(molecules)} molecules")
+
+    for molecule in molecules:
+        fields = {}
+        extras = {}
+        for child in molecule:
+            if child.tag in MOLECULE_FIELDS:
+                if child.tag not in fields:
+                    fields[child.tag] = child.text
+            elif child.text and child.text.strip():
+                extras[child.tag] = child.text.strip()
+            elif child.attrib:
+                extras[f"{child.tag}_attrs"] = child.attrib
+
+        if not fields.get("role"):
+            continue
+
+        role = fields["role"].strip().lower()
+        role_key = role.replace(" ", "_")
+
+        if role not in all_roles:
+            all_roles[role] = {
+                "list": [],
+                "primary_name": ""
+            }
+            data[f"{role_key}_details"] = []
+            data[role] = ""
+
+        mol_info = {
+            "name": stripped(fields.get("name"), "Unknown"),
+            "smiles": stripped(fields.get("smiles"), None),
+            "inchiKey": stripped(fields.get("inchiKey"), None),
+            "ratio": stripped(fields.get("ratio"), None),
+            "role": role,
+            "notes": None
+        }
+        mol_info.update(extras)
+
+        data[f"{role_key}_details"].append(mol_info)
+        all_roles[role]["list"].append(mol_info)
+
+        if mol_info["name"] != "Unknown" and not all_roles[role]["primary_name"]:
+            all_roles[role]["primary_name"] = mol_info["name"]
+            data[role] = mol_info["name"]
+
+        log.debug(f"    {role}: {mol_info['name']}")
+
+
+def reaction_smiles_from_roles(all_roles):
+    reactant_smiles = []
+    agent_smiles = []
+    product_smiles = []
+
+    for role, role_data in all_roles.items():
+        for mol in role_data["list"]:
+            if mol["smiles"]:
+                if role in REACTANT_ROLES:
+                    reactant_smiles.append(mol["smiles"])
+                elif role in PRODUCT_ROLES:
+                    product_smiles.append(mol["smiles"])
+                else:
+                    agent_smiles.append(mol["smiles"])
+
+    if reactant_smiles or agent_smiles or product_smiles:
+        return f"{'.'.join(reactant_smiles)}>{'.'.join(agent_smiles)}>{'.'.join(product_smiles)}"
+    return ""
+
+
+def read_reaction(scope, source_url):
+    # One pre-order walk below `scope` claims the first element of each
+    # section; the sections are then read from their own children only.
+    sections = {}
+    elements = scope.iter()
+    next(elements)
+    for elem in elements:
+        if elem.tag in SECTIONS and elem.tag not in sections:
+            sections[elem.tag] = elem
+            if len(sections) == len(SECTIONS):
+                break
+
+    data = create_minimal_data(source_url)
+    all_roles = {}
+
+    elem = sections.get("reactionSmiles")
+    if elem is not None and elem.text:
+        data["smiles"] = elem.text.strip()
+
+    elem = sections.get("source")
+    if elem is not None:
+        texts = child_texts(elem, [name for _, name in SOURCE_FIELDS])
+        data["source"] = {key: stripped(texts.get(name)) for key, name in SOURCE_FIELDS}
+
+    elem = sections.get("reactionConditions")
+    if elem is not None:
+        data["reaction_conditions"] = read_conditions(elem)
+
+    elem = sections.get("yield")
+    if elem is not None:
+        texts = child_texts(elem, YIELD_FIELDS)
+        data["yield"] = {name: stripped(texts.get(name)) for name in YIELD_FIELDS}
+
+    elem = sections.get("participants")
+    if elem is not None:
+        read_molecules(elem, data, all_roles)
+
+    if not data["smiles"]:
+        data["smiles"] = reaction_smiles_from_roles(all_roles)
+
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f"    Summary of roles found: {', '.join(all_roles.keys())}")
+        for role, role_data in all_roles.items():
+            log.debug(f"      {role}: {len(role_data['list'])} items")
+
+    return data
+
+
+def parse_xml_data(xml_content, source_url):
+    with METRICS.timer("xml_parse"):
+        return _parse_xml_data(xml_content, source_url)
+
+
+def _parse_xml_data(xml_content, source_url):
+    # Reads the whole document as one reaction: sections are looked up
+    # anywhere below the root element.
+    try:
+        try:
+            return read_reaction(ET.fromstring(xml_content), source_url)
+        except ET.ParseError as e:
+            log.warning(f"!! XML Parse Error: {e}")
+            xml_content = xml_content.replace('<?xml version="1.0" encoding="UTF-8"?>', '').strip()
+            start = xml_content.find('<reaction')
+            end = xml_content.find('</reaction>')
+            if start == -1 or end == -1:
+                return create_minimal_data(source_url)
+            try:
+                return read_reaction(ET.fromstring(xml_content[start:end + len('</reaction>')]), source_url)
+            except ET.ParseError as e:
+                log.warning(f"!! XML Parse Error: {e}")
+                return create_minimal_data(source_url)
+
+    except Exception as e:
+        log.warning(f"!! Failed to parse XML: {e}", exc_info=True)
+        return create_minimal_data(source_url)
+
+
+def iter_xml_reactions(source, source_url, tag="reaction"):
+    # Streams a file (path or binary file object) holding one or many
+    # <reaction> elements and yields a dict per reaction, with details_url set
+    # to "<source_url>#<n>". Each reaction element is dropped from the tree
+    # once read, so memory stays at about one reaction however large the
+    # export is.
+    scope = None
+    parents = []
+    count = 0
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if scope is None and elem.tag == tag:
+                scope = elem
+            parents.append(elem)
+            continue
+
+        parents.pop()
+        if elem is scope:
+            count += 1
+            yield read_reaction(elem, f"{source_url}#{count}")
+            elem.clear()
+            if parents:
+                parents[-1].remove(elem)
+            scope = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import bulk CRD XML exports into the reaction journal.")
+    parser.add_argument("files", nargs="+", help="XML files with one or more <reaction> elements")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL, help="Journal to append to (default: %(default)s)")
+    parser.add_argument("--output", default="reaction_data.json", help="JSON file rebuilt from the journal")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="info",
+                        help="debug also prints every molecule read")
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    journal = ReactionJournal(args.journal)
+    added = 0
+    try:
+        for path in args.files:
+            print(f"Reading {path}...")
+            try:
+                for reaction in iter_xml_reactions(path, os.path.abspath(path)):
+                    if reaction["details_url"] not in journal:
+                        journal.append(reaction)
+                        added += 1
+            except ET.ParseError as e:
+                print(f"!! XML Parse Error in {path}: {e}")
+    finally:
+        journal.close()
+
+    count, _ = write_reaction_json(args.journal, args.output)
+    print(f"Added {added} reactions; {count} reactions written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
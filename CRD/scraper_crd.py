@@ -1,430 +1,787 @@
+import os
+import sys
 import time
-import json
+import queue
+import logging
+import argparse
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 import io
-import xml.etree.ElementTree as ET
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.common.exceptions import NoSuchElementException
-
-def parse_xml_data(xml_content, source_url):
-    try:
-        root = ET.fromstring(xml_content)
-        
-        data = {
-            "sequence_origin": source_url,
-            "details_url": source_url,
-            "smiles": "",
-            "reaction_conditions": {},
-            "yield": "",
-            "source": {},
-        }
-        
-        all_roles = {}
-        
-        reaction_smiles_elem = root.find(".//reactionSmiles")
-        if reaction_smiles_elem is not None and reaction_smiles_elem.text:
-            data["smiles"] = reaction_smiles_elem.text.strip()
-        
-        source_elem = root.find(".//source")
-        if source_elem is not None:
-            data["source"] = {
-                "literature": source_elem.findtext("literatureSource", "").strip(),
-                "DOI": source_elem.findtext("DOI", "").strip(),
-                "year": source_elem.findtext("year", "").strip(),
-                "date_added": source_elem.findtext("dateAdded", "").strip()
-            }
-        
-        conditions_elem = root.find(".//reactionConditions")
-        if conditions_elem is not None:
-            data["reaction_conditions"] = {
-                "time": conditions_elem.findtext("reactionTime/amount", "").strip(),
-                "time_unit": conditions_elem.findtext("reactionTime/unit", "").strip(),
-                "temperature": conditions_elem.findtext("reactionTemperature/amount", "").strip(),
-                "temperature_unit": conditions_elem.findtext("reactionTemperature/unit", "").strip(),
-                "temperature_start": conditions_elem.findtext("reactionTemperatureStart/amount", "").strip(),
-                "temperature_end": conditions_elem.findtext("reactionTemperatureEnd/amount", "").strip(),
-                "reflux": conditions_elem.findtext("reflux/amount", "").strip()
-            }
-        
-        yield_elem = root.find(".//yield")
-        if yield_elem is not None:
-            data["yield"] = {
-                "amount": yield_elem.findtext("amount", "").strip(),
-                "unit": yield_elem.findtext("unit", "").strip()
-            }
-        
-        participants_elem = root.find(".//participants")
-        if participants_elem is not None:
-            molecules = participants_elem.findall(".//molecule")
-            print(f"  Found {len(molecules)} molecules")
-            
-            for molecule in molecules:
-                role_elem = molecule.find("role")
-                if role_elem is None or not role_elem.text:
-                    continue
-                    
-                role = role_elem.text.strip().lower()
-                role_key = role.replace(" ", "_")
-                
-                if role not in all_roles:
-                    all_roles[role] = {
-                        "list": [],
-                        "primary_name": ""
-                    }
-                    data[f"{role_key}_details"] = []
-                    data[role] = ""
-                
-                name_elem = molecule.find("name")
-                smiles_elem = molecule.find("smiles")
-                inchi_key_elem = molecule.find("inchiKey")
-                ratio_elem = molecule.find("ratio")
-                
-                mol_info = {
-                    "name": name_elem.text.strip() if name_elem is not None and name_elem.text else "Unknown",
-                    "smiles": smiles_elem.text.strip() if smiles_elem is not None and smiles_elem.text else None,
-                    "inchiKey": inchi_key_elem.text.strip() if inchi_key_elem is not None and inchi_key_elem.text else None,
-                    "ratio": ratio_elem.text.strip() if ratio_elem is not None and ratio_elem.text else None,
-                    "role": role,
-                    "notes": None
-                }
-                
-                for child in molecule:
-                    if child.tag not in ["role", "name", "smiles", "inchiKey", "ratio"]:
-                        if child.text and child.text.strip():
-                            mol_info[child.tag] = child.text.strip()
-                        elif child.attrib:
-                            mol_info[f"{child.tag}_attrs"] = child.attrib
-                
-                data[f"{role_key}_details"].append(mol_info)
-                all_roles[role]["list"].append(mol_info)
-                
-                if mol_info["name"] != "Unknown" and not all_roles[role]["primary_name"]:
-                    all_roles[role]["primary_name"] = mol_info["name"]
-                    data[role] = mol_info["name"]
-                
-                print(f"    {role}: {mol_info['name']}")
-        
-        if not data["smiles"]:
-            reactant_roles = ["reactant", "building block", "starting material"]
-            agent_roles = ["solvent", "reagent", "oxidizing agent", "catalyst", "base", "quench", "additive"]
-            product_roles = ["product"]
-            
-            reactant_smiles = []
-            agent_smiles = []
-            product_smiles = []
-            
-            for role, role_data in all_roles.items():
-                for mol in role_data["list"]:
-                    if mol["smiles"]:
-                        if role in reactant_roles:
-                            reactant_smiles.append(mol["smiles"])
-                        elif role in product_roles:
-                            product_smiles.append(mol["smiles"])
-                        else:
-                            agent_smiles.append(mol["smiles"])
-            
-            if reactant_smiles or agent_smiles or product_smiles:
-                data["smiles"] = f"{'.'.join(reactant_smiles)}>{'.'.join(agent_smiles)}>{'.'.join(product_smiles)}"
-        
-        print(f"    Summary of roles found: {', '.join(all_roles.keys())}")
-        for role, role_data in all_roles.items():
-            print(f"      {role}: {len(role_data['list'])} items")
-        
-        return data
-        
-    except ET.ParseError as e:
-        print(f"!! XML Parse Error: {e}")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.http_cache import DEFAULT_TTL, HttpCache, CachedSession, format_stats
+from common.fetch_control import DEFAULT_RATE, DEFAULT_RETRIES, ControlledSession, format_host_stats
+from common.metrics import METRICS, LOG_LEVELS, configure_logging, format_summary, write_metrics, profiled
+from common.manifest import Manifest
+from common.manifest import format_stats as format_manifest_stats
+from crd_http import ARCHIVE_URL, USER_AGENT, NeedsBrowser, archive_sets, iter_set_pages
+from crd_fetch import DEFAULT_XML_WORKERS, ReactionFetcher
+from crd_journal import (DEFAULT_JOURNAL, ReactionJournal, write_reaction_json, merge_reaction_json,
+                         iter_journal, iter_journal_ordered, reaction_roles)
+from crd_db import write_reactions_db
+from crd_xml import parse_xml_data
+
+# The chromedriver path is remembered here so later runs skip the
+# webdriver_manager download/version check. Selenium and webdriver_manager
+# are only imported once a browser is needed.
+DRIVER_CACHE = os.environ.get("CRD_DRIVER_CACHE",
+                              os.path.join(os.path.expanduser("~"), ".cache", "crd_scraper", "chromedriver_path"))
+DRIVER_LOCK = threading.Lock()
+_driver_path = None
+
+OUTPUT_FORMATS = ["json", "sqlite"]
+DEFAULT_OUTPUTS = {"json": "reaction_data.json", "sqlite": "reactions.sqlite"}
+
+log = logging.getLogger("crd")
+
+def env_flag(name):
+    return os.environ.get(name, "") not in ["", "0"]
+
+def parse_set_spec(spec):
+    # "all", "2", "1-3", "5-" (5 to the last set), "-3" (1 to 3) or a comma
+    # separated mix such as "1-3,7,10-". Returns (first, last) pairs of
+    # 1-based set numbers; last is None when the range is open.
+    spec = spec.strip().lower()
+    if spec == "all":
+        return [(1, None)]
+    ranges = []
+    for part in spec.split(","):
+        part = part.strip()
+        first, dash, last = part.partition("-")
         try:
-            xml_content = xml_content.replace('<?xml version="1.0" encoding="UTF-8"?>', '')
-            xml_content = xml_content.strip()
-            
-            if '<reaction' in xml_content and '</reaction>' in xml_content:
-                start = xml_content.find('<reaction')
-                end = xml_content.find('</reaction>') + len('</reaction>')
-                xml_content = xml_content[start:end]
-                
-                return parse_xml_data(xml_content, source_url)
-        except:
-            pass
-        
-        return create_minimal_data(source_url)
-    
-    except Exception as e:
-        print(f"!! Failed to parse XML: {e}")
-        import traceback
-        traceback.print_exc()
-        return create_minimal_data(source_url)
-
-def create_minimal_data(source_url):
-    return {
-        "sequence_origin": source_url,
-        "details_url": source_url,
-        "smiles": "",
-        "reaction_conditions": {},
-        "yield": "",
-        "source": {}
-    }
+            if not part or part == "-":
+                raise ValueError
+            first = int(first) if first.strip() else 1
+            last = (int(last) if last.strip() else None) if dash else first
+        except ValueError:
+            raise ValueError(f"'{part}' is not a set number or range")
+        if first < 1 or (last is not None and last < first):
+            raise ValueError(f"'{part}' is not a valid range")
+        ranges.append((first, last))
+    return ranges
+
+def set_spec(text):
+    try:
+        return parse_set_spec(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def parse_args(argv=None):
+    # Settings that used to come only from CRD_* environment variables still
+    # take their defaults from them.
+    parser = argparse.ArgumentParser(description="Scrape reaction data sets from the CRD archive.")
+    parser.add_argument("--sets", type=set_spec, default=None, metavar="SPEC",
+                        help="Archive sets to scrape: all, 2, 1-3, 5- (5 to the last), 1,3,5 or a mix "
+                             "such as 1-3,7,10-. Asked for interactively when left out on a terminal.")
+    parser.add_argument("--max-pages", type=int, default=None, help="Listing pages read per set")
+    parser.add_argument("--max-reactions", type=int, default=None, help="Reactions taken per set")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only count the selected sets' pages and reactions; fetch no XML and write nothing")
+    parser.add_argument("--output", default=None, help="Output path (default per format: %s)" %
+                        ", ".join(f"{fmt}={path}" for fmt, path in DEFAULT_OUTPUTS.items()))
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="json",
+                        help="json writes reaction_data.json; sqlite loads the reactions into the shared "
+                             "reaction database (e.g. the reactions.sqlite the ORD scraper writes)")
+    parser.add_argument("--mode", choices=["http", "browser"], default=os.environ.get("CRD_CRAWL_MODE", "http"),
+                        help="http reads the archive, listing and profile pages directly and only opens Chrome "
+                             "for sets whose pages need JavaScript; browser always clicks through")
+    parser.add_argument("--headless", action="store_true", default=env_flag("CRD_HEADLESS"),
+                        help="Run Chrome without a window")
+    parser.add_argument("--browsers", type=int, default=os.environ.get("CRD_BROWSERS", "1"),
+                        help="Chrome instances for browser-mode crawls, each taking sets from a shared queue")
+    parser.add_argument("--workers", type=int, default=os.environ.get("CRD_XML_WORKERS", DEFAULT_XML_WORKERS),
+                        help="XML documents fetched and parsed at the same time")
+    parser.add_argument("--rate", type=float, default=os.environ.get("CRD_RATE", DEFAULT_RATE),
+                        help="Requests per second allowed to the CRD host (0 = no limit)")
+    parser.add_argument("--retries", type=int, default=os.environ.get("CRD_RETRIES", DEFAULT_RETRIES),
+                        help="Retries for connection errors, timeouts, 429 and 5xx responses")
+    parser.add_argument("--archive-url", default=ARCHIVE_URL)
+    parser.add_argument("--http-cache", default=os.environ.get("CRD_HTTP_CACHE"), metavar="DIR",
+                        help="Keep fetched pages and XML documents in DIR between runs")
+    parser.add_argument("--http-cache-ttl", type=float, default=os.environ.get("CRD_HTTP_CACHE_TTL", DEFAULT_TTL),
+                        help="Seconds before a cached page is fetched again")
+    parser.add_argument("--offline", action="store_true", default=env_flag("CRD_OFFLINE"),
+                        help="Only read from --http-cache")
+    parser.add_argument("--journal", default=os.environ.get("CRD_JOURNAL", DEFAULT_JOURNAL),
+                        help="Every parsed reaction is appended here as it arrives; an interrupted run leaves "
+                             "it behind and the next run skips what it already holds (default: %(default)s)")
+    parser.add_argument("--keep-journal", action="store_true", default=env_flag("CRD_KEEP_JOURNAL"),
+                        help="Keep the journal after a complete run")
+    parser.add_argument("--incremental", default=os.environ.get("CRD_INCREMENTAL"), metavar="FILE",
+                        help="Keep a manifest of scraped reactions and their XML hashes in FILE. Sets are listed "
+                             "newest first, so paging a set stops at the first page whose reactions were all added "
+                             "no later than the newest one seen before (known reactions are rechecked); only new or changed reactions are parsed and merged into "
+                             "the existing output")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default=os.environ.get("CRD_LOG_LEVEL", "info"),
+                        help="debug prints every reaction and molecule, warning only problems")
+    parser.add_argument("--metrics", default=os.environ.get("CRD_METRICS"), metavar="FILE",
+                        help="Write stage timings and counters here (.prom for Prometheus text, else JSON)")
+    parser.add_argument("--profile", default=os.environ.get("CRD_PROFILE"), metavar="FILE",
+                        help="Run under cProfile and dump the stats to FILE")
+    parser.add_argument("--trace-memory", action="store_true", default=env_flag("CRD_TRACE_MEMORY"),
+                        help="Track allocations with tracemalloc and print the top sites")
+    args = parser.parse_args(argv)
+
+    if args.output is None:
+        args.output = DEFAULT_OUTPUTS[args.output_format]
+    if args.sets is None and not sys.stdin.isatty():
+        parser.error("--sets is required when not run from a terminal")
+    return args
 
 def get_user_selection():
     print("How would you like to select reaction data?")
     print(" - Single: Enter a number (e.g., 2 for 2nd reaction)")
-    print(" - Range: Enter 'start-end' (e.g., 1-3 for reactions 1 to 3)")
+    print(" - Range: Enter 'start-end' (e.g., 1-3 for reactions 1 to 3, 5- for 5 to the last)")
     print(" - All: Enter 'all' to process all reactions")
     print(" - Multiple: Enter numbers separated by commas (e.g., 1,3,5)")
     
     while True:
-        user_input = input("\nEnter your selection: ").strip().lower()
-        
-        if user_input in ["all"] or user_input.isdigit() or "-" in user_input or "," in user_input:
-            return user_input
-        else:
-            print("Invalid input. Please try again.")
+        user_input = input("\nEnter your selection: ")
+        try:
+            return parse_set_spec(user_input)
+        except ValueError as e:
+            print(f"Invalid input ({e}). Please try again.")
+
+def get_reaction_indices(ranges, total_count):
+    indices = {}
+    for first, last in ranges:
+        last = total_count if last is None else last
+        if first > total_count or last > total_count:
+            print(f"Invalid selection. Set numbers must be between 1 and {total_count}")
+            return None
+        for n in range(first, last + 1):
+            indices[n - 1] = True
+    indices = list(indices)
+
+    if len(indices) == total_count:
+        print(f"✓ Selected all {total_count} sets")
+    else:
+        print(f"✓ Selected sets: {', '.join([str(i+1) for i in indices])}")
+    return indices
+
+
+def open_xml_session(args):
+    session = requests.Session()
+    session.headers['User-Agent'] = USER_AGENT
+    pool_size = args.workers * max(args.browsers, 1)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session = ControlledSession(session, rate=args.rate, max_concurrency=pool_size, retries=args.retries)
+    if args.http_cache:
+        session = CachedSession(session, HttpCache(args.http_cache, ttl=args.http_cache_ttl, offline=args.offline))
+    elif args.offline:
+        print("--offline needs --http-cache; fetching XML from the network.")
+    return session
+
+def chromedriver_path(refresh=False):
+    global _driver_path
+    with DRIVER_LOCK:
+        if not refresh and _driver_path is not None:
+            return _driver_path
+        if not refresh and os.path.exists(DRIVER_CACHE):
+            with open(DRIVER_CACHE, encoding="utf-8") as f:
+                path = f.read().strip()
+            if os.path.isfile(path):
+                _driver_path = path
+                return path
+
+        from webdriver_manager.chrome import ChromeDriverManager
+        path = ChromeDriverManager().install()
+        os.makedirs(os.path.dirname(DRIVER_CACHE), exist_ok=True)
+        with open(DRIVER_CACHE, "w", encoding="utf-8") as f:
+            f.write(path)
+        _driver_path = path
+        return path
+
+def open_browser(headless=False, archive_url=ARCHIVE_URL):
+    from selenium import webdriver
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import SessionNotCreatedException
+    print("\nOpening website to fetch reaction data list...")
+    if not headless:
+        print("(Browser window will open now...)\n")
+
+    options = webdriver.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+        options.add_argument("--window-size=1920,1080")
+    else:
+        options.add_argument("--start-maximized")
+
+    try:
+        driver = webdriver.Chrome(service=Service(chromedriver_path()), options=options)
+    except SessionNotCreatedException:
+        # The cached driver no longer matches the installed Chrome.
+        driver = webdriver.Chrome(service=Service(chromedriver_path(refresh=True)), options=options)
+    driver.get(archive_url)
+    wait = WebDriverWait(driver, 10)
+    wait_until(wait, EC.presence_of_element_located((By.PARTIAL_LINK_TEXT, "reaction data")))
+    return driver, wait
+
+def wait_until(wait, condition):
+    with METRICS.timer("browser_wait"):
+        return wait.until(condition)
+
+def pause(seconds):
+    with METRICS.timer("browser_wait"):
+        time.sleep(seconds)
+
+def print_extracted(parsed_json):
+    roles_present = [k for k in parsed_json.keys() 
+                     if k.endswith('_details') or 
+                     (k not in ['sequence_origin', 'details_url', 'smiles', 
+                                'reaction_conditions', 'yield', 'source'] and 
+                      not k.endswith('_details'))]
+    summary = []
+    for role in roles_present:
+        if role.endswith('_details'):
+            role_name = role.replace('_details', '')
+            if role_name in parsed_json and parsed_json[role_name]:
+                summary.append(f"{role_name}: {parsed_json[role_name]}")
+        elif parsed_json.get(role):
+            summary.append(f"{role}: {parsed_json[role]}")
+    
+    if summary:
+        log.debug(f"      ✓ Extracted: {' | '.join(summary)}")
+    else:
+        log.debug("      ✓ Extracted (no named compounds)")
+
+def store_reactions(results, journal, manifest=None, group=None, order=None):
+    for details_url, xml_url, parsed_json, digest, error in results:
+        if isinstance(error, NeedsBrowser):
+            raise error
+        if error is not None:
+            log.warning(f"    Reaction {details_url}")
+            log.warning(f"      X Error processing XML: {error}")
+            continue
+        log.debug(f"    Reaction {details_url}")
+        log.debug(f"      Fetched XML from: {xml_url}")
+        if manifest is not None and manifest.check(details_url, digest) == "unchanged":
+            log.debug("      Unchanged since the last run")
             continue
+        if not parsed_json:
+            continue
+
+        with METRICS.timer("write"):
+            journal.append(parsed_json, order)
+        if manifest is not None:
+            source = parsed_json.get("source") if isinstance(parsed_json.get("source"), dict) else {}
+            manifest.record(details_url, group, digest, xml_url=xml_url, date_added=source.get("date_added"))
+        if log.isEnabledFor(logging.DEBUG):
+            print_extracted(parsed_json)
 
-def get_reaction_indices(user_input, total_count):
+def submit_reaction(fetcher, details_url, xml_url, manifest):
+    # Known reactions are fetched again with their last hash (and XML link)
+    # so an unchanged document is not parsed. Returns the results ready so far
+    # and whether the reaction was known.
+    entry = manifest.entry(details_url) if manifest is not None else None
+    if entry is None:
+        return fetcher.submit(details_url, xml_url), False
+    known_hash, info = entry
+    return fetcher.submit(details_url, xml_url or info.get("xml_url"), known_hash), True
+
+def reached_older(page_urls, known_urls, manifest, newest):
+    # Whether paging a newest-first set can stop at this page: every reaction
+    # on it was added no later than `newest`, the newest date_added the
+    # manifest held for the set. Without stored dates the whole page has to
+    # be known from earlier runs. Call once the page's reactions are stored.
+    if not known_urls:
+        return False
+    if newest is None:
+        return len(known_urls) == len(page_urls)
+    for url in page_urls:
+        entry = manifest.entry(url)
+        date = entry[1].get("date_added") if entry else None
+        if not date or date > newest:
+            return False
+    return True
+
+def scrape_set_http(xml_session, set_url, journal, args, manifest=None, group=None):
+    # Walks the set listing pages without a browser and hands each profile page
+    # to the fetch pool, which resolves its XML link, downloads and parses it.
+    # Raises NeedsBrowser when a page only works with JavaScript.
+    taken = 0
+    newest = manifest.newest(group, "date_added") if manifest is not None else None
+    with ReactionFetcher(xml_session, parse_xml_data, args.workers) as fetcher:
+        for page_num, page_url, profile_urls in iter_set_pages(xml_session, set_url, args.max_pages):
+            if not profile_urls:
+                log.info(f"  No Details buttons found on page {page_num}")
+                break
+
+            METRICS.count("pages")
+            log.info(f"  Page {page_num}: Found {len(profile_urls)} reactions. Queueing...")
+
+            if args.max_reactions:
+                profile_urls = profile_urls[:args.max_reactions - taken]
+            known_urls = []
+            for profile_url in profile_urls:
+                if profile_url not in journal:
+                    results, known = submit_reaction(fetcher, profile_url, None, manifest)
+                    if known:
+                        known_urls.append(profile_url)
+                    store_reactions(results, journal, manifest, group)
+            taken += len(profile_urls)
+            if args.max_reactions and taken >= args.max_reactions:
+                log.info(f"  > Took {taken} reactions from this set (--max-reactions).")
+                break
+            if known_urls:
+                # The page's dates are only known once its reactions are in.
+                store_reactions(fetcher.finish(), journal, manifest, group)
+                if reached_older(profile_urls, known_urls, manifest, newest):
+                    log.info("  > Reached reactions from the last run; the rest of this set is older.")
+                    break
+
+        store_reactions(fetcher.finish(), journal, manifest, group)
+
+    log.info("  > End of pages for this set.")
+
+def scrape_set_browser(driver, wait, i, total_count, xml_session, journal, args, manifest=None, order=None):
+    group = {}
+    with ReactionFetcher(xml_session, parse_xml_data, args.workers) as fetcher:
+        try:
+            found = harvest_set_browser(driver, wait, i, total_count, xml_session, fetcher, journal, args,
+                                        manifest, group, order)
+        finally:
+            store_reactions(fetcher.finish(), journal, manifest, group.get("name"), order)
+    return found
+
+def return_to_archive(driver, wait, archive_url=ARCHIVE_URL):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
     try:
-        indices = []
-        
-        if user_input == "all":
-            indices = list(range(total_count))
-            print(f"✓ Selected all {total_count} reactions")
+        driver.get(archive_url)
+        wait_until(wait, EC.presence_of_element_located((By.PARTIAL_LINK_TEXT, "reaction data")))
+    except:
+        pass
+
+def harvest_set_browser(driver, wait, i, total_count, xml_session, fetcher, journal, args, manifest=None, group=None,
+                        order=None):
+    # Clicks through the set collecting XML links; the fetch pool downloads
+    # and parses them while the browser moves on. The set's name is left in
+    # group["name"] for the caller.
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import NoSuchElementException
+    current_links = driver.find_elements(By.PARTIAL_LINK_TEXT, "reaction data")
+    if i >= len(current_links):
+        return False
+    
+    target_link = current_links[i]
+    set_text = target_link.text
+    if group is not None:
+        group["name"] = set_text
+    log.info(f"\n=== SET {i+1}/{total_count}: {set_text} ===")
+    
+    driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", target_link)
+    target_link.click()
+    
+    wait_until(wait, EC.presence_of_element_located((By.TAG_NAME, "body")))
+    main_window_handle = driver.current_window_handle
+
+    page_num = 1
+    taken = 0
+    newest = manifest.newest(set_text, "date_added") if manifest is not None else None
+    while True:
+        details_btns = driver.find_elements(By.LINK_TEXT, "Details")
+        if not details_btns:
+            log.info(f"  No Details buttons found on page {page_num}")
+            break
         
-        elif "-" in user_input:
-            parts = user_input.split("-")
-            if len(parts) != 2:
-                print("Invalid range format. Use 'start-end' (e.g., 1-3)")
-                return None
-            
+        METRICS.count("pages")
+        log.info(f"  Page {page_num}: Found {len(details_btns)} reactions. Scanning...")
+
+        if args.max_reactions:
+            details_btns = details_btns[:args.max_reactions - taken]
+        taken += len(details_btns)
+        page_urls = []
+        known_urls = []
+        for j, btn in enumerate(details_btns):
             try:
-                start = int(parts[0].strip()) - 1
-                end = int(parts[1].strip())
+                log.debug(f"    Reaction {j+1}/{len(details_btns)}")
                 
-                if start < 0 or end > total_count or start >= end:
-                    print(f"Invalid range. Please enter numbers between 1 and {total_count}")
-                    return None
+                driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", btn)
+                btn.click()
                 
-                indices = list(range(start, end))
-                print(f"✓ Selected reactions {start+1} to {end}")
-            
-            except ValueError:
-                print("Invalid input. Range must be numbers (e.g., 1-3)")
-                return None
-        
-        elif "," in user_input:
-            try:
-                numbers = [int(x.strip()) for x in user_input.split(",")]
-                indices = [n - 1 for n in numbers if 1 <= n <= total_count]
+                wait_until(WebDriverWait(driver, 5), EC.number_of_windows_to_be(2))
+                driver.switch_to.window(driver.window_handles[-1])
                 
-                if not indices:
-                    print(f"No valid numbers. Please enter numbers between 1 and {total_count}")
-                    return None
+                pause(1.5)
                 
-                print(f"✓ Selected reactions: {', '.join([str(i+1) for i in indices])}")
-            
-            except ValueError:
-                print("Invalid input. Enter numbers separated by commas (e.g., 1,3,5)")
-                return None
+                try:
+                    xml_element = wait_until(
+                        WebDriverWait(driver, 5), EC.presence_of_element_located((By.LINK_TEXT, "XML"))
+                    )
+                    xml_url = xml_element.get_attribute("href")
+                    current_url = driver.current_url
+                    page_urls.append(current_url)
+                    if current_url in journal:
+                        continue
+
+                    for cookie in driver.get_cookies():
+                        xml_session.cookies.set(cookie['name'], cookie['value'])
+                    
+                    results, known = submit_reaction(fetcher, current_url, xml_url, manifest)
+                    if known:
+                        known_urls.append(current_url)
+                    store_reactions(results, journal, manifest, set_text, order)
+
+                except Exception as e:
+                    METRICS.count("errors")
+                    log.warning(f"      X Error processing XML: {e}")
+
+            finally:
+                if len(driver.window_handles) > 1:
+                    driver.close()
+                driver.switch_to.window(main_window_handle)
+                pause(0.5)
         
-        else:
+        if args.max_reactions and taken >= args.max_reactions:
+            log.info(f"  > Took {taken} reactions from this set (--max-reactions).")
+            break
+        if args.max_pages and page_num >= args.max_pages:
+            break
+        if known_urls:
+            store_reactions(fetcher.finish(), journal, manifest, set_text, order)
+            if reached_older(page_urls, known_urls, manifest, newest):
+                log.info("  > Reached reactions from the last run; the rest of this set is older.")
+                break
+        try:
+            next_btn = driver.find_element(By.LINK_TEXT, "Next")
+            log.info("  Moving to next page...")
+            driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", next_btn)
+            next_btn.click()
+            pause(2)
+            page_num += 1
+        except NoSuchElementException:
+            log.info("  > End of pages for this set.")
+            break
+
+    log.info("  Returning to archive...")
+    driver.get(args.archive_url)
+    wait_until(wait, EC.presence_of_element_located((By.PARTIAL_LINK_TEXT, "reaction data")))
+    pause(1)
+    return True
+
+def scrape_sets_in_browsers(selected_indices, total_count, xml_session, journal, args, browser=None, manifest=None):
+    # Each worker thread drives its own Chrome and takes set indices from a
+    # shared queue; all of them append to the same journal, tagging records
+    # with their set's rank so the output follows the selection order.
+    rank = {i: n for n, i in enumerate(selected_indices)}
+    tasks = queue.Queue()
+    for i in selected_indices:
+        tasks.put(i)
+    finished = queue.Queue()
+    failed = set()
+
+    def worker(browser):
+        driver = None
+        try:
+            driver, wait = browser or open_browser(args.headless, args.archive_url)
+            while True:
+                try:
+                    i = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    if not scrape_set_browser(driver, wait, i, total_count, xml_session, journal, args, manifest,
+                                              rank[i]):
+                        log.warning(f"Set {i+1} not found on the archive page")
+                        failed.add(i)
+                except Exception as e:
+                    log.warning(f"Error in set {i+1}: {e}")
+                    failed.add(i)
+                    return_to_archive(driver, wait, args.archive_url)
+                finished.put(i)
+        except Exception as e:
+            log.warning(f"Browser worker failed: {e}")
+        finally:
+            if driver is not None:
+                driver.quit()
+            finished.put(None)
+
+    count = max(1, min(args.browsers, len(selected_indices)))
+    print(f"Scraping {len(selected_indices)} sets with {count} browsers...")
+    threads = []
+    for n in range(count):
+        thread = threading.Thread(target=worker, args=(browser if n == 0 else None,), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    done = set()
+    running = len(threads)
+    while running:
+        i = finished.get()
+        if i is None:
+            running -= 1
+            continue
+        done.add(i)
+        log.info(f"=== SET {i+1}/{total_count} done ({len(done)}/{len(selected_indices)} sets, {journal.count} reactions) ===")
+    for thread in threads:
+        thread.join()
+
+    # Returns how many sets were scraped and whether every one was.
+    missing = [i + 1 for i in selected_indices if i not in done or i in failed]
+    if missing:
+        print(f"Sets not scraped: {', '.join(map(str, missing))}")
+    return len(selected_indices) - len(missing), not missing
+
+def read_archive(xml_session, args):
+    # (set_links, driver, wait, total_count); set_links is None when the
+    # archive is read in the browser.
+    set_links = None
+    driver = wait = None
+    if args.mode == "http":
+        print("\nFetching reaction data list over HTTP...")
+        try:
+            set_links = archive_sets(xml_session, args.archive_url) or None
+        except Exception as e:
+            print(f"Could not read the archive over HTTP: {e}")
+        if set_links is None:
+            print("Falling back to the browser.")
+
+    if set_links is None:
+        from selenium.webdriver.common.by import By
+        driver, wait = open_browser(args.headless, args.archive_url)
+        total_count = len(driver.find_elements(By.PARTIAL_LINK_TEXT, "reaction data"))
+    else:
+        total_count = len(set_links)
+    print(f"\nFound {total_count} reaction data sets available.")
+    return set_links, driver, wait, total_count
+
+def count_set_http(xml_session, set_url, args):
+    pages = 0
+    profile_urls = []
+    for page_num, page_url, found in iter_set_pages(xml_session, set_url, args.max_pages):
+        if not found:
+            break
+        pages += 1
+        profile_urls.extend(found)
+        if args.max_reactions and len(profile_urls) >= args.max_reactions:
+            profile_urls = profile_urls[:args.max_reactions]
+            break
+    return pages, profile_urls
+
+def count_set_browser(driver, wait, i, args):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.common.exceptions import NoSuchElementException
+    links = driver.find_elements(By.PARTIAL_LINK_TEXT, "reaction data")
+    if i >= len(links):
+        return None, 0, 0
+    set_text = links[i].text
+    driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", links[i])
+    links[i].click()
+    wait_until(wait, EC.presence_of_element_located((By.TAG_NAME, "body")))
+
+    pages = reactions = 0
+    while True:
+        found = len(driver.find_elements(By.LINK_TEXT, "Details"))
+        if not found:
+            break
+        pages += 1
+        reactions += found
+        if (args.max_pages and pages >= args.max_pages) or (args.max_reactions and reactions >= args.max_reactions):
+            break
+        try:
+            next_btn = driver.find_element(By.LINK_TEXT, "Next")
+        except NoSuchElementException:
+            break
+        driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", next_btn)
+        next_btn.click()
+        pause(2)
+
+    return_to_archive(driver, wait, args.archive_url)
+    if args.max_reactions:
+        reactions = min(reactions, args.max_reactions)
+    return set_text, pages, reactions
+
+def count_sets(args):
+    # --dry-run: reads the archive and the selected sets' listing pages and
+    # counts their reactions without fetching any XML or writing anything.
+    # Sets that need the browser are counted there, without telling which
+    # reactions the journal already holds.
+    known = {record.get("details_url") for record in iter_journal(args.journal)}
+    manifest = Manifest(args.incremental) if args.incremental else None
+    xml_session = open_xml_session(args)
+    driver = None
+    try:
+        set_links, driver, wait, total_count = read_archive(xml_session, args)
+        selected_indices = get_reaction_indices(args.sets or get_user_selection(), total_count)
+        if selected_indices is None:
+            print("Invalid selection. Exiting...")
+            sys.exit(2)
+
+        counted = total_pages = total_reactions = total_new = 0
+        for i in selected_indices:
+            new = None
             try:
-                num = int(user_input)
-                if 1 <= num <= total_count:
-                    indices = [num - 1]
-                    print(f"✓ Selected reaction #{num}")
-                else:
-                    print(f"Invalid number. Please enter a number between 1 and {total_count}")
-                    return None
-            
-            except ValueError:
-                print("Invalid input. Please enter a valid selection.")
-                return None
-        
-        return indices
-        
-    except Exception as e:
-        print(f"Error processing input: {e}")
-        return None
+                if set_links is not None:
+                    set_text, set_url = set_links[i]
+                    try:
+                        pages, profile_urls = count_set_http(xml_session, set_url, args)
+                        reactions = len(profile_urls)
+                        new = sum(1 for url in profile_urls
+                                  if url not in known and (manifest is None or url not in manifest))
+                    except NeedsBrowser:
+                        if driver is None:
+                            driver, wait = open_browser(args.headless, args.archive_url)
+                if new is None:
+                    set_text, pages, reactions = count_set_browser(driver, wait, i, args)
+            except Exception as e:
+                log.warning(f"Error counting set {i+1}: {e}")
+                continue
+            counted += 1
+            total_pages += pages
+            total_reactions += reactions
+            total_new += reactions if new is None else new
+            new_text = "not checked against the journal" if new is None else f"{new} new"
+            print(f"  SET {i+1}/{total_count}: {set_text}: {pages} pages, {reactions} reactions ({new_text})")
 
+        print(f"\nDry run: {counted} of {len(selected_indices)} sets counted, {total_pages} pages, {total_reactions} reactions, "
+              f"about {total_new} to fetch.")
+        return counted
+    finally:
+        xml_session.close()
+        if driver is not None:
+            driver.quit()
+        if manifest is not None:
+            manifest.close()
 
-def run_scraper():
+def run_scraper(args):
+    # Returns the number of sets scraped.
     print(f"\n{'='*60}")
     print(f"                            CRD SCRAPER ")
     print(f"Developed by: BARRAL, Jacinth Cedric & LAROCO, Jan Lorenz")
     print(f"{'='*60}")
     
-    user_selection = get_user_selection()
+    user_selection = args.sets or get_user_selection()
     
-    print("\nOpening website to fetch reaction data list...")
-    print("(Browser window will open now...)\n")
-    
-    options = webdriver.ChromeOptions()
-    options.add_argument("--start-maximized")
-    
-    all_reaction_data = []
-
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-    main_archive_url = "https://kmt.vander-lingen.nl/archive"
+    journal_existed = os.path.exists(args.journal)
+    journal = ReactionJournal(args.journal)
+    if journal.resumed:
+        print(f"Resuming from {args.journal}: {journal.resumed} reactions already scraped will be skipped.")
+    manifest = None
+    if args.incremental:
+        # The journal then only collects new and changed reactions, which
+        # are merged into the existing output at the end.
+        manifest = Manifest(args.incremental)
+        print(f"Incremental: {len(manifest)} reactions known from earlier runs.")
+    completed = False
+    scraped = 0
+    xml_session = open_xml_session(args)
+    driver = None
 
     try:
-        driver.get(main_archive_url)
-        wait = WebDriverWait(driver, 10)
-        wait.until(EC.presence_of_element_located((By.PARTIAL_LINK_TEXT, "reaction data")))
-
-        initial_links = driver.find_elements(By.PARTIAL_LINK_TEXT, "reaction data")
-        total_count = len(initial_links)
-        
-        print(f"\nFound {total_count} reaction data sets available.")
+        set_links, driver, wait, total_count = read_archive(xml_session, args)
         
         selected_indices = get_reaction_indices(user_selection, total_count)
         
         if selected_indices is None:
             print("Invalid selection. Exiting...")
-            driver.quit()
-            return
+            sys.exit(2)
         
         print("\nStarting scrape process...")
 
+        if set_links is None and args.browsers > 1:
+            browser = (driver, wait)
+            driver = None
+            scraped, completed = scrape_sets_in_browsers(selected_indices, total_count, xml_session, journal, args,
+                                                         browser, manifest)
+            return scraped
+
         for i in selected_indices:
+            if set_links is not None:
+                set_text, set_url = set_links[i]
+                log.info(f"\n=== SET {i+1}/{total_count}: {set_text} ===")
+                try:
+                    scrape_set_http(xml_session, set_url, journal, args, manifest, set_text)
+                    scraped += 1
+                    continue
+                except NeedsBrowser as e:
+                    log.info(f"  {e}; using the browser for this set.")
+                except Exception as e:
+                    log.warning(f"Error in main loop: {e}")
+                    continue
+                if driver is None:
+                    driver, wait = open_browser(args.headless, args.archive_url)
+
             try:
-                current_links = driver.find_elements(By.PARTIAL_LINK_TEXT, "reaction data")
-                if i >= len(current_links):
+                if not scrape_set_browser(driver, wait, i, total_count, xml_session, journal, args, manifest):
                     break
-                
-                target_link = current_links[i]
-                print(f"\n=== SET {i+1}/{total_count}: {target_link.text} ===")
-                
-                driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", target_link)
-                target_link.click()
-                
-                wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-                main_window_handle = driver.current_window_handle
-
-                page_num = 1
-                while True:
-                    details_btns = driver.find_elements(By.LINK_TEXT, "Details")
-                    if not details_btns:
-                        print(f"  No Details buttons found on page {page_num}")
-                        break
-                    
-                    print(f"  Page {page_num}: Found {len(details_btns)} reactions. Scanning...")
-
-                    for j, btn in enumerate(details_btns):
-                        try:
-                            print(f"    Reaction {j+1}/{len(details_btns)}")
-                            
-                            driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", btn)
-                            btn.click()
-                            
-                            WebDriverWait(driver, 5).until(EC.number_of_windows_to_be(2))
-                            driver.switch_to.window(driver.window_handles[-1])
-                            
-                            time.sleep(1.5)
-                            
-                            try:
-                                xml_element = WebDriverWait(driver, 5).until(
-                                    EC.presence_of_element_located((By.LINK_TEXT, "XML"))
-                                )
-                                xml_url = xml_element.get_attribute("href")
-                                current_url = driver.current_url
-                                
-                                print(f"      Fetching XML from: {xml_url}")
-
-                                cookies = driver.get_cookies()
-                                session = requests.Session()
-                                for cookie in cookies:
-                                    session.cookies.set(cookie['name'], cookie['value'])
-                                
-                                headers = {
-                                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                                }
-                                response = session.get(xml_url, headers=headers, timeout=10)
-                                
-                                if response.status_code == 200:
-                                    parsed_json = parse_xml_data(response.text, current_url)
-                                    if parsed_json:
-                                        all_reaction_data.append(parsed_json)
-                                        
-                                        roles_present = [k for k in parsed_json.keys() 
-                                                         if k.endswith('_details') or 
-                                                         (k not in ['sequence_origin', 'details_url', 'smiles', 
-                                                                    'reaction_conditions', 'yield', 'source'] and 
-                                                          not k.endswith('_details'))]
-                                        summary = []
-                                        for role in roles_present:
-                                            if role.endswith('_details'):
-                                                role_name = role.replace('_details', '')
-                                                if role_name in parsed_json and parsed_json[role_name]:
-                                                    summary.append(f"{role_name}: {parsed_json[role_name]}")
-                                            elif parsed_json.get(role):
-                                                summary.append(f"{role}: {parsed_json[role]}")
-                                        
-                                        if summary:
-                                            print(f"      ✓ Extracted: {' | '.join(summary)}")
-                                        else:
-                                            print(f"      ✓ Extracted (no named compounds)")
-                                            
-                                        if len(all_reaction_data) % 5 == 0:
-                                            with open("reaction_data_intermediate.json", "w", encoding="utf-8") as f:
-                                                json.dump(all_reaction_data, f, indent=4)
-                                            print(f"      (Auto-saved {len(all_reaction_data)} reactions)")
-                                else:
-                                    print(f"      X Failed to fetch XML: Status {response.status_code}")
-
-                            except Exception as e:
-                                print(f"      X Error processing XML: {e}")
-
-                        finally:
-                            if len(driver.window_handles) > 1:
-                                driver.close()
-                            driver.switch_to.window(main_window_handle)
-                            time.sleep(0.5)
-                    
-                    try:
-                        next_btn = driver.find_element(By.LINK_TEXT, "Next")
-                        print(f"  Moving to next page...")
-                        driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", next_btn)
-                        next_btn.click()
-                        time.sleep(2)
-                        page_num += 1
-                    except NoSuchElementException:
-                        print("  > End of pages for this set.")
-                        break
-
-                print(f"  Returning to archive...")
-                driver.get(main_archive_url)
-                wait.until(EC.presence_of_element_located((By.PARTIAL_LINK_TEXT, "reaction data")))
-                time.sleep(1)
-
+                scraped += 1
             except Exception as e:
-                print(f"Error in main loop: {e}")
-                try:
-                    driver.get(main_archive_url)
-                    wait.until(EC.presence_of_element_located((By.PARTIAL_LINK_TEXT, "reaction data")))
-                except:
-                    pass
+                log.warning(f"Error in main loop: {e}")
+                return_to_archive(driver, wait, args.archive_url)
                 continue
 
+        completed = True
+        return scraped
+
     finally:
-        print(f"\nScraping Complete. Saving {len(all_reaction_data)} reactions to 'reaction_data.json'...")
-        with open("reaction_data.json", "w", encoding="utf-8") as f:
-            json.dump(all_reaction_data, f, indent=4, ensure_ascii=False)
-        
-        print(f"\n=== ANALYSIS OF ROLES FOUND ===")
+        journal.close()
         all_unique_roles = set()
-        for reaction in all_reaction_data:
-            for key in reaction:
-                if key.endswith('_details'):
-                    all_unique_roles.add(key.replace('_details', ''))
+        if journal.count:
+            print(f"\nScraping Complete. Saving {journal.count} reactions to '{args.output}'...")
+            with METRICS.timer("write"):
+                if args.output_format == "sqlite":
+                    write_reactions_db(iter_journal_ordered(args.journal), args.output)
+                    all_unique_roles = reaction_roles(iter_journal(args.journal))
+                elif manifest is not None:
+                    _, all_unique_roles = merge_reaction_json(args.journal, args.output)
+                else:
+                    _, all_unique_roles = write_reaction_json(args.journal, args.output)
+        else:
+            # Nothing scraped (e.g. a selection that matched no sets): the
+            # last crawl's output is left as it was.
+            print(f"\nNo reactions scraped; '{args.output}' left unchanged.")
+        if manifest is not None:
+            # Only now does the output hold what the manifest records.
+            manifest.save()
+            print(f"Incremental: {format_manifest_stats(manifest.stats)}")
+            manifest.close()
+        if journal.count == 0 and not journal_existed:
+            os.remove(args.journal)
+        elif completed and journal.count and not args.keep_journal:
+            os.remove(args.journal)
+        else:
+            print(f"Journal kept at {args.journal}; rerun to resume.")
         
+        print(f"\n=== ANALYSIS OF ROLES FOUND ===")
         print(f"Total unique roles found: {len(all_unique_roles)}")
         print(f"Roles: {', '.join(sorted(all_unique_roles))}")
         
-        driver.quit()
+        if isinstance(xml_session, CachedSession):
+            print(f"HTTP cache: {format_stats(xml_session.cache.stats)}")
+        if xml_session.hosts:
+            print("Fetch stats:")
+            print(format_host_stats(xml_session.hosts))
+        xml_session.close()
+        if driver is not None:
+            driver.quit()
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_logging(args.log_level)
+    try:
+        with profiled(args.profile, args.trace_memory):
+            if args.dry_run:
+                done = count_sets(args)
+            else:
+                done = run_scraper(args)
+            if not done:
+                print("None of the selected sets could be read.")
+                sys.exit(1)
+    finally:
+        snapshot = METRICS.snapshot()
+        print(format_summary(snapshot))
+        if args.metrics:
+            write_metrics(args.metrics, snapshot, "crd_scraper")
 
 if __name__ == "__main__":
-    run_scraper()
+    main()
@@ -0,0 +1,256 @@
+import os
+import sys
+import json
+import time
+import base64
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+from ord_schema.proto import reaction_pb2
+from rdkit import Chem, RDLogger
+from google.protobuf.json_format import MessageToDict
+
+import scrape_ord
+from ord_output import open_writer
+
+DEFAULT_ROLES = "REACTANT=0.45,REAGENT=0.2,SOLVENT=0.2,CATALYST=0.15"
+DEFAULT_KEYS = "Amine=0.15,Aryl halide=0.15,Base=0.15,Solvent=0.15,Catalyst=0.1,Ligand=0.1,Additive=0.05,m1_m2=0.1,other=0.05"
+
+# Building blocks for synthetic SMILES; combining them gives as many distinct
+# (valid) molecules as --unique-smiles asks for.
+CORES = ["c1ccccc1", "c1ccncc1", "C1CCCCC1", "c1ccc2ccccc2c1", "C1CCOC1", "c1ccsc1"]
+GROUPS = ["N", "NC", "Br", "Cl", "I", "F", "C(=O)O", "O", "OC", "C(=O)N", "C#N", "CC", "C(C)(C)C", ""]
+SPECIALS = [
+    "C(=O)([O-])[O-].[Cs+].[Cs+]", "CC(C)(C)[O-].[Na+]", "[Pd]", "Cl[Pd]Cl", "[Cu]I", "O=C([O-])[O-].[K+].[K+]",
+    "c1ccc(P(c2ccccc2)c2ccccc2)cc1", "CN(C)C=O", "ClCCl", "CCN(CC)CC", "CS(C)=O", "Cc1ccccc1",
+]
+ROLE_NAMES = {
+    "REACTANT": reaction_pb2.ReactionRole.REACTANT,
+    "REAGENT": reaction_pb2.ReactionRole.REAGENT,
+    "SOLVENT": reaction_pb2.ReactionRole.SOLVENT,
+    "CATALYST": reaction_pb2.ReactionRole.CATALYST,
+    "WORKUP": reaction_pb2.ReactionRole.WORKUP,
+    "PRODUCT": reaction_pb2.ReactionRole.PRODUCT,
+}
+
+
+def parse_weights(text):
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return list(weights), list(weights.values())
+
+
+def smiles_pool(size, rng):
+    pool = list(SPECIALS)
+    seen = set(pool)
+    attempts = 0
+    while len(pool) < size and attempts < size * 50:
+        attempts += 1
+        core = rng.choice(CORES)
+        a, b = rng.choice(GROUPS), rng.choice(GROUPS)
+        chain = "C" * rng.randint(0, 6)
+        smiles = f"{a}{chain}{core}{b}" if a else f"{chain}{core}{b}"
+        if smiles in seen or Chem.MolFromSmiles(smiles) is None:
+            continue
+        seen.add(smiles)
+        pool.append(smiles)
+    return pool[:size]
+
+
+def make_reactions(count, components, unique_smiles, roles, keys, seed):
+    rng = random.Random(seed)
+    pool = smiles_pool(unique_smiles, rng)
+    role_names, role_weights = roles
+    key_names, key_weights = keys
+    reactions = []
+    for i in range(count):
+        reaction = reaction_pb2.Reaction()
+        reaction.reaction_id = f"ord-bench{i:08d}"
+        for j in range(components):
+            key = rng.choices(key_names, key_weights)[0]
+            component = reaction.inputs[key if j == 0 else f"{key}_{j}"].components.add()
+            component.reaction_role = ROLE_NAMES[rng.choices(role_names, role_weights)[0]]
+            identifier = component.identifiers.add()
+            if rng.random() < 0.05:
+                identifier.type = reaction_pb2.CompoundIdentifier.NAME
+                identifier.value = f"compound {rng.randint(0, 999)}"
+            else:
+                identifier.type = reaction_pb2.CompoundIdentifier.SMILES
+                identifier.value = rng.choice(pool)
+        reactions.append(reaction)
+    return reactions, len(pool)
+
+
+def timed(repeat, fn):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_stages(payloads, repeat, cache_size):
+    stages = {}
+
+    seconds, proto_bytes = timed(repeat, lambda: [base64.b64decode(p) for _, p in payloads])
+    stages["base64_decode"] = seconds
+
+    seconds, reactions = timed(repeat, lambda: [reaction_pb2.Reaction.FromString(b) for b in proto_bytes])
+    stages["proto_parse"] = seconds
+
+    components = []
+    for reaction in reactions:
+        for input_key, input_val in reaction.inputs.items():
+            for component in input_val.components:
+                components.append((input_key, component))
+
+    def to_dicts():
+        return [MessageToDict(c, preserving_proto_field_name=True, use_integers_for_enums=False)
+                for _, c in components]
+    stages["message_to_dict"], _ = timed(repeat, to_dicts)
+
+    smiles = [scrape_ord.get_smiles(c) for _, c in components]
+    stages["get_smiles"], _ = timed(repeat, lambda: [scrape_ord.get_smiles(c) for _, c in components])
+
+    seconds, mols = timed(repeat, lambda: [Chem.MolFromSmiles(s) if s else None for s in smiles])
+    stages["rdkit_parse"] = seconds
+
+    stages["is_metal"], _ = timed(repeat, lambda: [scrape_ord.is_metal(m) for m in mols])
+
+    patterns = [scrape_ord.AMINE_SMARTS, scrape_ord.ARYL_HALIDE_SMARTS, scrape_ord.CARBOXYLIC_ACID_SMARTS]
+    stages["smarts_match"], _ = timed(
+        repeat, lambda: [[m.HasSubstructMatch(p) for p in patterns] for m in mols if m])
+
+    def classify(size):
+        def run():
+            scrape_ord.configure_cache(size)
+            return [scrape_ord.classify_component(c, c.reaction_role, k) for k, c in components]
+        return run
+    stages["classify_uncached"], _ = timed(repeat, classify(0))
+    stages["classify_cached"], _ = timed(repeat, classify(cache_size))
+
+    def pipeline():
+        scrape_ord.configure_cache(cache_size)
+        return scrape_ord.classify_payloads(payloads)
+    seconds, (rows, errors) = timed(repeat, pipeline)
+    stages["pipeline"] = seconds
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_ord_")
+    try:
+        def write(output_format, name):
+            def run():
+                writer = open_writer(output_format, os.path.join(tmp_dir, name))
+                writer.write_rows(rows)
+                writer.close()
+            return run
+        stages["write_json"], _ = timed(repeat, write("json", "out.json"))
+        stages["write_ndjson"], _ = timed(repeat, write("ndjson", "out_ndjson"))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return stages, len(components), len(rows), len(errors)
+
+
+def peak_memory(payloads, cache_size):
+    scrape_ord.configure_cache(cache_size)
+    tracemalloc.start()
+    scrape_ord.classify_payloads(payloads)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print(f"\nComparison with baseline (tolerance {tolerance:.0%}):")
+    for stage, seconds in results["stages"].items():
+        old = baseline["stages"].get(stage)
+        if not old:
+            continue
+        ratio = seconds / old
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  <-- slower"
+            regressions.append(stage)
+        print(f"  {stage:<18} {old * 1000:9.2f} ms -> {seconds * 1000:9.2f} ms  ({ratio:5.2f}x){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ORD decode/classify/write pipeline offline.")
+    parser.add_argument("--reactions", type=int, default=2000)
+    parser.add_argument("--components", type=int, default=6, help="Components per reaction")
+    parser.add_argument("--unique-smiles", type=int, default=300, help="Distinct SMILES in the fixture")
+    parser.add_argument("--roles", default=DEFAULT_ROLES, help="Role weights, e.g. REACTANT=0.5,SOLVENT=0.5")
+    parser.add_argument("--keys", default=DEFAULT_KEYS, help="Input key weights, e.g. Base=1,Amine=2")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage; the fastest is reported")
+    parser.add_argument("--cache-size", type=int, default=100000)
+    parser.add_argument("--save-baseline", default=None, metavar="FILE")
+    parser.add_argument("--compare", default=None, metavar="FILE", help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before a stage fails")
+    args = parser.parse_args()
+
+    RDLogger.DisableLog("rdApp.*")
+    print(f"Generating {args.reactions} reactions x {args.components} components...")
+    reactions, unique = make_reactions(args.reactions, args.components, args.unique_smiles,
+                                       parse_weights(args.roles), parse_weights(args.keys), args.seed)
+    payloads = [(r.reaction_id, base64.b64encode(r.SerializeToString()).decode("ascii")) for r in reactions]
+    del reactions
+
+    stages, components, rows, errors = run_stages(payloads, args.repeat, args.cache_size)
+    peak = peak_memory(payloads, args.cache_size)
+
+    results = {
+        "config": {
+            "reactions": args.reactions,
+            "components": args.components,
+            "unique_smiles": unique,
+            "roles": args.roles,
+            "keys": args.keys,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "cache_size": args.cache_size,
+        },
+        "machine": {"python": platform.python_version(), "platform": platform.platform()},
+        "stages": stages,
+        "reactions_per_s": args.reactions / stages["pipeline"],
+        "components_per_s": components / stages["pipeline"],
+        "pipeline_peak_bytes": peak,
+        "rows": rows,
+        "errors": errors,
+    }
+
+    print(f"\n{components} components, {rows} classified rows, {errors} errors, {unique} distinct SMILES")
+    for stage, seconds in stages.items():
+        print(f"  {stage:<18} {seconds * 1000:9.2f} ms  ({components / seconds:12.0f} components/s)")
+    print(f"\nPipeline: {results['reactions_per_s']:.0f} reactions/s, {results['components_per_s']:.0f} components/s")
+    print(f"Pipeline peak traced memory: {peak / 1024 ** 2:.1f} MiB")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["config"] != results["config"]:
+            print("Warning: baseline was recorded with a different fixture configuration.")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import json
+import sqlite3
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 100000
+FLUSH_EVERY = 1000
+
+
+class ClassifyCache:
+    # Two levels: a bounded in-process LRU in front of an optional SQLite file.
+    # `facts` maps a SMILES string as written to (canonical SMILES, molecule
+    # facts); `categories` maps (canonical SMILES, role, input key) to the
+    # final category list.
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, path=None, version="1", facts_version="1"):
+        self.max_size = max_size
+        self.facts_lru = OrderedDict()
+        self.categories_lru = OrderedDict()
+        self.pending_facts = []
+        self.pending_categories = []
+        self.stats = {
+            "facts_hits": 0,
+            "facts_disk_hits": 0,
+            "facts_misses": 0,
+            "categories_hits": 0,
+            "categories_disk_hits": 0,
+            "categories_misses": 0
+        }
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, timeout=60)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS smiles_facts (
+                smiles TEXT PRIMARY KEY, canonical TEXT,
+                metal INTEGER, amine INTEGER, aryl_halide INTEGER, acid INTEGER)""")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS categories (
+                canonical TEXT, role INTEGER, input_key TEXT, categories TEXT,
+                PRIMARY KEY (canonical, role, input_key))""")
+            self._check_version("facts_version", facts_version, ["smiles_facts", "categories"])
+            self._check_version("version", version, ["categories"])
+            self.db.commit()
+
+    def _check_version(self, name, version, tables):
+        # Stored rows are dropped when the rules (or fact patterns) that produced them change.
+        row = self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        if row is None or row[0] != str(version):
+            for table in tables:
+                self.db.execute(f"DELETE FROM {table}")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (name, str(version)))
+
+    def _remember(self, lru, key, value):
+        lru[key] = value
+        if len(lru) > self.max_size:
+            lru.popitem(last=False)
+
+    def facts(self, smiles, compute):
+        hit = self.facts_lru.get(smiles)
+        if hit is not None:
+            self.facts_lru.move_to_end(smiles)
+            self.stats["facts_hits"] += 1
+            return hit
+
+        if self.db is not None:
+            row = self.db.execute(
+                "SELECT canonical, metal, amine, aryl_halide, acid FROM smiles_facts WHERE smiles = ?",
+                (smiles,)).fetchone()
+            if row is not None:
+                value = (row[0], tuple(bool(x) for x in row[1:]))
+                self._remember(self.facts_lru, smiles, value)
+                self.stats["facts_disk_hits"] += 1
+                return value
+
+        self.stats["facts_misses"] += 1
+        value = compute(smiles)
+        self._remember(self.facts_lru, smiles, value)
+        if self.db is not None:
+            canonical, flags = value
+            self.pending_facts.append((smiles, canonical) + tuple(int(x) for x in flags))
+            self._maybe_flush()
+        return value
+
+    def get_categories(self, canonical, role, input_key):
+        key = (canonical, role, input_key)
+        hit = self.categories_lru.get(key)
+        if hit is not None:
+            self.categories_lru.move_to_end(key)
+            self.stats["categories_hits"] += 1
+            return hit
+
+        if self.db is not None:
+            row = self.db.execute(
+                "SELECT categories FROM categories WHERE canonical = ? AND role = ? AND input_key = ?",
+                key).fetchone()
+            if row is not None:
+                value = tuple(json.loads(row[0]))
+                self._remember(self.categories_lru, key, value)
+                self.stats["categories_disk_hits"] += 1
+                return value
+
+        self.stats["categories_misses"] += 1
+        return None
+
+    def put_categories(self, canonical, role, input_key, categories):
+        key = (canonical, role, input_key)
+        value = tuple(categories)
+        self._remember(self.categories_lru, key, value)
+        if self.db is not None:
+            self.pending_categories.append(key + (json.dumps(list(value)),))
+            self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self.pending_facts) + len(self.pending_categories) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        if self.db is None:
+            return
+        if not self.pending_facts and not self.pending_categories:
+            return
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO smiles_facts VALUES (?, ?, ?, ?, ?, ?)",
+                                self.pending_facts)
+            self.db.executemany("INSERT OR REPLACE INTO categories VALUES (?, ?, ?, ?)",
+                                self.pending_categories)
+        self.pending_facts = []
+        self.pending_categories = []
+
+    def take_stats(self):
+        stats = self.stats
+        self.stats = {name: 0 for name in stats}
+        return stats
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+def add_stats(total, stats):
+    for name, count in stats.items():
+        total[name] = total.get(name, 0) + count
+    return total
+
+
+def format_stats(stats):
+    lines = []
+    for level in ["facts", "categories"]:
+        hits = stats.get(f"{level}_hits", 0)
+        disk_hits = stats.get(f"{level}_disk_hits", 0)
+        misses = stats.get(f"{level}_misses", 0)
+        total = hits + disk_hits + misses
+        rate = (hits + disk_hits) / total * 100 if total else 0.0
+        lines.append(f"  {level}: {hits} memory hits, {disk_hits} disk hits, {misses} misses ({rate:.1f}% hit rate)")
+    return "\n".join(lines)
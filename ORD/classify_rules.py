@@ -0,0 +1,246 @@
+import os
+import re
+import sys
+import hashlib
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import METRICS
+
+# Categories in output order. Bits in a compiled mask follow this order.
+CATEGORIES = [
+    "Base",
+    "Solvent",
+    "Amine",
+    "Aryl Halide",
+    "Metal",
+    "Ligand",
+    "Carboxylic Acid",
+    "Additive",
+    "Activation Agent",
+]
+
+METAL_ELEMENTS = [3, 11, 19, 37, 55, 12, 20, 38, 56, 26, 27, 28, 29, 30, 44, 45, 46, 47, 48, 76, 77, 78, 79, 80]
+
+# Molecule facts a rule can ask for. "metal" is checked against METAL_ELEMENTS,
+# the rest are SMARTS patterns.
+FACT_NAMES = ["metal", "amine", "aryl_halide", "acid"]
+
+FACT_SMARTS = {
+    "amine": "[NX3;H2,H1;!$(NC=O)]",
+    "aryl_halide": "[c]~[F,Cl,Br,I]",
+    "acid": "[CX3](=O)[OX2H1]",
+}
+
+# Rules run top to bottom. A rule applies when its role matches (if given) and
+# any of its keywords is a substring of the lower-cased input key (if given).
+# It is skipped if any category in "unless" is already set. With a "fact" it
+# adds "then" when the fact holds and "otherwise" (if any) when it does not.
+# A "final" rule ends classification.
+RULES = [
+    {"role": "SOLVENT", "then": "Solvent", "final": True},
+    {"keywords": ["carboxylic acid"], "then": "Carboxylic Acid"},
+    {"keywords": ["acid"], "unless": ["Carboxylic Acid"], "fact": "acid", "then": "Carboxylic Acid"},
+    {"keywords": ["amine"], "then": "Amine"},
+    {"keywords": ["activation", "coupling agent"], "then": "Activation Agent"},
+    {"keywords": ["additive"], "then": "Additive"},
+    {"keywords": ["base"], "then": "Base"},
+    {"keywords": ["ligand"], "then": "Ligand"},
+    {"keywords": ["catalyst", "metal"], "fact": "metal", "then": "Metal", "otherwise": "Ligand"},
+    {"role": "CATALYST", "unless": ["Metal", "Ligand"], "fact": "metal", "then": "Metal", "otherwise": "Ligand"},
+    {"role": "REAGENT", "unless": ["Base", "Activation Agent", "Additive"], "then": "Base"},
+    {"role": "REACTANT", "unless": ["Amine"], "fact": "amine", "then": "Amine"},
+    {"role": "REACTANT", "unless": ["Aryl Halide"], "fact": "aryl_halide", "then": "Aryl Halide"},
+    {"role": "REACTANT", "unless": ["Carboxylic Acid"], "fact": "acid", "then": "Carboxylic Acid"},
+]
+
+# Input keys starting with this prefix are split on "_"; every part that is the
+# prefix followed by digits (m1, m2, ...) becomes its own upper-cased category.
+SLOT_PREFIX = "m"
+
+MAX_PLANS = 10000
+
+
+def rules_version(*tables):
+    text = json.dumps(tables, sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def slot_categories(key_lower):
+    if not key_lower.startswith(SLOT_PREFIX):
+        return ()
+    slots = []
+    for part in key_lower.split('_'):
+        if part.startswith(SLOT_PREFIX) and part[len(SLOT_PREFIX):].isdigit():
+            slot = part.upper()
+            if slot not in slots:
+                slots.append(slot)
+    return tuple(slots)
+
+
+class CompiledRule:
+    __slots__ = ["role", "keywords", "unless", "fact", "then", "otherwise", "final"]
+
+
+class Plan:
+    # The rules that apply to one (role, input key) pair. When none of them
+    # needs a molecule fact the result is known up front and kept in `constant`.
+    __slots__ = ["rules", "slots", "constant"]
+
+
+class CompiledRules:
+    # ord_schema and rdkit are imported when the rules are compiled, not with
+    # this module, and each SMARTS pattern is compiled the first time a rule
+    # asks for its fact.
+
+    def __init__(self, categories=CATEGORIES, rules=RULES, fact_smarts=FACT_SMARTS,
+                 metal_elements=METAL_ELEMENTS, slot_prefix=SLOT_PREFIX):
+        self.categories = list(categories)
+        from ord_schema.proto import reaction_pb2
+        self.bits = {name: 1 << i for i, name in enumerate(self.categories)}
+        self.metal_elements = frozenset(metal_elements)
+        self.fact_smarts = dict(fact_smarts)
+        self.patterns = {}
+        self.version = rules_version(list(categories), rules, slot_prefix)
+        self.facts_version = rules_version(fact_smarts, sorted(metal_elements))
+
+        keywords = []
+        for rule in rules:
+            for keyword in rule.get("keywords", []):
+                if keyword not in keywords:
+                    keywords.append(keyword)
+        self.keyword_bits = {keyword: 1 << i for i, keyword in enumerate(keywords)}
+
+        # A keyword found in the key also means every keyword inside it was found.
+        self.implied_bits = {}
+        for keyword in keywords:
+            mask = 0
+            for other in keywords:
+                if other in keyword:
+                    mask |= self.keyword_bits[other]
+            self.implied_bits[keyword] = mask
+
+        # One lookahead per position finds the longest keyword starting there,
+        # so a single scan reports every (possibly overlapping) occurrence.
+        ordered = sorted(keywords, key=len, reverse=True)
+        alternation = "|".join(re.escape(keyword) for keyword in ordered)
+        self.keyword_re = re.compile(f"(?=({alternation}))") if keywords else None
+
+        self.rules = []
+        for rule in rules:
+            compiled = CompiledRule()
+            role = rule.get("role")
+            compiled.role = reaction_pb2.ReactionRole.ReactionRoleType.Value(role) if role else None
+            compiled.keywords = 0
+            for keyword in rule.get("keywords", []):
+                compiled.keywords |= self.keyword_bits[keyword]
+            compiled.unless = self.mask(rule.get("unless", []))
+            compiled.fact = rule.get("fact")
+            if compiled.fact is not None and compiled.fact != "metal" and compiled.fact not in self.fact_smarts:
+                raise ValueError(f"Unknown fact '{compiled.fact}' in classification rule {rule}")
+            compiled.then = self.mask([rule["then"]])
+            compiled.otherwise = self.mask([rule["otherwise"]]) if rule.get("otherwise") else 0
+            compiled.final = rule.get("final", False)
+            self.rules.append(compiled)
+
+        self.plans = {}
+
+    def pattern(self, name):
+        pattern = self.patterns.get(name)
+        if pattern is None:
+            from rdkit import Chem
+            pattern = self.patterns[name] = Chem.MolFromSmarts(self.fact_smarts[name])
+        return pattern
+
+    def mask(self, names):
+        mask = 0
+        for name in names:
+            mask |= self.bits[name]
+        return mask
+
+    def names(self, mask):
+        return [name for name in self.categories if mask & self.bits[name]]
+
+    def keywords_in(self, key_lower):
+        found = 0
+        if self.keyword_re is not None:
+            for match in self.keyword_re.finditer(key_lower):
+                found |= self.implied_bits[match.group(1)]
+        return found
+
+    def plan(self, role, key_lower):
+        key = (role, key_lower)
+        plan = self.plans.get(key)
+        if plan is not None:
+            return plan
+
+        found = self.keywords_in(key_lower)
+        plan = Plan()
+        plan.rules = []
+        plan.slots = slot_categories(key_lower)
+        for rule in self.rules:
+            if rule.role is not None and rule.role != role:
+                continue
+            if rule.keywords and not (rule.keywords & found):
+                continue
+            plan.rules.append(rule)
+            if rule.final and rule.fact is None:
+                plan.slots = ()
+                break
+
+        plan.constant = None
+        if all(rule.fact is None for rule in plan.rules):
+            plan.constant = tuple(self.run(plan, None))
+
+        if len(self.plans) >= MAX_PLANS:
+            self.plans.clear()
+        self.plans[key] = plan
+        return plan
+
+    def run(self, plan, get_fact):
+        mask = 0
+        for rule in plan.rules:
+            if mask & rule.unless:
+                continue
+            if rule.fact is None or get_fact(rule.fact):
+                mask |= rule.then
+            else:
+                mask |= rule.otherwise
+            if rule.final:
+                return self.names(mask)
+        return self.names(mask) + list(plan.slots)
+
+    def classify(self, role, key_lower, get_fact):
+        plan = self.plan(role, key_lower)
+        if plan.constant is not None:
+            return list(plan.constant)
+        return self.run(plan, get_fact)
+
+    def fact(self, name, mol):
+        if not mol:
+            return False
+        if name == "metal":
+            for atom in mol.GetAtoms():
+                if atom.GetAtomicNum() in self.metal_elements:
+                    return True
+            return False
+        with METRICS.timer("smarts_match"):
+            return mol.HasSubstructMatch(self.pattern(name))
+
+    def all_facts(self, mol):
+        return tuple(self.fact(name, mol) for name in FACT_NAMES)
+
+    def lazy_facts(self, smiles):
+        # Parses the SMILES and runs each check only the first time a rule asks.
+        from rdkit import Chem
+        state = {}
+
+        def get_fact(name):
+            if name not in state:
+                if "mol" not in state:
+                    with METRICS.timer("rdkit_parse"):
+                        state["mol"] = Chem.MolFromSmiles(smiles) if smiles else None
+                state[name] = self.fact(name, state["mol"])
+            return state[name]
+
+        return get_fact
@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import base64
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.jsonl import read_jsonl, open_log
+
+JOURNAL_FILE = "journal.jsonl"
+DEAD_LETTER_FILE = "dead_letter.jsonl"
+
+
+def page_key(dataset_id, offset, results):
+    first_id = results[0].get("reaction_id") if offset == 0 and results else None
+    return (dataset_id, offset, first_id)
+
+
+def encode_proto(proto):
+    if isinstance(proto, str):
+        return proto
+    return base64.b64encode(proto).decode("ascii")
+
+
+class Checkpoint:
+    # Journal of a crawl in `directory`. Each "pages" record is written after
+    # the output for those pages has been flushed and stores the output file
+    # sizes at that moment, so a restart can cut off anything written after
+    # the last record. A dataset is marked done once its fetch has finished
+    # and every page yielded for it has been recorded.
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.done_datasets = set()
+        self.done_pages = {}
+        self.first_ids = {}
+        self.reaction_ids = set()
+        self.positions = None
+        self.counts = None
+        self.pending = {}
+        self.fetch_finished = set()
+
+        records, self.journal = open_log(os.path.join(directory, JOURNAL_FILE))
+        for record in records:
+            if record["type"] == "pages":
+                for dataset_id, offset, first_id in record["pages"]:
+                    self.done_pages.setdefault(dataset_id, set()).add(offset)
+                    if first_id is not None:
+                        self.first_ids[dataset_id] = first_id
+                self.reaction_ids.update(record["reaction_ids"])
+                self.positions = record["positions"]
+                self.counts = record["counts"]
+            elif record["type"] == "dataset_done":
+                self.done_datasets.add(record["dataset_id"])
+
+        _, self.dead_letter = open_log(os.path.join(directory, DEAD_LETTER_FILE))
+
+    @property
+    def resumed(self):
+        return self.positions is not None or bool(self.done_datasets)
+
+    def _write(self, record):
+        self.journal.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def page_started(self, dataset_id):
+        self.pending[dataset_id] = self.pending.get(dataset_id, 0) + 1
+
+    def fetch_done(self, dataset_id):
+        self.fetch_finished.add(dataset_id)
+        self._maybe_done(dataset_id)
+
+    def _maybe_done(self, dataset_id):
+        if dataset_id in self.done_datasets:
+            return
+        if dataset_id in self.fetch_finished and self.pending.get(dataset_id, 0) == 0:
+            self._write({"type": "dataset_done", "dataset_id": dataset_id})
+            self.done_datasets.add(dataset_id)
+
+    def commit(self, keys, rows, errors, writer):
+        reaction_ids = []
+        seen = set()
+        for row in rows:
+            reaction_id = row[1]
+            if reaction_id not in seen:
+                seen.add(reaction_id)
+                reaction_ids.append(reaction_id)
+
+        self.add_dead_letters(errors)
+        writer.flush(sync=True)
+        self._write({
+            "type": "pages",
+            "pages": [list(key) for key in keys],
+            "reaction_ids": reaction_ids,
+            "positions": writer.positions(),
+            "counts": writer.counts,
+        })
+        self.reaction_ids.update(reaction_ids)
+        for dataset_id, offset, first_id in keys:
+            self.done_pages.setdefault(dataset_id, set()).add(offset)
+            self.pending[dataset_id] -= 1
+        for dataset_id in set(key[0] for key in keys):
+            self._maybe_done(dataset_id)
+
+    def add_dead_letters(self, errors):
+        if not errors:
+            return
+        for reaction_id, proto, error in errors:
+            record = {"reaction_id": reaction_id, "proto": encode_proto(proto), "error": error}
+            self.dead_letter.write(json.dumps(record) + "\n")
+        self.dead_letter.flush()
+        os.fsync(self.dead_letter.fileno())
+
+    def close(self):
+        self.journal.close()
+        self.dead_letter.close()
+
+
+def read_dead_letters(path):
+    records, _ = read_jsonl(path)
+    return records
+
+
+def write_dead_letters(path, errors):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for reaction_id, proto, error in errors:
+            record = {"reaction_id": reaction_id, "proto": encode_proto(proto), "error": error}
+            f.write(json.dumps(record) + "\n")
+    os.replace(tmp_path, path)
@@ -0,0 +1,189 @@
+import os
+import sys
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.fetch_control import DEFAULT_RATE, DEFAULT_RETRIES, ControlledSession
+from common.metrics import METRICS
+
+log = logging.getLogger("ord")
+
+DEFAULT_API_URL = "https://open-reaction-database.org/api"
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_WORKERS = 8
+DEFAULT_PAGES_AHEAD = 2
+
+
+def make_session(pool_size=DEFAULT_WORKERS, rate=DEFAULT_RATE, retries=DEFAULT_RETRIES):
+    # Requests are rate limited and retried per host; concurrency adapts
+    # between 1 and `pool_size`. requests is imported here, so runs that only
+    # read dataset files never load it.
+    import requests
+    from requests.adapters import HTTPAdapter
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return ControlledSession(session, rate=rate, max_concurrency=pool_size, retries=retries)
+
+
+def fetch_datasets(session, api_url=DEFAULT_API_URL, timeout=30):
+    with METRICS.timer("fetch"):
+        response = session.get(f"{api_url}/datasets", timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_page(session, api_url, dataset_id, offset, page_size, timeout=60):
+    params = {
+        "dataset_id": dataset_id,
+        "limit": page_size,
+        "offset": offset
+    }
+    with METRICS.timer("fetch"):
+        response = session.get(f"{api_url}/query", params=params, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def iter_dataset_pages(session, dataset_ids, api_url=DEFAULT_API_URL, page_size=DEFAULT_PAGE_SIZE,
+                       workers=DEFAULT_WORKERS, pages_ahead=DEFAULT_PAGES_AHEAD, max_pages=None,
+                       completed=None, first_ids=None, on_done=None):
+    # Yields (dataset_id, offset, results) in (dataset, offset) order, so a
+    # run gives the same output whatever order responses arrive in. The
+    # first page of a dataset is fetched alone; once it comes back full, up
+    # to `pages_ahead` further pages of that dataset are kept in flight
+    # alongside other datasets. Pages that arrive early wait in a reorder
+    # buffer; later datasets only fetch ahead while in-flight plus buffered
+    # pages stay under `workers`, which bounds its size. Offsets in
+    # `completed` (from a checkpoint) are not fetched again, and
+    # `on_done(dataset_id)` is called once a dataset has been read to its end.
+    completed = completed or {}
+    first_ids = first_ids or {}
+    state = {}
+    for dataset_id in dataset_ids:
+        state[dataset_id] = {
+            "next_offset": 0,
+            "next_release": 0,
+            "outstanding": 0,
+            "submitted": 0,
+            "first_id": first_ids.get(dataset_id),
+            "opened": 0 in completed.get(dataset_id, ()),
+            "done": False,
+            "failed": False,
+            "end_offset": None
+        }
+    # offset -> results (None when there is nothing to yield) per dataset.
+    arrived = {dataset_id: {} for dataset_id in dataset_ids}
+    inflight = {}
+    head = 0
+
+    def buffered():
+        return sum(len(pages) for pages in arrived.values())
+
+    def release():
+        # Yields every page the head dataset can hand on in order, moving to
+        # the next dataset once one has been fetched and released in full.
+        nonlocal head
+        while head < len(dataset_ids):
+            dataset_id = dataset_ids[head]
+            s = state[dataset_id]
+            pages = arrived[dataset_id]
+            done_offsets = completed.get(dataset_id, ())
+            while True:
+                while s["next_release"] in done_offsets:
+                    s["next_release"] += page_size
+                offset = s["next_release"]
+                if offset not in pages:
+                    break
+                results = pages.pop(offset)
+                s["next_release"] += page_size
+                if results:
+                    yield dataset_id, offset, results
+            fetched = s["done"] or (max_pages and s["submitted"] >= max_pages)
+            if s["outstanding"] or pages or not fetched:
+                return
+            if s["done"] and not s["failed"] and on_done:
+                on_done(dataset_id)
+            head += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+
+        def submit_more():
+            progressed = True
+            while progressed and len(inflight) < workers:
+                progressed = False
+                for n, dataset_id in enumerate(dataset_ids[head:]):
+                    if len(inflight) >= workers:
+                        break
+                    if n > 0 and len(inflight) + buffered() >= workers:
+                        break
+                    s = state[dataset_id]
+                    if s["done"]:
+                        continue
+                    if max_pages and s["submitted"] >= max_pages:
+                        continue
+                    done_offsets = completed.get(dataset_id, ())
+                    while s["next_offset"] in done_offsets:
+                        s["next_offset"] += page_size
+                        s["submitted"] += 1
+                    if max_pages and s["submitted"] >= max_pages:
+                        continue
+                    limit = pages_ahead if s["opened"] else 1
+                    if s["outstanding"] > 0 and not s["opened"]:
+                        continue
+                    if s["outstanding"] + len(arrived[dataset_id]) >= limit:
+                        continue
+
+                    future = pool.submit(fetch_page, session, api_url, dataset_id,
+                                         s["next_offset"], page_size)
+                    inflight[future] = (dataset_id, s["next_offset"])
+                    s["next_offset"] += page_size
+                    s["outstanding"] += 1
+                    s["submitted"] += 1
+                    progressed = True
+
+        submit_more()
+        yield from release()
+
+        while inflight:
+            finished, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+            for future in finished:
+                dataset_id, offset = inflight.pop(future)
+                s = state[dataset_id]
+                s["outstanding"] -= 1
+                arrived[dataset_id][offset] = None
+
+                try:
+                    results = future.result()
+                except Exception as e:
+                    log.warning(f"Error querying dataset {dataset_id} at offset {offset}: {e}")
+                    METRICS.count("errors")
+                    s["done"] = True
+                    s["failed"] = True
+                    continue
+
+                if s["end_offset"] is not None and offset > s["end_offset"]:
+                    continue
+
+                if offset == 0:
+                    s["opened"] = True
+                    if results:
+                        s["first_id"] = results[0].get("reaction_id")
+                elif results and results[0].get("reaction_id") == s["first_id"]:
+                    # The server ignored the offset and sent page one again.
+                    s["done"] = True
+                    s["end_offset"] = offset
+                    continue
+
+                if len(results) < page_size:
+                    s["done"] = True
+                    if s["end_offset"] is None or offset < s["end_offset"]:
+                        s["end_offset"] = offset
+
+                arrived[dataset_id][offset] = results
+
+            submit_more()
+            yield from release()
+            submit_more()
@@ -0,0 +1,191 @@
+import os
+import io
+import sys
+import gzip
+import mmap
+import logging
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import METRICS
+
+log = logging.getLogger("ord")
+
+# Field number of `repeated Reaction reactions` in ord_schema's Dataset message.
+DATASET_REACTIONS_FIELD = 3
+# Field number of `string reaction_id` in the Reaction message.
+REACTION_ID_FIELD = 10
+READ_BUFFER = 1 << 20
+DATASET_SUFFIXES = (".pb", ".pb.gz")
+
+
+def find_dataset_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if name.endswith(DATASET_SUFFIXES):
+                        files.append(os.path.join(root, name))
+        elif os.path.exists(path):
+            files.append(path)
+        else:
+            log.warning(f"Dataset file '{path}' does not exist")
+            METRICS.count("errors")
+    return files
+
+
+def dataset_label(path):
+    name = os.path.basename(path)
+    for suffix in DATASET_SUFFIXES[::-1]:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def read_varint(stream):
+    result = 0
+    shift = 0
+    while True:
+        byte = stream.read(1)
+        if not byte:
+            if shift == 0:
+                return None
+            raise EOFError("Truncated varint in dataset file")
+        b = byte[0]
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result
+        shift += 7
+
+
+def read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise EOFError("Truncated field in dataset file")
+    return data
+
+
+def skip_field(stream, wire_type):
+    if wire_type == 0:
+        read_varint(stream)
+    elif wire_type == 1:
+        read_exact(stream, 8)
+    elif wire_type == 2:
+        size = read_varint(stream)
+        while size > 0:
+            chunk = stream.read(min(size, READ_BUFFER))
+            if not chunk:
+                raise EOFError("Truncated field in dataset file")
+            size -= len(chunk)
+    elif wire_type == 5:
+        read_exact(stream, 4)
+    else:
+        raise ValueError(f"Unsupported wire type {wire_type} in dataset file")
+
+
+def iter_stream_reactions(stream):
+    # Walks the top-level Dataset fields and yields the serialized bytes of
+    # each Reaction without decoding the rest of the message.
+    while True:
+        tag = read_varint(stream)
+        if tag is None:
+            return
+        field, wire_type = tag >> 3, tag & 7
+        if field == DATASET_REACTIONS_FIELD and wire_type == 2:
+            size = read_varint(stream)
+            yield read_exact(stream, size)
+        else:
+            skip_field(stream, wire_type)
+
+
+def mmap_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(buf):
+            raise EOFError("Truncated varint in dataset file")
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def iter_length_fields(buf, wanted_field):
+    # Yields the payload of every length-delimited `wanted_field` at the top
+    # level of a serialized message held in `buf` (an mmap or bytes).
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        tag, pos = mmap_varint(buf, pos)
+        field, wire_type = tag >> 3, tag & 7
+        if wire_type == 0:
+            _, pos = mmap_varint(buf, pos)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 5:
+            pos += 4
+        elif wire_type == 2:
+            size, pos = mmap_varint(buf, pos)
+            if pos + size > end:
+                raise EOFError("Truncated field in dataset file")
+            if field == wanted_field:
+                yield buf[pos:pos + size]
+            pos += size
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type} in dataset file")
+
+
+def iter_mmap_reactions(buf):
+    return iter_length_fields(buf, DATASET_REACTIONS_FIELD)
+
+
+def reaction_id_of(proto_bytes):
+    # Reads Reaction.reaction_id without decoding the rest of the message.
+    for value in iter_length_fields(proto_bytes, REACTION_ID_FIELD):
+        return bytes(value).decode("utf-8")
+    return None
+
+
+def iter_file_reactions(path):
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as raw:
+            stream = io.BufferedReader(raw, buffer_size=READ_BUFFER)
+            yield from iter_stream_reactions(stream)
+        return
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            yield from iter_mmap_reactions(buf)
+
+
+def iter_file_pages(files, page_size, completed=None, on_done=None):
+    # Same (dataset, offset, results) shape as ord_fetch.iter_dataset_pages,
+    # with raw proto bytes in place of base64 and the reaction_id left to
+    # the decoder. Offsets in `completed` are read past but not yielded.
+    completed = completed or {}
+    for path in files:
+        label = dataset_label(path)
+        done_offsets = completed.get(label, ())
+        offset = 0
+        results = []
+        try:
+            for proto_bytes in iter_file_reactions(path):
+                results.append({"reaction_id": None, "proto": proto_bytes})
+                if len(results) >= page_size:
+                    if offset not in done_offsets:
+                        yield label, offset, results
+                    offset += len(results)
+                    results = []
+        except (EOFError, ValueError) as e:
+            log.warning(f"Error reading dataset file {path}: {e}")
+            METRICS.count("errors")
+            continue
+        if results and offset not in done_offsets:
+            yield label, offset, results
+        if on_done:
+            on_done(label)
@@ -0,0 +1,107 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.manifest import Manifest, content_hash
+from ord_files import reaction_id_of
+
+
+def file_summary(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+class IncrementalRun:
+    # Keeps an ORD output in step with the archive across runs. ORD pages
+    # have no date order to stop at, so change detection is two-level: a
+    # dataset whose listing entry (or file size and mtime) matches the
+    # manifest is not fetched at all, and inside a dataset that is read only
+    # reactions whose proto hash is new or different are classified. Once a
+    # dataset has been read to its end, reactions the manifest still lists
+    # for it but that were not seen are counted as removed.
+
+    def __init__(self, path, version, max_pages=None):
+        self.manifest = Manifest(path, version)
+        self.summaries = {}
+        self.seen = {}
+        self.processed = set()
+        self.removed = set()
+        self.failed_ids = set()
+        self.complete = not max_pages
+
+    def select(self, dataset_ids, summaries):
+        # Drops datasets whose summary is unchanged since the last run.
+        self.summaries = summaries
+        todo = []
+        for dataset_id in dataset_ids:
+            summary = summaries.get(dataset_id)
+            if summary and self.manifest.group_unchanged(dataset_id, summary):
+                continue
+            todo.append(dataset_id)
+        return todo
+
+    def filter_pages(self, pages):
+        for dataset_id, offset, results in pages:
+            seen = self.seen.setdefault(dataset_id, set())
+            todo = []
+            for result in results:
+                reaction_id = result['reaction_id']
+                if reaction_id is None:
+                    try:
+                        reaction_id = reaction_id_of(result['proto'])
+                    except (EOFError, ValueError):
+                        reaction_id = None
+                if not reaction_id:
+                    todo.append(result)
+                    continue
+                seen.add(reaction_id)
+                digest = content_hash(result['proto'])
+                if self.manifest.check(reaction_id, digest) == "unchanged":
+                    continue
+                self.manifest.record(reaction_id, dataset_id, digest)
+                self.processed.add(reaction_id)
+                todo.append({"reaction_id": reaction_id, "proto": result['proto']})
+            yield dataset_id, offset, todo
+
+    def dataset_done(self, dataset_id):
+        # Only a dataset read to its end can vouch for its summary and for
+        # which of its reactions are gone.
+        if not self.complete:
+            return
+        seen = self.seen.pop(dataset_id, set())
+        for reaction_id in self.manifest.keys(dataset_id):
+            if reaction_id not in seen:
+                self.manifest.forget(reaction_id)
+                self.removed.add(reaction_id)
+        summary = self.summaries.get(dataset_id)
+        if summary:
+            self.manifest.record_group(dataset_id, summary)
+
+    def failed(self, errors):
+        # Failed reactions are left out of the manifest so the next run tries
+        # them again; their old entries are dropped from the output.
+        for reaction_id, _, _ in errors:
+            if reaction_id:
+                self.manifest.forget(reaction_id)
+                self.failed_ids.add(reaction_id)
+
+    @property
+    def replaced_ids(self):
+        return self.processed | self.removed
+
+    @property
+    def stale_ids(self):
+        # Reactions with nothing to write this run whose old entries must go.
+        return self.removed | self.failed_ids
+
+    @property
+    def stats(self):
+        stats = dict(self.manifest.stats)
+        stats["removed"] = len(self.removed)
+        return stats
+
+    def save(self):
+        self.manifest.save()
+
+    def close(self):
+        self.manifest.close()
@@ -0,0 +1,397 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+from classify_rules import CATEGORIES
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.reaction_db import ReactionDB, is_db_path
+
+OUTPUT_FORMATS = ["json", "ndjson", "parquet", "sqlite"]
+DEFAULT_OUTPUTS = {
+    "json": "ord_data.json",
+    "ndjson": "ord_data",
+    "parquet": "ord_data.parquet",
+    "sqlite": "reactions.sqlite",
+}
+ENTRY_FIELDS = ["reaction_id", "input_key", "reaction_role", "identifier_type", "value"]
+MANIFEST_FILE = "manifest.json"
+PARQUET_ROW_GROUP = 100000
+
+
+def new_organized_data():
+    organized_data = {name: [] for name in CATEGORIES}
+    for slot in range(1, 10):
+        organized_data[f"M{slot}"] = []
+    return organized_data
+
+
+def make_entry(reaction_id, input_key, role_name, identifier_type, value):
+    return {
+        "reaction_id": reaction_id,
+        "input_key": input_key,
+        "reaction_role": role_name,
+        "identifier_type": identifier_type,
+        "value": value,
+    }
+
+
+def merge_rows(rows, organized_data):
+    for categories, reaction_id, input_key, role_name, identifier_type, value in rows:
+        for cat in categories:
+            if cat not in organized_data:
+                organized_data[cat] = []
+            organized_data[cat].append(make_entry(reaction_id, input_key, role_name, identifier_type, value))
+
+
+def category_file(directory, category):
+    return os.path.join(directory, f"{category}.ndjson")
+
+
+class JsonWriter:
+    # The original layout: everything is kept in memory and dumped at close.
+
+    def __init__(self, path):
+        self.path = path
+        self.organized_data = new_organized_data()
+
+    @property
+    def counts(self):
+        return {cat: len(entries) for cat, entries in self.organized_data.items()}
+
+    def write_rows(self, rows):
+        merge_rows(rows, self.organized_data)
+
+    def close(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"raw": self.organized_data}, f, indent=2)
+
+
+class NdjsonWriter:
+    # One NDJSON file per category in `directory`, plus a manifest that keeps
+    # the category order and counts. With append=True existing files are
+    # extended instead of replaced.
+
+    def __init__(self, directory, append=False):
+        self.directory = directory
+        self.files = {}
+        self.counts = {name: 0 for name in new_organized_data()}
+        os.makedirs(directory, exist_ok=True)
+
+        manifest = read_manifest(directory)
+        if append and manifest:
+            for cat, count in manifest["counts"].items():
+                self.counts[cat] = count
+        elif not append:
+            for name in os.listdir(directory):
+                if name.endswith(".ndjson") or name == MANIFEST_FILE:
+                    os.remove(os.path.join(directory, name))
+
+    def _file(self, cat):
+        f = self.files.get(cat)
+        if f is None:
+            f = open(category_file(self.directory, cat), "a", encoding="utf-8")
+            self.files[cat] = f
+            if cat not in self.counts:
+                self.counts[cat] = 0
+        return f
+
+    def write_rows(self, rows):
+        for categories, reaction_id, input_key, role_name, identifier_type, value in rows:
+            line = None
+            for cat in categories:
+                if line is None:
+                    entry = make_entry(reaction_id, input_key, role_name, identifier_type, value)
+                    line = json.dumps(entry, separators=(",", ":")) + "\n"
+                self._file(cat).write(line)
+                self.counts[cat] += 1
+
+    def flush(self, sync=False):
+        for f in self.files.values():
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+        self.write_manifest()
+
+    def positions(self):
+        sizes = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(".ndjson"):
+                sizes[name[:-len(".ndjson")]] = os.path.getsize(os.path.join(self.directory, name))
+        return sizes
+
+    def restore(self, positions, counts):
+        # Cut every category file back to a size recorded by a checkpoint.
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith(".ndjson"):
+                continue
+            size = positions.get(name[:-len(".ndjson")], 0)
+            path = os.path.join(self.directory, name)
+            if os.path.getsize(path) < size:
+                raise ValueError(f"{path} is shorter than its checkpoint; cannot resume safely")
+            with open(path, "r+b") as f:
+                f.truncate(size)
+        self.counts = {name: 0 for name in new_organized_data()}
+        self.counts.update(counts)
+        self.write_manifest()
+
+    def write_manifest(self):
+        manifest = {"categories": list(self.counts), "counts": self.counts}
+        tmp_path = os.path.join(self.directory, MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.directory, MANIFEST_FILE))
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+        self.write_manifest()
+
+
+class ParquetWriter:
+    # Columnar output with dictionary-encoded category, input_key,
+    # reaction_role, identifier_type and value columns. Rows are buffered
+    # into row groups so memory stays bounded.
+
+    def __init__(self, path, row_group_size=PARQUET_ROW_GROUP):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow (pip install pyarrow)")
+        self.pa = pa
+        self.path = path
+        self.row_group_size = row_group_size
+        self.counts = {name: 0 for name in new_organized_data()}
+        self.columns = {name: [] for name in ["category"] + ENTRY_FIELDS}
+        dictionary = pa.dictionary(pa.int32(), pa.string())
+        self.schema = pa.schema([
+            ("category", dictionary),
+            ("reaction_id", pa.string()),
+            ("input_key", dictionary),
+            ("reaction_role", dictionary),
+            ("identifier_type", dictionary),
+            ("value", dictionary),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write_rows(self, rows):
+        columns = self.columns
+        for categories, reaction_id, input_key, role_name, identifier_type, value in rows:
+            for cat in categories:
+                columns["category"].append(cat)
+                columns["reaction_id"].append(reaction_id)
+                columns["input_key"].append(input_key)
+                columns["reaction_role"].append(role_name)
+                columns["identifier_type"].append(identifier_type)
+                columns["value"].append(value)
+                self.counts[cat] = self.counts.get(cat, 0) + 1
+        if len(columns["category"]) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.columns["category"]:
+            return
+        pa = self.pa
+        arrays = []
+        for field in self.schema:
+            array = pa.array(self.columns[field.name], type=pa.string())
+            if pa.types.is_dictionary(field.type):
+                array = array.dictionary_encode()
+            arrays.append(array)
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.columns = {name: [] for name in self.columns}
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+class SqliteWriter:
+    # Rows go into the shared reaction database (common/reaction_db.py),
+    # committed in batches. Reactions already in the database are replaced;
+    # everything else in it, including CRD reactions, is left alone. New
+    # identifiers are linked to deduplicated compounds at close.
+
+    def __init__(self, path, processes=0):
+        self.db = ReactionDB(path)
+        self.processes = processes
+        self.counts = {name: 0 for name in new_organized_data()}
+
+    def write_rows(self, rows):
+        self.db.add_ord_rows(rows)
+        for row in rows:
+            for cat in row[0]:
+                self.counts[cat] = self.counts.get(cat, 0) + 1
+
+    def remove_reactions(self, reaction_ids):
+        self.db.remove_reactions("ORD", reaction_ids)
+
+    def close(self):
+        self.db.resolve_compounds(self.processes)
+        self.db.close()
+
+
+def open_writer(output_format, path, append=False, processes=0):
+    if output_format == "json":
+        return JsonWriter(path)
+    if output_format == "ndjson":
+        return NdjsonWriter(path, append=append)
+    if output_format == "parquet":
+        return ParquetWriter(path)
+    if output_format == "sqlite":
+        return SqliteWriter(path, processes)
+    raise ValueError(f"Unknown output format '{output_format}'")
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def ndjson_categories(directory):
+    manifest = read_manifest(directory)
+    categories = list(manifest["categories"]) if manifest else list(new_organized_data())
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".ndjson") and name[:-len(".ndjson")] not in categories:
+            categories.append(name[:-len(".ndjson")])
+    return categories
+
+
+def iter_ndjson_entries(directory, category):
+    path = category_file(directory, category)
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def spool_parquet(path):
+    # Legacy JSON wants the entries category by category, which would mean
+    # decoding the whole file once per category. Instead the file is read
+    # once and each batch is split by category into per-category Arrow
+    # streams in a temporary directory, removed once `spool` is released.
+    # Returns (categories, spool, file name per category).
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+    spool = tempfile.TemporaryDirectory(prefix="ord_parquet_")
+    schema = pa.schema([(field, pa.string()) for field in ENTRY_FIELDS])
+    categories = list(new_organized_data())
+    files = {}
+    writers = {}
+    try:
+        for batch in pq.ParquetFile(path).iter_batches():
+            column = batch.column("category")
+            entries = pa.RecordBatch.from_arrays([batch.column(field).cast(pa.string()) for field in ENTRY_FIELDS],
+                                                 schema=schema)
+            for code, cat in enumerate(column.dictionary.to_pylist()):
+                if cat not in categories:
+                    categories.append(cat)
+                selected = entries.filter(pc.equal(column.indices, code))
+                if not selected.num_rows:
+                    continue
+                if cat not in writers:
+                    files[cat] = open(os.path.join(spool.name, f"{len(files)}.arrows"), "wb")
+                    writers[cat] = ipc.new_stream(files[cat], schema)
+                writers[cat].write_batch(selected)
+    finally:
+        for cat, writer in writers.items():
+            writer.close()
+            files[cat].close()
+    return categories, spool, {cat: os.path.basename(f.name) for cat, f in files.items()}
+
+
+def iter_spooled_entries(spool, names, category):
+    import pyarrow.ipc as ipc
+    if category not in names:
+        return
+    with open(os.path.join(spool.name, names[category]), "rb") as f:
+        for batch in ipc.open_stream(f):
+            columns = batch.to_pydict()
+            for i in range(batch.num_rows):
+                yield {field: columns[field][i] for field in ENTRY_FIELDS}
+
+
+def sqlite_categories(path):
+    db = ReactionDB(path)
+    categories = list(new_organized_data())
+    for cat in db.ord_categories():
+        if cat not in categories:
+            categories.append(cat)
+    db.close()
+    return categories
+
+
+def iter_sqlite_entries(path, category):
+    db = ReactionDB(path)
+    try:
+        yield from db.iter_ord_entries(category)
+    finally:
+        db.close()
+
+
+def write_legacy_json(categories, iter_entries, output_file):
+    # Produces byte-for-byte what json.dump({"raw": ...}, indent=2) would,
+    # holding only one entry in memory at a time.
+    total = 0
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write('{\n  "raw": {')
+        for i, cat in enumerate(categories):
+            f.write("\n    " if i == 0 else ",\n    ")
+            f.write(json.dumps(cat) + ": [")
+            count = 0
+            for entry in iter_entries(cat):
+                text = json.dumps(entry, indent=2).replace("\n", "\n      ")
+                f.write(("\n      " if count == 0 else ",\n      ") + text)
+                count += 1
+            f.write("\n    ]" if count else "]")
+            total += count
+        f.write("\n  }\n}" if categories else "}\n}")
+    return total
+
+
+def open_source(source):
+    # Returns (categories, iter_entries) for any output this module writes:
+    # an NDJSON directory, a Parquet file, a reaction database or a legacy
+    # JSON file.
+    if os.path.isdir(source):
+        return ndjson_categories(source), lambda cat: iter_ndjson_entries(source, cat)
+    if source.endswith(".parquet"):
+        categories, spool, names = spool_parquet(source)
+        return categories, lambda cat: iter_spooled_entries(spool, names, cat)
+    if is_db_path(source):
+        return sqlite_categories(source), lambda cat: iter_sqlite_entries(source, cat)
+    with open(source, encoding="utf-8") as f:
+        data = json.load(f)["raw"]
+    return list(data), lambda cat: iter(data.get(cat, []))
+
+
+def build_legacy_json(source, output_file):
+    categories, iter_entries = open_source(source)
+    return write_legacy_json(categories, iter_entries, output_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the legacy ord_data.json from streamed ORD output.")
+    parser.add_argument("source", help="NDJSON output directory, Parquet file or reaction database")
+    parser.add_argument("output", nargs="?", default="ord_data.json")
+    args = parser.parse_args()
+    total = build_legacy_json(args.source, args.output)
+    print(f"Wrote {total} classified components to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
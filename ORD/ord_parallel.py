@@ -0,0 +1,72 @@
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from classify_cache import add_stats
+from common.metrics import METRICS
+from ord_checkpoint import page_key
+
+DEFAULT_BATCH_SIZE = 200
+
+_scrape_ord = None
+
+
+def _init_worker(cache_options):
+    # Each worker compiles the SMARTS patterns on its first classify call.
+    global _scrape_ord
+    import scrape_ord
+    _scrape_ord = scrape_ord
+    # A forked worker starts with a copy of the parent's timings; drop them
+    # so only the worker's own are sent back.
+    METRICS.take()
+    if cache_options:
+        scrape_ord.configure_cache(**cache_options)
+
+
+def _classify_batch(batch):
+    rows, errors = _scrape_ord.classify_payloads(batch)
+    _scrape_ord.flush_cache()
+    return rows, errors, _scrape_ord.take_cache_stats(), METRICS.take()
+
+
+def iter_payload_batches(pages, batch_size=DEFAULT_BATCH_SIZE):
+    # Batches hold whole pages so a batch can be checkpointed as a unit; each
+    # is yielded with the keys of the pages it contains.
+    keys = []
+    batch = []
+    for dataset_id, offset, results in pages:
+        keys.append(page_key(dataset_id, offset, results))
+        for result in results:
+            batch.append((result['reaction_id'], result['proto']))
+        if len(batch) >= batch_size:
+            yield keys, batch
+            keys = []
+            batch = []
+    if keys:
+        yield keys, batch
+
+
+def iter_classified_batches(batches, processes, cache_options=None, cache_stats=None, max_pending=None):
+    # Results are yielded in submission order, so the merged output is the
+    # same as the in-process path for the same input.
+    if max_pending is None:
+        max_pending = processes * 2
+    pending = deque()
+
+    def collect(keys, future):
+        rows, errors, stats, metrics = future.result()
+        if cache_stats is not None:
+            add_stats(cache_stats, stats)
+        METRICS.merge(metrics)
+        return keys, rows, errors
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(cache_options,)) as pool:
+        for keys, batch in batches:
+            pending.append((keys, pool.submit(_classify_batch, batch)))
+            while len(pending) >= max_pending:
+                yield collect(*pending.popleft())
+        while pending:
+            yield collect(*pending.popleft())
@@ -0,0 +1,138 @@
+import os
+import shutil
+import hashlib
+import argparse
+
+from ord_output import OUTPUT_FORMATS, DEFAULT_OUTPUTS, ENTRY_FIELDS, open_source, open_writer, write_legacy_json
+
+
+def shard_of(dataset_id, shard_count):
+    # Stable across machines and Python versions, unlike hash().
+    digest = hashlib.sha1(dataset_id.encode("utf-8")).hexdigest()
+    return int(digest[:16], 16) % shard_count
+
+
+def parse_shard(text):
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Shard must look like INDEX/COUNT (e.g. 0/4), got '{text}'")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index must be between 0 and {count - 1}, got '{text}'")
+    return index, count
+
+
+def select_shard(dataset_ids, shard):
+    index, count = shard
+    return [dataset_id for dataset_id in dataset_ids if shard_of(dataset_id, count) == index]
+
+
+def shard_output(path, shard):
+    index, count = shard
+    return staging_output(path, f"shard-{index}-of-{count}")
+
+
+def staging_output(path, tag):
+    if path.endswith(".json") or path.endswith(".parquet") or path.endswith(".sqlite"):
+        stem, ext = path.rsplit(".", 1)
+        return f"{stem}.{tag}.{ext}"
+    return f"{path}.{tag}"
+
+
+def remove_output(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def merge_outputs(sources, output, output_format="json", replaced_ids=None):
+    # Streams the per-shard outputs, category by category and in the order the
+    # sources are given, into one output. Entries of reactions in
+    # `replaced_ids` are only taken from the last source. Returns per-category
+    # and per-source totals plus the number of distinct reactions.
+    opened = [open_source(source) for source in sources]
+    categories = []
+    for source_categories, _ in opened:
+        for cat in source_categories:
+            if cat not in categories:
+                categories.append(cat)
+
+    totals = {cat: 0 for cat in categories}
+    per_source = [0] * len(sources)
+    reaction_ids = set()
+
+    def iter_entries(cat):
+        for i, (source_categories, source_entries) in enumerate(opened):
+            if cat not in source_categories:
+                continue
+            last = i == len(opened) - 1
+            for entry in source_entries(cat):
+                if replaced_ids and not last and entry["reaction_id"] in replaced_ids:
+                    continue
+                totals[cat] += 1
+                per_source[i] += 1
+                reaction_ids.add(entry["reaction_id"])
+                yield entry
+
+    if output_format == "json":
+        write_legacy_json(categories, iter_entries, output)
+    else:
+        writer = open_writer(output_format, output)
+        for cat in categories:
+            batch = []
+            for entry in iter_entries(cat):
+                batch.append(([cat],) + tuple(entry[field] for field in ENTRY_FIELDS))
+                if len(batch) >= 10000:
+                    writer.write_rows(batch)
+                    batch = []
+            writer.write_rows(batch)
+        writer.close()
+
+    return totals, dict(zip(sources, per_source)), len(reaction_ids)
+
+
+def merge_into(output, update, output_format, replaced_ids):
+    # Folds `update` (a partial output from an incremental run) into
+    # `output`, dropping the old entries of every reaction in `replaced_ids`,
+    # then swaps the result into place. `update` is consumed.
+    if not os.path.exists(output):
+        os.replace(update, output)
+        return None
+    merged = staging_output(output, "merged")
+    remove_output(merged)
+    result = merge_outputs([output, update], merged, output_format, replaced_ids)
+    if os.path.isdir(output):
+        # A directory cannot be replaced in one step.
+        old = staging_output(output, "old")
+        remove_output(old)
+        os.replace(output, old)
+        os.replace(merged, output)
+        remove_output(old)
+    else:
+        os.replace(merged, output)
+    remove_output(update)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge per-shard ORD outputs into one category structure.")
+    parser.add_argument("sources", nargs="+", help="Shard outputs (NDJSON directories, Parquet or JSON files)")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="json")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    output = args.output or DEFAULT_OUTPUTS[args.output_format]
+    print(f"Merging {len(args.sources)} shard outputs into {output}...")
+    totals, per_source, reactions = merge_outputs(args.sources, output, args.output_format)
+
+    for source, count in per_source.items():
+        print(f"  {source}: {count} entries")
+    for cat, count in totals.items():
+        if count:
+            print(f"  {cat}: {count}")
+    print(f"Total: {sum(totals.values())} classified components from {reactions} reactions.")
+
+
+if __name__ == "__main__":
+    main()
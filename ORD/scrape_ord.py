@@ -1,218 +1,509 @@
-import requests
+import os
+import sys
 import base64
-import json
-from ord_schema.proto import reaction_pb2
-from rdkit import Chem
-from google.protobuf.json_format import MessageToDict
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.http_cache import DEFAULT_TTL, DEFAULT_MAX_BYTES, HttpCache, CachedSession
+from common.http_cache import format_stats as format_http_stats
+from common.fetch_control import DEFAULT_RATE, DEFAULT_RETRIES, format_host_stats
+from common.metrics import METRICS, LOG_LEVELS, configure_logging, format_summary, write_metrics, profiled
+from common.manifest import format_stats as format_manifest_stats
+from ord_fetch import (DEFAULT_API_URL, DEFAULT_PAGE_SIZE, DEFAULT_PAGES_AHEAD, DEFAULT_WORKERS,
+                       make_session, fetch_datasets, iter_dataset_pages)
+from classify_rules import FACT_NAMES, CompiledRules
+from classify_cache import DEFAULT_CACHE_SIZE, ClassifyCache, add_stats, format_stats
+from ord_files import find_dataset_files, dataset_label, iter_file_pages
+from ord_output import OUTPUT_FORMATS, DEFAULT_OUTPUTS, open_writer, build_legacy_json
+from ord_checkpoint import Checkpoint, page_key, read_dead_letters, write_dead_letters
+from ord_shard import parse_shard, shard_of, select_shard, shard_output, staging_output, remove_output, merge_into
+from ord_incremental import IncrementalRun, file_summary
+from ord_parallel import DEFAULT_BATCH_SIZE, iter_payload_batches, iter_classified_batches
+
+log = logging.getLogger("ord")
+
+# rdkit, ord_schema and protobuf's json_format take most of the start-up
+# time, so they are imported (and the rules compiled) by load_chemistry() on
+# first use rather than with this module.
+Chem = None
+reaction_pb2 = None
+MessageToDict = None
+RULES = None
+
+LEGACY_PATTERNS = {"AMINE_SMARTS": "amine", "ARYL_HALIDE_SMARTS": "aryl_halide", "CARBOXYLIC_ACID_SMARTS": "acid"}
 
-AMINE_SMARTS = Chem.MolFromSmarts("[NX3;H2,H1;!$(NC=O)]")
-ARYL_HALIDE_SMARTS = Chem.MolFromSmarts("[c]~[F,Cl,Br,I]")
-CARBOXYLIC_ACID_SMARTS = Chem.MolFromSmarts("[CX3](=O)[OX2H1]")
+def load_chemistry():
+    global Chem, reaction_pb2, MessageToDict, RULES
+    if RULES is None:
+        from rdkit import Chem
+        from ord_schema.proto import reaction_pb2
+        from google.protobuf.json_format import MessageToDict
+        RULES = CompiledRules()
+    return RULES
+
+def __getattr__(name):
+    if name in LEGACY_PATTERNS:
+        return load_chemistry().pattern(LEGACY_PATTERNS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_smiles(component):
+    load_chemistry()
     for identifier in component.identifiers:
         if identifier.type == reaction_pb2.CompoundIdentifier.SMILES:
             return identifier.value
     return None
 
 def is_metal(mol):
-    if not mol: return False
-    for atom in mol.GetAtoms():
-        if atom.GetAtomicNum() in [3, 11, 19, 37, 55, 12, 20, 38, 56, 26, 27, 28, 29, 30, 44, 45, 46, 47, 48, 76, 77, 78, 79, 80]:
-            return True
-    return False
+    return load_chemistry().fact("metal", mol)
+
+CLASSIFY_CACHE = None
+
+def configure_cache(max_size=DEFAULT_CACHE_SIZE, path=None):
+    global CLASSIFY_CACHE
+    if CLASSIFY_CACHE is not None:
+        CLASSIFY_CACHE.close()
+    CLASSIFY_CACHE = None
+    if max_size > 0:
+        load_chemistry()
+        CLASSIFY_CACHE = ClassifyCache(max_size, path, RULES.version, RULES.facts_version)
+    return CLASSIFY_CACHE
+
+def flush_cache():
+    if CLASSIFY_CACHE is not None:
+        CLASSIFY_CACHE.flush()
+
+def take_cache_stats():
+    if CLASSIFY_CACHE is None:
+        return {}
+    return CLASSIFY_CACHE.take_stats()
+
+def molecule_facts(smiles):
+    load_chemistry()
+    with METRICS.timer("rdkit_parse"):
+        mol = Chem.MolFromSmiles(smiles) if smiles else None
+    if not mol:
+        return smiles, RULES.all_facts(None)
+    return Chem.MolToSmiles(mol), RULES.all_facts(mol)
 
 def classify_component(component, role, input_key=""):
-    smiles = get_smiles(component)
-    mol = Chem.MolFromSmiles(smiles) if smiles else None
     key_lower = input_key.lower()
+    plan = load_chemistry().plan(role, key_lower)
+    if plan.constant is not None:
+        return list(plan.constant)
     
-    categories = []
+    smiles = get_smiles(component) or ""
     
-    if role == reaction_pb2.ReactionRole.SOLVENT:
-        categories.append("Solvent")
-        return categories
+    if CLASSIFY_CACHE is None:
+        return RULES.run(plan, RULES.lazy_facts(smiles))
     
-    if "carboxylic acid" in key_lower or "acid" in key_lower:
-        if mol and mol.HasSubstructMatch(CARBOXYLIC_ACID_SMARTS):
-            categories.append("Carboxylic Acid")
-        elif "carboxylic acid" in key_lower:
-            categories.append("Carboxylic Acid")
-            
-    if "amine" in key_lower:
-        categories.append("Amine")
-        
-    if "activation" in key_lower or "coupling agent" in key_lower:
-        categories.append("Activation Agent")
-        
-    if "additive" in key_lower:
-        categories.append("Additive")
-        
-    if "base" in key_lower:
-        categories.append("Base")
-        
-    if "ligand" in key_lower:
-        categories.append("Ligand")
-        
-    if "catalyst" in key_lower or "metal" in key_lower:
-        if is_metal(mol):
-            categories.append("Metal")
-        else:
-            categories.append("Ligand")
+    canonical, facts = CLASSIFY_CACHE.facts(smiles, molecule_facts)
+    categories = CLASSIFY_CACHE.get_categories(canonical, role, key_lower)
+    if categories is None:
+        facts = dict(zip(FACT_NAMES, facts))
+        categories = RULES.run(plan, facts.get)
+        CLASSIFY_CACHE.put_categories(canonical, role, key_lower, categories)
+    return list(categories)
 
-    if role == reaction_pb2.ReactionRole.CATALYST and "Metal" not in categories and "Ligand" not in categories:
-        if is_metal(mol):
-            categories.append("Metal")
-        else:
-            categories.append("Ligand")
+def extract_dataset_id(arg):
+    if "ord_dataset-" not in arg:
+        return None
+    start_idx = arg.find("ord_dataset-")
+    possible_id = arg[start_idx:]
+    for char in ['/', '?', '&', ' ']:
+        if char in possible_id:
+            possible_id = possible_id.split(char)[0]
+    return possible_id.strip()
+
+def decode_reaction(proto):
+    # API results carry base64 text, dataset files raw serialized bytes.
+    load_chemistry()
+    with METRICS.timer("proto_decode"):
+        if isinstance(proto, str):
+            proto = base64.b64decode(proto)
+        return reaction_pb2.Reaction.FromString(proto)
+
+def component_rows(reaction_id, reaction):
+    load_chemistry()
+    rows = []
+    for input_key, input_val in reaction.inputs.items():
+        for component in input_val.components:
             
-    if role == reaction_pb2.ReactionRole.REAGENT:
-        if "Base" not in categories and "Activation Agent" not in categories and "Additive" not in categories:
-            categories.append("Base")
-        
-    if role == reaction_pb2.ReactionRole.REACTANT:
-        if mol:
-            if "Amine" not in categories and mol.HasSubstructMatch(AMINE_SMARTS):
-                categories.append("Amine")
-            if "Aryl Halide" not in categories and mol.HasSubstructMatch(ARYL_HALIDE_SMARTS):
-                categories.append("Aryl Halide")
-            if "Carboxylic Acid" not in categories and mol.HasSubstructMatch(CARBOXYLIC_ACID_SMARTS):
-                categories.append("Carboxylic Acid")
-    
-    if key_lower.startswith("m"):
-        parts = key_lower.split('_')
-        for part in parts:
-            if part.startswith("m") and part[1:].isdigit():
-                m_key = part.upper()
-                categories.append(m_key)
+            raw_component_data = MessageToDict(
+                component, 
+                preserving_proto_field_name=True,
+                use_integers_for_enums=False
+            )
+            role_name = raw_component_data.get('reaction_role', 'UNSPECIFIED')
+            
+            with METRICS.timer("classify"):
+                categories = classify_component(component, component.reaction_role, input_key)
+            
+            identifier_type = "UNKNOWN"
+            value = "Unknown"
+            
+            for ident in component.identifiers:
+                if ident.type == reaction_pb2.CompoundIdentifier.SMILES:
+                    identifier_type = "SMILES"
+                    value = ident.value
+                    break
+            
+            if identifier_type == "UNKNOWN":
+                for ident in component.identifiers:
+                    if ident.type == reaction_pb2.CompoundIdentifier.NAME:
+                        identifier_type = "NAME"
+                        value = ident.value
+                        break
             
-    return list(set(categories))
+            rows.append((categories, reaction_id, input_key, role_name, identifier_type, value))
+    return rows
 
-import sys
+def classify_payloads(payloads):
+    rows = []
+    errors = []
+    count = 0
+    for reaction_id, proto in payloads:
+        count += 1
+        try:
+            reaction = decode_reaction(proto)
+            rows.extend(component_rows(reaction_id or reaction.reaction_id, reaction))
+        except Exception as e:
+            errors.append((reaction_id, proto, str(e)))
+    METRICS.count("reactions", count)
+    METRICS.count("components", len(rows))
+    return rows, errors
+
+def report_errors(errors):
+    for reaction_id, proto, error in errors:
+        log.warning(f"Error processing reaction {reaction_id or '(unknown id)'}: {error}")
+    METRICS.count("errors", len(errors))
+
+def classify_pages(pages):
+    for dataset_id, offset, results in pages:
+        rows, errors = classify_payloads((result['reaction_id'], result['proto']) for result in results)
+        yield [page_key(dataset_id, offset, results)], rows, errors
+
+def track_pages(pages, reactions_seen, checkpoint=None):
+    for dataset_id, offset, results in pages:
+        if checkpoint is not None:
+            checkpoint.page_started(dataset_id)
+            if checkpoint.reaction_ids:
+                results = [r for r in results if r['reaction_id'] not in checkpoint.reaction_ids]
+        reactions_seen[dataset_id] = reactions_seen.get(dataset_id, 0) + len(results)
+        METRICS.count("pages")
+        log.info(f"Processing dataset {dataset_id} (offset {offset}, {len(results)} reactions)...")
+        yield dataset_id, offset, results
+
+def iter_dead_letter_pages(path, page_size):
+    seen = set()
+    results = []
+    for record in read_dead_letters(path):
+        key = (record['reaction_id'], record['proto'])
+        if key in seen:
+            continue
+        seen.add(key)
+        results.append({"reaction_id": record['reaction_id'], "proto": record['proto']})
+    for offset in range(0, len(results), page_size):
+        yield "dead-letter", offset, results[offset:offset + page_size]
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape and classify reactions from the Open Reaction Database.")
+    parser.add_argument("datasets", nargs="*", help="ORD dataset IDs or URLs containing them")
+    parser.add_argument("--all", action="store_true",
+                        help="Crawl every dataset in the archive instead of the first two")
+    parser.add_argument("--shard", type=parse_shard, default=None, metavar="INDEX/COUNT",
+                        help="Only process datasets whose ID hashes to shard INDEX of COUNT (0-based); "
+                             "combine shard outputs with ord_shard.py")
+    parser.add_argument("--input", action="append", default=[], metavar="PATH",
+                        help="Read local .pb/.pb.gz Dataset files (or directories of them) instead of "
+                             "querying the API; may be repeated")
+    parser.add_argument("--api-url", default=os.environ.get("ORD_API_URL", DEFAULT_API_URL),
+                        help="Base URL of the ORD API (point at a local server for testing)")
+    parser.add_argument("--http-cache", default=os.environ.get("ORD_HTTP_CACHE"), metavar="DIR",
+                        help="Keep API responses in this directory and reuse them on later runs")
+    parser.add_argument("--http-cache-ttl", type=float, default=DEFAULT_TTL,
+                        help="Seconds before a cached response is revalidated with the server")
+    parser.add_argument("--http-cache-max-mb", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 2,
+                        help="Evict least recently used responses beyond this size")
+    parser.add_argument("--offline", action="store_true",
+                        help="Replay responses from --http-cache only, never touching the network")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Maximum number of requests in flight at once")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help="Most requests per second sent to one host (0 = no limit)")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help="Retries for connection errors, timeouts, 429 and 5xx responses")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE,
+                        help="Reactions requested per /api/query page")
+    parser.add_argument("--pages-ahead", type=int, default=DEFAULT_PAGES_AHEAD,
+                        help="Pages of one dataset fetched ahead of processing")
+    parser.add_argument("--max-pages", type=int, default=None,
+                        help="Stop each dataset after this many pages")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="Decode and classify in this many worker processes (0 = in-process)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Reactions sent to a worker process at a time")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+                        help="Entries kept in the in-memory classification cache (0 disables caching)")
+    parser.add_argument("--cache-db", default=None,
+                        help="SQLite file that keeps classification results between runs")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default=None,
+                        help="json: one indented file written at the end; ndjson: one streamed file per "
+                             "category in a directory; parquet: one streamed columnar file; sqlite: "
+                             "the indexed reaction database shared with the CRD scraper")
+    parser.add_argument("--output", default=None,
+                        help="Output file (or directory for ndjson); defaults to ord_data.json, ord_data/, "
+                             "ord_data.parquet or reactions.sqlite")
+    parser.add_argument("--legacy-json", default=None,
+                        help="With ndjson/parquet/sqlite output, also build the legacy JSON file here at the end")
+    parser.add_argument("--checkpoint", default=None, metavar="DIR",
+                        help="Journal progress in DIR and resume from it after a crash (implies ndjson output); "
+                             "failed reactions are kept in DIR/dead_letter.jsonl")
+    parser.add_argument("--retry-dead-letter", default=None, metavar="FILE",
+                        help="Only reprocess the reactions in a dead-letter file, appending to the output; "
+                             "reactions that fail again are written back to FILE")
+    parser.add_argument("--incremental", default=None, metavar="FILE",
+                        help="Keep a manifest of processed reactions in FILE and only classify new or changed "
+                             "ones, merging them into the existing output; unchanged datasets are not fetched")
+    parser.add_argument("--log-level", choices=LOG_LEVELS, default="info",
+                        help="info prints a line per page, warning only problems")
+    parser.add_argument("--metrics", default=None, metavar="FILE",
+                        help="Write stage timings and counters here (.prom for Prometheus text, else JSON)")
+    parser.add_argument("--profile", default=None, metavar="FILE",
+                        help="Run under cProfile and dump the stats to FILE")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Track allocations with tracemalloc and print the top sites")
+    args = parser.parse_args(argv)
+    
+    if args.output_format is None:
+        args.output_format = "ndjson" if args.checkpoint or args.retry_dead_letter else "json"
+    if args.checkpoint and args.output_format != "ndjson":
+        parser.error("--checkpoint needs --output-format ndjson")
+    if args.checkpoint and args.retry_dead_letter:
+        parser.error("--retry-dead-letter cannot be combined with --checkpoint")
+    if args.incremental and (args.checkpoint or args.retry_dead_letter):
+        parser.error("--incremental cannot be combined with --checkpoint or --retry-dead-letter")
+    return args
+
+def open_session(args):
+    session = make_session(args.workers, args.rate, args.retries)
+    if args.offline and not args.http_cache:
+        raise SystemExit("--offline needs --http-cache DIR to replay from")
+    if args.http_cache:
+        cache = HttpCache(args.http_cache, ttl=args.http_cache_ttl,
+                          max_bytes=int(args.http_cache_max_mb * 1024 ** 2), offline=args.offline)
+        session = CachedSession(session, cache)
+    return session
+
+def resolve_datasets(args, session):
     datasets_to_process = []
     
-    if len(sys.argv) > 1:
-        for arg in sys.argv[1:]:
-            target_id = None
-            if "ord_dataset-" in arg:
-                start_idx = arg.find("ord_dataset-")
-                possible_id = arg[start_idx:]
-                for char in ['/', '?', '&', ' ']:
-                    if char in possible_id:
-                        possible_id = possible_id.split(char)[0]
-                target_id = possible_id.strip()
-            
-            if target_id:
-                if not any(d['dataset_id'] == target_id for d in datasets_to_process):
-                    datasets_to_process.append({'dataset_id': target_id})
-            else:
-                print(f"Warning: Could not extract dataset ID from '{arg}'")
+    for arg in args.datasets:
+        target_id = extract_dataset_id(arg)
+        
+        if target_id:
+            if not any(d['dataset_id'] == target_id for d in datasets_to_process):
+                datasets_to_process.append({'dataset_id': target_id})
+        else:
+            print(f"Warning: Could not extract dataset ID from '{arg}'")
     
     if datasets_to_process:
         print(f"Targeting {len(datasets_to_process)} specific datasets.")
     else:
         print("No specific datasets provided, fetching all available for default behavior...")
-        datasets_url = "https://open-reaction-database.org/api/datasets"
         try:
-            datasets = requests.get(datasets_url).json()
-            datasets_to_process = datasets[:2]
+            datasets = fetch_datasets(session, args.api_url)
+            datasets_to_process = datasets if args.all or args.shard else datasets[:2]
         except Exception as e:
             print(f"Error fetching datasets: {e}")
-            return
+            return None
+    
+    return datasets_to_process
 
-    organized_data = {
-        "Base": [],
-        "Solvent": [],
-        "Amine": [],
-        "Aryl Halide": [],
-        "Metal": [],
-        "Ligand": [],
-        "Carboxylic Acid": [],
-        "Additive": [],
-        "Activation Agent": [],
-        "M1": [], "M2": [], "M3": [], "M4": [],
-        "M5": [], "M6": [], "M7": [], "M8": [], "M9": []
-    }
-
-    for dataset_info in datasets_to_process:
-        dataset_id = dataset_info['dataset_id']
-        print(f"Processing dataset {dataset_id}...")
-        
-        query_url = "https://open-reaction-database.org/api/query"
-        params = {
-            "dataset_id": dataset_id,
-            "limit": 50
-        }
-        
+def dataset_summaries(session, args, datasets):
+    # A dataset's listing entry (name, reaction count, ...) stands in for its
+    # content. Datasets named on the command line are looked up in the listing.
+    summaries = {d['dataset_id']: d for d in datasets if len(d) > 1}
+    if len(summaries) < len(datasets):
         try:
-            response = requests.get(query_url, params=params)
-            results = response.json()
+            listing = fetch_datasets(session, args.api_url)
         except Exception as e:
-            print(f"Error querying dataset {dataset_id}: {e}")
-            continue
-        
-        for result in results:
-            reaction_id = result['reaction_id']
-            proto_str = result['proto']
-            
-            try:
-                proto_bytes = base64.b64decode(proto_str)
-                reaction = reaction_pb2.Reaction.FromString(proto_bytes)
-                
-                for input_key, input_val in reaction.inputs.items():
-                    for component in input_val.components:
-                        
-                        raw_component_data = MessageToDict(
-                            component, 
-                            preserving_proto_field_name=True,
-                            use_integers_for_enums=False
-                        )
-                        role_name = raw_component_data.get('reaction_role', 'UNSPECIFIED')
-                        
-                        categories = classify_component(component, component.reaction_role, input_key)
-                        
-                        identifier_type = "UNKNOWN"
-                        value = "Unknown"
-                        
-                        for ident in component.identifiers:
-                            if ident.type == reaction_pb2.CompoundIdentifier.SMILES:
-                                identifier_type = "SMILES"
-                                value = ident.value
-                                break
-                        
-                        if identifier_type == "UNKNOWN":
-                            for ident in component.identifiers:
-                                if ident.type == reaction_pb2.CompoundIdentifier.NAME:
-                                    identifier_type = "NAME"
-                                    value = ident.value
-                                    break
-                        
-                        for cat in categories:
-                            if cat not in organized_data:
-                                organized_data[cat] = []
-                                
-                            entry = {
-                                "reaction_id": reaction_id,
-                                "input_key": input_key,
-                                "reaction_role": role_name,
-                                "identifier_type": identifier_type,
-                                "value": value,
-                            }
-                            organized_data[cat].append(entry)
-
-            except Exception as e:
-                print(f"Error processing reaction {reaction_id}: {e}")
-
-    output_file = "ord_data.json"
-    final_output = {"raw": organized_data}
-    
-    total_items = sum(len(v) for v in organized_data.values())
+            print(f"Error fetching dataset listing: {e}")
+            listing = []
+        wanted = {d['dataset_id'] for d in datasets}
+        summaries.update((d['dataset_id'], d) for d in listing if d['dataset_id'] in wanted)
+    return summaries
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_logging(args.log_level)
+    with profiled(args.profile, args.trace_memory):
+        scrape(args)
+    snapshot = METRICS.snapshot()
+    print(format_summary(snapshot))
+    if args.metrics:
+        write_metrics(args.metrics, snapshot, "ord_scraper")
+
+def scrape(args):
+    session = None
+    checkpoint = None
+    incremental = None
+    output_file = args.output or DEFAULT_OUTPUTS[args.output_format]
+    if args.shard and not args.output:
+        output_file = shard_output(output_file, args.shard)
+    
+    if args.checkpoint:
+        checkpoint = Checkpoint(args.checkpoint)
+        if checkpoint.resumed:
+            print(f"Resuming from {args.checkpoint}: {len(checkpoint.done_datasets)} datasets and "
+                  f"{len(checkpoint.reaction_ids)} reactions already done.")
+    on_done = checkpoint.fetch_done if checkpoint else None
+    
+    if args.incremental:
+        incremental = IncrementalRun(args.incremental, f"{load_chemistry().version}-{RULES.facts_version}",
+                                     args.max_pages)
+        on_done = incremental.dataset_done
+        if incremental.manifest.reset:
+            print(f"Classification rules changed since {args.incremental} was written; reprocessing everything.")
+    
+    if args.retry_dead_letter:
+        print(f"Retrying failed reactions from {args.retry_dead_letter}.")
+        dataset_ids = ["dead-letter"]
+        pages = iter_dead_letter_pages(args.retry_dead_letter, args.page_size)
+    elif args.input:
+        files = find_dataset_files(args.input)
+        if not files:
+            print("No dataset files found.")
+            return
+        if args.shard:
+            files = [path for path in files if shard_of(dataset_label(path), args.shard[1]) == args.shard[0]]
+            print(f"Shard {args.shard[0]}/{args.shard[1]}: {len(files)} dataset files.")
+        print(f"Reading {len(files)} local dataset files.")
+        dataset_ids = [dataset_label(path) for path in files]
+        if checkpoint is not None:
+            files = [path for path in files if dataset_label(path) not in checkpoint.done_datasets]
+        if incremental is not None:
+            todo = incremental.select(dataset_ids, {dataset_label(path): file_summary(path) for path in files})
+            files = [path for path in files if dataset_label(path) in todo]
+            print(f"{len(files)} dataset files changed since the last run.")
+        pages = iter_file_pages(
+            files, args.page_size,
+            completed=checkpoint.done_pages if checkpoint else None,
+            on_done=on_done
+        )
+    else:
+        session = open_session(args)
+        datasets = resolve_datasets(args, session)
+        if datasets is None:
+            return
+        dataset_ids = [d['dataset_id'] for d in datasets]
+        if args.shard:
+            total = len(dataset_ids)
+            dataset_ids = select_shard(dataset_ids, args.shard)
+            print(f"Shard {args.shard[0]}/{args.shard[1]}: {len(dataset_ids)} of {total} datasets.")
+        todo = dataset_ids
+        if checkpoint is not None:
+            todo = [dataset_id for dataset_id in dataset_ids if dataset_id not in checkpoint.done_datasets]
+        if incremental is not None:
+            todo = incremental.select(todo, dataset_summaries(session, args, datasets))
+            print(f"{len(todo)} of {len(dataset_ids)} datasets changed since the last run.")
+        print(f"Processing {len(todo)} datasets with up to {args.workers} requests in flight...")
+        pages = iter_dataset_pages(
+            session, todo,
+            api_url=args.api_url,
+            page_size=args.page_size,
+            workers=args.workers,
+            pages_ahead=args.pages_ahead,
+            max_pages=args.max_pages,
+            completed=checkpoint.done_pages if checkpoint else None,
+            first_ids=checkpoint.first_ids if checkpoint else None,
+            on_done=on_done
+        )
+
+    configure_cache(args.cache_size, args.cache_db)
+    cache_stats = {}
+    
+    final_output = output_file
+    if incremental is not None and args.output_format != "sqlite":
+        # New and changed reactions go to a separate output that is merged
+        # into the existing one at the end; the database is updated in place.
+        output_file = staging_output(output_file, "new")
+        remove_output(output_file)
+    resume_output = bool(args.retry_dead_letter) or (checkpoint is not None and checkpoint.resumed)
+    writer = open_writer(args.output_format, output_file, append=resume_output, processes=args.processes)
+    if checkpoint is not None and checkpoint.positions is not None:
+        writer.restore(checkpoint.positions, checkpoint.counts)
+    reactions_seen = {dataset_id: 0 for dataset_id in dataset_ids}
+    
+    if incremental is not None:
+        pages = incremental.filter_pages(pages)
+    pages = track_pages(pages, reactions_seen, checkpoint)
+    
+    if args.processes > 0:
+        print(f"Classifying in {args.processes} worker processes (batches of {args.batch_size})...")
+        batches = iter_payload_batches(pages, args.batch_size)
+        cache_options = {"max_size": args.cache_size, "path": args.cache_db}
+        classified = iter_classified_batches(batches, args.processes, cache_options, cache_stats)
+    else:
+        classified = classify_pages(pages)
+    
+    failed = []
+    for keys, rows, errors in classified:
+        with METRICS.timer("write"):
+            writer.write_rows(rows)
+        report_errors(errors)
+        if args.retry_dead_letter:
+            failed.extend(errors)
+        if incremental is not None:
+            incremental.failed(errors)
+        if checkpoint is not None:
+            checkpoint.commit(keys, rows, errors, writer)
+    
+    if isinstance(session, CachedSession):
+        print(f"HTTP cache: {format_http_stats(session.cache.stats)}")
+    if session is not None and session.hosts:
+        print("Fetch stats:")
+        print(format_host_stats(session.hosts))
+    if session is not None:
+        session.close()
+    flush_cache()
+    add_stats(cache_stats, take_cache_stats())
+    
+    for dataset_id in dataset_ids:
+        print(f"  {dataset_id}: {reactions_seen[dataset_id]} reactions")
+    if cache_stats:
+        print("Classification cache:")
+        print(format_stats(cache_stats))
+    if args.retry_dead_letter:
+        write_dead_letters(args.retry_dead_letter, failed)
+        print(f"{len(failed)} reactions still failing, kept in {args.retry_dead_letter}.")
+    if checkpoint is not None:
+        print(f"Checkpoint: {len(checkpoint.done_datasets)} datasets complete.")
+        checkpoint.close()
+
+    total_items = sum(writer.counts.values())
     print(f"Saving {total_items} classified components to {output_file}...")
+    with METRICS.timer("write"):
+        if incremental is not None and args.output_format == "sqlite":
+            writer.remove_reactions(incremental.stale_ids)
+        writer.close()
+    
+    if incremental is not None:
+        if output_file != final_output:
+            if incremental.replaced_ids:
+                print(f"Merging into {final_output}...")
+                with METRICS.timer("write"):
+                    merge_into(final_output, output_file, args.output_format, incremental.replaced_ids)
+            else:
+                remove_output(output_file)
+            output_file = final_output
+        incremental.save()
+        print(f"Incremental: {format_manifest_stats(incremental.stats, 'datasets')}")
+        incremental.close()
     
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(final_output, f, indent=2)
+    if args.legacy_json and args.output_format != "json":
+        print(f"Building {args.legacy_json} from {output_file}...")
+        build_legacy_json(output_file, args.legacy_json)
     print("Done.")
 
 if __name__ == "__main__":
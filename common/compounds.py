@@ -0,0 +1,38 @@
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+from rdkit import Chem, RDLogger
+
+CACHE_SIZE = 100000
+CHUNK_SIZE = 500
+
+RDLogger.DisableLog("rdApp.*")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonical_compound(smiles):
+    # (canonical SMILES, InChIKey) for a SMILES string, or (None, None) when
+    # RDKit cannot read it. The InChIKey may be None for molecules InChI
+    # cannot describe.
+    mol = Chem.MolFromSmiles(smiles) if smiles else None
+    if mol is None:
+        return None, None
+    return Chem.MolToSmiles(mol), Chem.MolToInchiKey(mol) or None
+
+
+def _canonicalize_chunk(chunk):
+    return [canonical_compound(smiles) for smiles in chunk]
+
+
+def canonicalize_all(smiles_list, processes=0, chunk_size=CHUNK_SIZE):
+    # canonical_compound over a list, each distinct string once, in
+    # `processes` worker processes when that is above zero.
+    uniques = list(dict.fromkeys(smiles_list))
+    if processes > 0 and len(uniques) > chunk_size:
+        chunks = [uniques[i:i + chunk_size] for i in range(0, len(uniques), chunk_size)]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = [result for chunk in pool.map(_canonicalize_chunk, chunks) for result in chunk]
+    else:
+        results = _canonicalize_chunk(uniques)
+    found = dict(zip(uniques, results))
+    return [found[smiles] for smiles in smiles_list]
@@ -0,0 +1,216 @@
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+
+DEFAULT_RATE = 0.0
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 0.5
+MAX_BACKOFF = 60.0
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+# A response slower than this multiple of the host's usual latency (and
+# than SLOW_SECONDS) is treated like a throttling signal.
+SLOW_FACTOR = 4.0
+SLOW_SECONDS = 1.0
+LATENCY_WEIGHT = 0.1
+
+
+class TokenBucket:
+    # Allows `rate` requests per second on average with bursts of up to
+    # `burst`; a rate of 0 means no limit. pause() stops all requests for a
+    # while, as a 429 with Retry-After asks.
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif not self.rate:
+                    return
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HostState:
+    # Per-host limits and counters. The concurrency limit grows by about one
+    # request per round trip while responses are good and halves (at most
+    # once per round trip) on 429/5xx, connection errors or a latency spike.
+
+    def __init__(self, host, rate, max_concurrency):
+        self.host = host
+        self.bucket = TokenBucket(rate)
+        self.max_concurrency = max_concurrency
+        self.limit = max(1.0, max_concurrency / 2)
+        self.active = 0
+        self.latency = None
+        self.last_decrease = 0.0
+        self.cond = threading.Condition()
+        self.started = time.monotonic()
+        self.stats = {"requests": 0, "ok": 0, "retries": 0, "throttled": 0, "server_errors": 0,
+                      "errors": 0, "failed": 0, "bytes": 0, "seconds": 0.0}
+
+    def enter(self):
+        with self.cond:
+            while self.active >= int(self.limit):
+                self.cond.wait()
+            self.active += 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def leave(self, seconds, response, error):
+        with self.cond:
+            self.active -= 1
+            stats = self.stats
+            stats["requests"] += 1
+            stats["seconds"] += seconds
+            if error is not None:
+                stats["errors"] += 1
+            elif response.status_code == 429:
+                stats["throttled"] += 1
+            elif response.status_code >= 500:
+                stats["server_errors"] += 1
+            else:
+                stats["ok"] += 1
+                stats["bytes"] += len(response.content)
+
+            slow = self.latency is not None and seconds > max(self.latency * SLOW_FACTOR, SLOW_SECONDS)
+            congested = error is not None or response.status_code in RETRY_STATUSES or slow
+            now = time.monotonic()
+            if congested:
+                if now - self.last_decrease > (self.latency or seconds):
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = now
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            if error is None and not slow:
+                self.latency = seconds if self.latency is None else \
+                    (1 - LATENCY_WEIGHT) * self.latency + LATENCY_WEIGHT * seconds
+            self.cond.notify_all()
+
+
+def retry_after(response):
+    # Seconds asked for by a Retry-After header, or None.
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=DEFAULT_BACKOFF, cap=MAX_BACKOFF):
+    # Exponential backoff with full jitter.
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class ControlledSession:
+    # Wraps a requests.Session (or anything with the same get()) so every
+    # request waits for its host's token bucket and concurrency limit, and
+    # connection errors, timeouts, 429 and 5xx responses are retried with
+    # backoff. The last response is returned if retries run out, so callers
+    # still see the status code; the last exception is raised if there was
+    # no response at all.
+
+    def __init__(self, session, rate=DEFAULT_RATE, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+        self.session = session
+        self.rate = rate
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host(self, url):
+        name = urlsplit(url).netloc
+        with self.lock:
+            state = self.hosts.get(name)
+            if state is None:
+                state = self.hosts[name] = HostState(name, self.rate, self.max_concurrency)
+        return state
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        # Imported here so loading this module does not pull in requests.
+        import requests
+        host = self.host(url)
+        attempt = 0
+        while True:
+            host.bucket.acquire()
+            host.enter()
+            response = error = None
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, params=params, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except BaseException:
+                host.release()
+                raise
+            host.leave(time.monotonic() - start, response, error)
+
+            if error is None and response.status_code not in RETRY_STATUSES:
+                return response
+            if attempt >= self.retries:
+                with host.cond:
+                    host.stats["failed"] += 1
+                if error is not None:
+                    raise error
+                return response
+
+            delay = retry_after(response)
+            delay = backoff_delay(attempt, self.backoff) if delay is None else min(delay, MAX_BACKOFF)
+            if response is not None and response.status_code == 429:
+                host.bucket.pause(delay)
+            with host.cond:
+                host.stats["retries"] += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def close(self):
+        self.session.close()
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+def format_host_stats(hosts):
+    lines = []
+    for name, state in sorted(hosts.items()):
+        stats = state.stats
+        elapsed = max(time.monotonic() - state.started, 1e-9)
+        average = stats["seconds"] / stats["requests"] if stats["requests"] else 0.0
+        lines.append(f"  {name}: {stats['requests']} requests ({stats['ok'] / elapsed:.1f}/s, "
+                     f"{stats['bytes'] / elapsed / 1024:.0f} KiB/s, {average * 1000:.0f} ms avg), "
+                     f"{stats['retries']} retried, {stats['throttled']} throttled, "
+                     f"{stats['server_errors']} server errors, {stats['errors']} connection errors, "
+                     f"{stats['failed']} gave up; concurrency {state.limit:.1f}")
+    return "\n".join(lines)
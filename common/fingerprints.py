@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from rdkit import Chem, DataStructs, RDLogger
+from rdkit.Chem import rdFingerprintGenerator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.reaction_db import ReactionDB
+
+FP_BITS = 2048
+MORGAN_RADIUS = 2
+CHUNK_ROWS = 65536
+BUILD_CHUNK = 2000
+
+RDLogger.DisableLog("rdApp.*")
+
+_morgan = None
+
+
+def morgan_generator():
+    global _morgan
+    if _morgan is None:
+        _morgan = rdFingerprintGenerator.GetMorganGenerator(radius=MORGAN_RADIUS, fpSize=FP_BITS)
+    return _morgan
+
+
+def morgan_bits(mol):
+    return np.packbits(morgan_generator().GetFingerprintAsNumPy(mol))
+
+
+def pattern_bits(mol):
+    # RDKit's pattern fingerprint sets every bit of a substructure's
+    # fingerprint in the molecule's too, so it is a safe screen for
+    # HasSubstructMatch (Morgan bits are not).
+    bits = np.zeros(FP_BITS, dtype=np.uint8)
+    DataStructs.ConvertToNumpyArray(Chem.PatternFingerprint(mol, FP_BITS), bits)
+    return np.packbits(bits)
+
+
+def _fingerprint_chunk(chunk):
+    rows = []
+    for compound, smiles in chunk:
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is not None:
+            rows.append((compound, smiles, morgan_bits(mol), pattern_bits(mol)))
+    return rows
+
+
+if hasattr(np, "bitwise_count"):
+    def popcount_rows(packed):
+        return np.bitwise_count(packed.view(np.uint64)).sum(axis=1, dtype=np.int32)
+else:
+    POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount_rows(packed):
+        return POPCOUNT[packed].sum(axis=1, dtype=np.int32)
+
+
+def build_index(db_path, index_dir, processes=0):
+    # Fingerprints every resolved compound in the reaction database and
+    # writes the index as .npy files that load memory-mapped.
+    db = ReactionDB(db_path)
+    db.resolve_compounds(processes)
+    compounds = db.conn.execute("SELECT id, canonical_smiles FROM compounds "
+                                "WHERE canonical_smiles IS NOT NULL ORDER BY id").fetchall()
+    db.close()
+
+    chunks = [compounds[i:i + BUILD_CHUNK] for i in range(0, len(compounds), BUILD_CHUNK)]
+    if processes > 0 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            rows = [row for chunk in pool.map(_fingerprint_chunk, chunks) for row in chunk]
+    else:
+        rows = [row for chunk in chunks for row in _fingerprint_chunk(chunk)]
+
+    width = FP_BITS // 8
+    morgan = np.array([row[2] for row in rows], dtype=np.uint8).reshape(len(rows), width)
+    encoded = [row[1].encode("utf-8") for row in rows]
+    os.makedirs(index_dir, exist_ok=True)
+    np.save(os.path.join(index_dir, "ids.npy"), np.array([row[0] for row in rows], dtype=np.int64))
+    np.save(os.path.join(index_dir, "morgan.npy"), morgan)
+    np.save(os.path.join(index_dir, "morgan_counts.npy"), popcount_rows(morgan))
+    np.save(os.path.join(index_dir, "pattern.npy"),
+            np.array([row[3] for row in rows], dtype=np.uint8).reshape(len(rows), width))
+    np.save(os.path.join(index_dir, "smiles_offsets.npy"),
+            np.cumsum([0] + [len(text) for text in encoded], dtype=np.int64))
+    with open(os.path.join(index_dir, "smiles.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    with open(os.path.join(index_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump({"bits": FP_BITS, "radius": MORGAN_RADIUS, "compounds": len(rows)}, f, indent=2)
+    return len(rows)
+
+
+class FingerprintIndex:
+    # Similarity and substructure search over the compounds of a reaction
+    # database. Row i of every array belongs to compound ids[i]. Queries
+    # scan the memory-mapped arrays CHUNK_ROWS rows at a time.
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "index.json"), encoding="utf-8") as f:
+            info = json.load(f)
+        if info["bits"] != FP_BITS or info["radius"] != MORGAN_RADIUS:
+            raise ValueError(f"{index_dir} was built with other fingerprint settings; rebuild it")
+        self.ids = np.load(os.path.join(index_dir, "ids.npy"), mmap_mode="r")
+        self.morgan = np.load(os.path.join(index_dir, "morgan.npy"), mmap_mode="r")
+        self.counts = np.load(os.path.join(index_dir, "morgan_counts.npy"), mmap_mode="r")
+        self.pattern = np.load(os.path.join(index_dir, "pattern.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(index_dir, "smiles_offsets.npy"), mmap_mode="r")
+        self.smiles_data = np.memmap(os.path.join(index_dir, "smiles.bin"), dtype=np.uint8, mode="r") \
+            if self.offsets[-1] else np.empty(0, np.uint8)
+        self.screened = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def smiles(self, row):
+        return self.smiles_data[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+
+    def tanimoto(self, query):
+        # Tanimoto similarity of every compound to a packed Morgan fingerprint.
+        query = query[np.newaxis, :]
+        query_count = popcount_rows(query)[0]
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, len(self))
+            common = popcount_rows(np.bitwise_and(self.morgan[start:stop], query))
+            union = self.counts[start:stop] + query_count - common
+            scores[start:stop] = np.where(union > 0, common / np.maximum(union, 1), 0.0)
+        return scores
+
+    def similar(self, smiles, top=10, threshold=0.0):
+        # [(compound id, smiles, similarity)] for the `top` most similar
+        # compounds at or above `threshold`, best first.
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is None:
+            raise ValueError(f"Cannot read SMILES '{smiles}'")
+        scores = self.tanimoto(morgan_bits(mol))
+        if top < len(scores):
+            rows = np.argpartition(-scores, top)[:top]
+        else:
+            rows = np.arange(len(scores))
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+        return [(int(self.ids[row]), self.smiles(row), float(scores[row]))
+                for row in rows if scores[row] >= threshold]
+
+    def screen(self, query_pattern):
+        # Rows whose pattern fingerprint contains every bit of the query's.
+        hits = []
+        for start in range(0, len(self), CHUNK_ROWS):
+            block = self.pattern[start:start + CHUNK_ROWS]
+            hits.append(start + np.flatnonzero((np.bitwise_and(block, query_pattern) == query_pattern).all(axis=1)))
+        return np.concatenate(hits) if hits else np.empty(0, np.int64)
+
+    def substructure(self, query, limit=None, smarts=False):
+        # [(compound id, smiles)] of compounds containing `query`; only the
+        # candidates that pass the fingerprint screen are matched atom by atom.
+        pattern = Chem.MolFromSmarts(query) if smarts else Chem.MolFromSmiles(query)
+        if pattern is None:
+            raise ValueError(f"Cannot read {'SMARTS' if smarts else 'SMILES'} '{query}'")
+        candidates = self.screen(pattern_bits(pattern))
+        self.screened = len(candidates)
+        matches = []
+        for row in candidates:
+            mol = Chem.MolFromSmiles(self.smiles(row))
+            if mol is not None and mol.HasSubstructMatch(pattern):
+                matches.append((int(self.ids[row]), self.smiles(row)))
+                if limit and len(matches) >= limit:
+                    break
+        return matches
+
+
+def print_reactions(db, compound, role, limit):
+    rows = [row for row in db.compound_reactions(compound) if role is None or row[2].lower() == role.lower()]
+    for source, reaction_id, role_name in rows[:limit]:
+        print(f"      {source} {reaction_id} ({role_name})")
+    if len(rows) > limit:
+        print(f"      ... {len(rows) - limit} more")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint search over the compounds of a reaction database.")
+    parser.add_argument("database")
+    parser.add_argument("index", help="Index directory")
+    parser.add_argument("--build", action="store_true", help="(Re)build the index from the database first")
+    parser.add_argument("--processes", type=int, default=0, help="Worker processes for --build")
+    parser.add_argument("--similar", metavar="SMILES", help="Compounds most similar to SMILES")
+    parser.add_argument("--substructure", metavar="QUERY", help="Compounds containing QUERY (SMILES)")
+    parser.add_argument("--smarts", action="store_true", help="Read --substructure as SMARTS")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--threshold", type=float, default=0.0, help="Lowest similarity to report")
+    parser.add_argument("--role", help="Only list reactions where the compound has this role")
+    parser.add_argument("--reactions", type=int, default=5, help="Reactions listed per compound")
+    args = parser.parse_args()
+
+    if args.build:
+        print(f"Indexed {build_index(args.database, args.index, args.processes)} compounds in {args.index}.")
+    if not args.similar and not args.substructure:
+        return
+
+    index = FingerprintIndex(args.index)
+    db = ReactionDB(args.database)
+    if args.similar:
+        hits = index.similar(args.similar, args.top, args.threshold)
+        print(f"{len(hits)} compounds similar to {args.similar}:")
+        for compound, smiles, score in hits:
+            print(f"  {score:.3f}  {smiles}")
+            print_reactions(db, compound, args.role, args.reactions)
+    if args.substructure:
+        hits = index.substructure(args.substructure, args.top, args.smarts)
+        print(f"{len(hits)} compounds contain {args.substructure} "
+              f"({index.screened} of {len(index)} passed the screen):")
+        for compound, smiles in hits:
+            print(f"  {smiles}")
+            print_reactions(db, compound, args.role, args.reactions)
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from email.utils import formatdate
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+INDEX_FILE = "index.sqlite"
+TOUCH_BATCH = 256
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class CachedResponse:
+    # Just enough of requests.Response for the scrapers.
+
+    def __init__(self, url, status_code, headers, content, from_cache):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def encoding(self):
+        content_type = self.headers.get("Content-Type", "")
+        for part in content_type.split(";"):
+            part = part.strip()
+            if part.lower().startswith("charset="):
+                return part.split("=", 1)[1].strip('"')
+        return "utf-8"
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise CacheMiss(f"HTTP {self.status_code} for {self.url}")
+
+
+def request_key(url, params=None):
+    items = sorted((str(k), str(v)) for k, v in (params or {}).items())
+    text = json.dumps(["GET", url, items])
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class HttpCache:
+    # Response bodies are stored once per content hash under objects/; an
+    # SQLite index maps request keys (URL + sorted params) to a body and its
+    # validators. Entries older than `ttl` are revalidated with
+    # If-None-Match / If-Modified-Since. When the bodies exceed `max_bytes` the
+    # least recently used entries are evicted. With offline=True nothing goes
+    # to the network and a missing entry raises CacheMiss. The byte total is
+    # kept as a running count and access times of hits are written in
+    # batches, so a hit or a store does not cost a scan or a commit.
+
+    def __init__(self, directory, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, offline=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "offline_misses": 0, "stored": 0, "evicted": 0}
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, INDEX_FILE), check_same_thread=False, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY, url TEXT, params TEXT, status INTEGER, headers TEXT,
+            etag TEXT, last_modified TEXT, body_hash TEXT, size INTEGER,
+            fetched_at REAL, accessed_at REAL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_body ON entries (body_hash)")
+        self.db.commit()
+        self.total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self.touched = {}
+
+    def object_path(self, body_hash):
+        return os.path.join(self.directory, "objects", body_hash[:2], body_hash)
+
+    def lookup(self, key):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT url, status, headers, etag, last_modified, body_hash, fetched_at FROM entries WHERE key = ?",
+                (key,)).fetchone()
+        if row is None:
+            return None
+        url, status, headers, etag, last_modified, body_hash, fetched_at = row
+        try:
+            with open(self.object_path(body_hash), "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        return {
+            "url": url,
+            "status": status,
+            "headers": json.loads(headers),
+            "etag": etag,
+            "last_modified": last_modified,
+            "content": content,
+            "fetched_at": fetched_at,
+        }
+
+    def count(self, name):
+        # get() runs on several fetch threads at once.
+        with self.lock:
+            self.stats[name] += 1
+
+    def touch(self, key, fetched=False):
+        # Revalidations are written at once since lookup() needs fetched_at;
+        # plain hits are held until TOUCH_BATCH of them are pending.
+        now = time.time()
+        with self.lock:
+            if fetched:
+                self.touched.pop(key, None)
+                self.db.execute("UPDATE entries SET accessed_at = ?, fetched_at = ? WHERE key = ?", (now, now, key))
+                self.db.commit()
+                return
+            self.touched[key] = now
+            if len(self.touched) >= TOUCH_BATCH:
+                self._flush_touched()
+                self.db.commit()
+
+    def _flush_touched(self):
+        # Caller holds the lock and commits.
+        if self.touched:
+            self.db.executemany("UPDATE entries SET accessed_at = ? WHERE key = ?",
+                                [(now, key) for key, now in self.touched.items()])
+            self.touched.clear()
+
+    def store(self, key, url, params, response):
+        content = response.content
+        body_hash = hashlib.sha256(content).hexdigest()
+        path = self.object_path(body_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+        headers = {name: response.headers[name] for name in ["Content-Type", "ETag", "Last-Modified"]
+                   if name in response.headers}
+        now = time.time()
+        with self.lock:
+            self.touched.pop(key, None)
+            row = self.db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+                key, url, json.dumps(params or {}, sort_keys=True), response.status_code, json.dumps(headers),
+                headers.get("ETag"), headers.get("Last-Modified"), body_hash, len(content), now, now))
+            self.db.commit()
+            self.total += len(content) - (row[0] if row else 0)
+            self.stats["stored"] += 1
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            if self.total <= self.max_bytes:
+                return
+            # Other processes may share the directory, so the scan starts
+            # from the real total and the latest access times.
+            self._flush_touched()
+            total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            rows = self.db.execute("SELECT key, body_hash, size FROM entries ORDER BY accessed_at").fetchall()
+            removed = []
+            for key, body_hash, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                removed.append(body_hash)
+                total -= size
+                self.stats["evicted"] += 1
+            self.db.commit()
+            self.total = total
+            for body_hash in set(removed):
+                still_used = self.db.execute("SELECT 1 FROM entries WHERE body_hash = ? LIMIT 1",
+                                             (body_hash,)).fetchone()
+                if still_used is None:
+                    try:
+                        os.remove(self.object_path(body_hash))
+                    except FileNotFoundError:
+                        pass
+
+    def get(self, session, url, params=None, headers=None, **kwargs):
+        key = request_key(url, params)
+        entry = self.lookup(key)
+
+        if entry is not None and (self.offline or time.time() - entry["fetched_at"] < self.ttl):
+            self.touch(key)
+            self.count("hits")
+            return CachedResponse(entry["url"], entry["status"], entry["headers"], entry["content"], True)
+
+        if self.offline:
+            self.count("offline_misses")
+            raise CacheMiss(f"Offline and not cached: {url} {params or ''}")
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry["etag"]:
+                request_headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                request_headers["If-Modified-Since"] = entry["last_modified"]
+            elif not entry["etag"]:
+                request_headers["If-Modified-Since"] = formatdate(entry["fetched_at"], usegmt=True)
+
+        response = session.get(url, params=params, headers=request_headers, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self.touch(key, fetched=True)
+            self.count("revalidated")
+            return CachedResponse(entry["url"], entry["status"], entry["headers"], entry["content"], True)
+
+        self.count("misses")
+        if response.status_code == 200:
+            self.store(key, url, params, response)
+        return response
+
+    def close(self):
+        with self.lock:
+            self._flush_touched()
+            self.db.commit()
+            self.db.close()
+
+
+class CachedSession:
+    # Wraps a requests.Session so existing `session.get(...)` calls go
+    # through the cache; everything else is passed to the wrapped session.
+
+    def __init__(self, session, cache):
+        self.session = session
+        self.cache = cache
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        return self.cache.get(self.session, url, params=params, headers=headers, **kwargs)
+
+    def close(self):
+        self.session.close()
+        self.cache.close()
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+def format_stats(stats):
+    text = (f"{stats['hits']} hits, {stats['revalidated']} revalidated, {stats['misses']} fetched, "
+            f"{stats['stored']} stored, {stats['evicted']} evicted")
+    if stats["offline_misses"]:
+        text += f", {stats['offline_misses']} missing (offline)"
+    return text
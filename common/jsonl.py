@@ -0,0 +1,41 @@
+import os
+import json
+
+
+def iter_jsonl(path):
+    # Yields (record, end) for each intact line, where `end` is the byte
+    # offset just past it; a line cut short by a crash ends the log.
+    if not os.path.exists(path):
+        return
+    end = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                return
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return
+            end += len(line)
+            yield record, end
+
+
+def read_jsonl(path):
+    # Returns the parsed records and the byte length of the intact prefix.
+    records = []
+    good_length = 0
+    for record, good_length in iter_jsonl(path):
+        records.append(record)
+    return records, good_length
+
+
+def truncate_log(path, good_length):
+    if os.path.exists(path) and os.path.getsize(path) != good_length:
+        with open(path, "r+b") as f:
+            f.truncate(good_length)
+
+
+def open_log(path):
+    records, good_length = read_jsonl(path)
+    truncate_log(path, good_length)
+    return records, open(path, "a", encoding="utf-8")
@@ -0,0 +1,120 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+DEFAULT_VERSION = "1"
+
+
+def content_hash(content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha1(content).hexdigest()
+
+
+class Manifest:
+    # What earlier incremental runs have already put in the output: every
+    # reaction (an ORD reaction_id or a CRD profile URL) with the hash of the
+    # content it was processed from, and a summary per group (an ORD dataset
+    # or dataset file, a CRD archive set) so unchanged groups can be skipped
+    # without fetching them. Changes are only committed by save(), which
+    # callers run once the output holds the same reactions; a run that dies
+    # first leaves the manifest as it was. Everything is dropped when
+    # `version` (e.g. the classification rules) changes. Safe to share
+    # between threads.
+
+    def __init__(self, path, version=DEFAULT_VERSION):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS reactions (
+            key TEXT PRIMARY KEY, grp TEXT, hash TEXT, info TEXT, updated REAL)""")
+        self.db.execute("CREATE TABLE IF NOT EXISTS groups (name TEXT PRIMARY KEY, summary TEXT, updated REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS reactions_grp ON reactions(grp)")
+        row = self.db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        self.reset = row is not None and row[0] != str(version)
+        if row is None or self.reset:
+            self.db.execute("DELETE FROM reactions")
+            self.db.execute("DELETE FROM groups")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(version),))
+        self.db.commit()
+        self.stats = {"new": 0, "changed": 0, "unchanged": 0, "groups_skipped": 0}
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def __len__(self):
+        return self._query("SELECT COUNT(*) FROM reactions")[0][0]
+
+    def __contains__(self, key):
+        return self.entry(key) is not None
+
+    def entry(self, key):
+        # (hash, info) for a known reaction, else None.
+        rows = self._query("SELECT hash, info FROM reactions WHERE key = ?", (key,))
+        if not rows:
+            return None
+        digest, info = rows[0]
+        return digest, json.loads(info) if info else {}
+
+    def hash_of(self, key):
+        entry = self.entry(key)
+        return entry[0] if entry else None
+
+    def check(self, key, digest):
+        # "new", "changed" or "unchanged", counted in self.stats.
+        known = self.hash_of(key)
+        state = "new" if known is None else "unchanged" if known == digest else "changed"
+        with self.lock:
+            self.stats[state] += 1
+        return state
+
+    def record(self, key, group, digest, **info):
+        self._query("INSERT OR REPLACE INTO reactions VALUES (?, ?, ?, ?, ?)",
+                    (key, group, digest, json.dumps(info) if info else None, time.time()))
+
+    def keys(self, group):
+        return [key for key, in self._query("SELECT key FROM reactions WHERE grp = ?", (group,))]
+
+    def newest(self, group, field):
+        # The largest value of an info field over a group's reactions, or None.
+        rows = self._query("SELECT MAX(json_extract(info, ?)) FROM reactions WHERE grp = ?",
+                           ("$." + field, group))
+        return rows[0][0]
+
+    def forget(self, key):
+        self._query("DELETE FROM reactions WHERE key = ?", (key,))
+
+    def group_unchanged(self, name, summary):
+        rows = self._query("SELECT summary FROM groups WHERE name = ?", (name,))
+        if rows and rows[0][0] == json.dumps(summary, sort_keys=True):
+            self.stats["groups_skipped"] += 1
+            return True
+        return False
+
+    def record_group(self, name, summary):
+        self._query("INSERT OR REPLACE INTO groups VALUES (?, ?, ?)",
+                    (name, json.dumps(summary, sort_keys=True), time.time()))
+
+    def save(self):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        # Anything not saved is rolled back.
+        with self.lock:
+            self.db.close()
+
+
+def format_stats(stats, groups=None):
+    text = f"{stats['new']} new, {stats['changed']} changed, {stats['unchanged']} unchanged"
+    if "removed" in stats:
+        text += f", {stats['removed']} removed"
+    text += " reactions"
+    if groups:
+        text += f"; {stats['groups_skipped']} unchanged {groups} skipped"
+    return text
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+LOG_LEVELS = ["debug", "info", "warning", "error"]
+
+
+class Metrics:
+    # Named stage timers (calls, total and longest seconds) and event
+    # counters. Safe to use from several threads; worker processes send
+    # take() back to the parent, which merge()s it.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.timers = {}
+        self.counters = {}
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "elapsed": time.monotonic() - self.started,
+                "timers": {name: list(timer) for name, timer in self.timers.items()},
+                "counters": dict(self.counters),
+            }
+
+    def take(self):
+        with self.lock:
+            taken = {"timers": self.timers, "counters": self.counters}
+            self.timers = {}
+            self.counters = {}
+            return taken
+
+    def merge(self, taken):
+        with self.lock:
+            for name, (calls, seconds, longest) in taken.get("timers", {}).items():
+                timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+                timer[0] += calls
+                timer[1] += seconds
+                timer[2] = max(timer[2], longest)
+            for name, n in taken.get("counters", {}).items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+
+METRICS = Metrics()
+
+
+def format_summary(snapshot):
+    # Stages can nest (classify includes rdkit_parse and smarts_match) and run
+    # on several threads at once, so the shares of wall time need not add up
+    # to 100%.
+    elapsed = max(snapshot["elapsed"], 1e-9)
+    lines = [f"Run time {elapsed:.1f} s",
+             f"  {'stage':<16} {'calls':>9} {'total s':>9} {'avg ms':>9} {'max ms':>9} {'% wall':>7}"]
+    for name, (calls, seconds, longest) in sorted(snapshot["timers"].items(), key=lambda item: -item[1][1]):
+        lines.append(f"  {name:<16} {calls:>9} {seconds:>9.2f} {seconds / calls * 1000:>9.3f} "
+                     f"{longest * 1000:>9.1f} {seconds / elapsed * 100:>6.1f}%")
+    if snapshot["counters"]:
+        lines.append("  " + ", ".join(f"{name}={n}" for name, n in sorted(snapshot["counters"].items())))
+    return "\n".join(lines)
+
+
+def prometheus_text(snapshot, prefix):
+    lines = [
+        f"# HELP {prefix}_stage_seconds_total Time spent in each stage.",
+        f"# TYPE {prefix}_stage_seconds_total counter",
+    ]
+    for name, (calls, seconds, longest) in sorted(snapshot["timers"].items()):
+        lines.append(f'{prefix}_stage_seconds_total{{stage="{name}"}} {seconds:.6f}')
+    lines += [f"# HELP {prefix}_stage_calls_total Calls of each stage.", f"# TYPE {prefix}_stage_calls_total counter"]
+    for name, (calls, seconds, longest) in sorted(snapshot["timers"].items()):
+        lines.append(f'{prefix}_stage_calls_total{{stage="{name}"}} {calls}')
+    lines += [f"# HELP {prefix}_stage_seconds_max Longest single call of each stage.",
+              f"# TYPE {prefix}_stage_seconds_max gauge"]
+    for name, (calls, seconds, longest) in sorted(snapshot["timers"].items()):
+        lines.append(f'{prefix}_stage_seconds_max{{stage="{name}"}} {longest:.6f}')
+    lines += [f"# HELP {prefix}_events_total Events counted during the run.", f"# TYPE {prefix}_events_total counter"]
+    for name, n in sorted(snapshot["counters"].items()):
+        lines.append(f'{prefix}_events_total{{event="{name}"}} {n}')
+    lines += [f"# HELP {prefix}_run_seconds Wall time of the run.", f"# TYPE {prefix}_run_seconds gauge",
+              f"{prefix}_run_seconds {snapshot['elapsed']:.3f}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path, snapshot, prefix):
+    # A .prom path gets the Prometheus text format (for node_exporter's
+    # textfile collector), anything else JSON. Written atomically.
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        if path.endswith(".prom"):
+            f.write(prometheus_text(snapshot, prefix))
+        else:
+            json.dump(snapshot, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def profiled(profile_path=None, trace_memory=False, top=15):
+    # Opt-in cProfile (stats dumped to `profile_path`, top functions by
+    # cumulative time printed) and tracemalloc (peak and top allocation
+    # sites printed) around a block.
+    profiler = None
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            import pstats
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            print(f"\nProfile written to {profile_path}; top {top} by cumulative time:")
+            pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(top)
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"\nPython memory: {current / 1024 ** 2:.1f} MiB at exit, {peak / 1024 ** 2:.1f} MiB peak; "
+                  f"top {top} allocation sites:")
+            for stat in snapshot.statistics("lineno")[:top]:
+                print(f"  {stat}")
+
+
+def configure_logging(level="info"):
+    # Progress goes to stdout without decoration, as the print calls did.
+    logging.basicConfig(format="%(message)s", stream=sys.stdout, level=getattr(logging, level.upper()))
@@ -0,0 +1,377 @@
+import os
+import sys
+import json
+import sqlite3
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DEFAULT_BATCH = 5000
+DB_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reactions (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    reaction_id TEXT NOT NULL,
+    smiles TEXT,
+    doi TEXT,
+    year INTEGER,
+    record TEXT,
+    UNIQUE (source, reaction_id)
+);
+CREATE TABLE IF NOT EXISTS compounds (
+    id INTEGER PRIMARY KEY,
+    inchi_key TEXT UNIQUE,
+    canonical_smiles TEXT,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS identifiers (
+    id INTEGER PRIMARY KEY,
+    identifier_type TEXT NOT NULL,
+    value TEXT NOT NULL,
+    name TEXT,
+    compound INTEGER REFERENCES compounds(id),
+    UNIQUE (identifier_type, value)
+);
+CREATE TABLE IF NOT EXISTS roles (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS participants (
+    id INTEGER PRIMARY KEY,
+    reaction INTEGER NOT NULL REFERENCES reactions(id),
+    identifier INTEGER NOT NULL REFERENCES identifiers(id),
+    role INTEGER NOT NULL REFERENCES roles(id),
+    input_key TEXT
+);
+CREATE TABLE IF NOT EXISTS participant_categories (
+    participant INTEGER NOT NULL REFERENCES participants(id),
+    category INTEGER NOT NULL REFERENCES categories(id)
+);
+CREATE INDEX IF NOT EXISTS reactions_reaction_id ON reactions(reaction_id);
+CREATE INDEX IF NOT EXISTS reactions_doi ON reactions(doi);
+CREATE INDEX IF NOT EXISTS compounds_canonical_smiles ON compounds(canonical_smiles);
+CREATE INDEX IF NOT EXISTS identifiers_compound ON identifiers(compound);
+CREATE INDEX IF NOT EXISTS participants_reaction ON participants(reaction);
+CREATE INDEX IF NOT EXISTS participants_identifier ON participants(identifier);
+CREATE INDEX IF NOT EXISTS participant_categories_category ON participant_categories(category);
+CREATE INDEX IF NOT EXISTS participant_categories_participant ON participant_categories(participant);
+"""
+
+
+def crd_identifier(mol):
+    # CRD molecules are identified by SMILES when they have one, so they
+    # share rows with ORD components spelled the same way.
+    if mol.get("smiles"):
+        return "SMILES", mol["smiles"]
+    if mol.get("inchiKey"):
+        return "INCHI_KEY", mol["inchiKey"]
+    return "NAME", mol.get("name") or "Unknown"
+
+
+def is_db_path(path):
+    return path.lower().endswith(DB_SUFFIXES)
+
+
+def to_year(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ReactionDB:
+    # SQLite store shared by the ORD and CRD scrapers. Reactions, roles and
+    # categories are normalised into their own tables and linked through
+    # participants. Each participant points at an identifier (a SMILES,
+    # name or InChIKey as it was written), and resolve_compounds() links
+    # identifiers to compounds deduplicated by InChIKey. Writes are committed
+    # in one transaction per `batch_size` participants. Writing a reaction
+    # that is already stored replaces its participants.
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH):
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.ids = {"roles": {}, "categories": {}, "identifiers": {}, "reactions": {}, "participants": {}}
+        self.replaced = set()
+        self.pending = 0
+
+    def _name_id(self, table, name):
+        cache = self.ids[table]
+        row_id = cache.get(name)
+        if row_id is None:
+            row = self.conn.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()
+            row_id = row[0] if row else self.conn.execute(f"INSERT INTO {table} (name) VALUES (?)", (name,)).lastrowid
+            cache[name] = row_id
+        return row_id
+
+    def identifier_id(self, identifier_type, value, name=None):
+        cache = self.ids["identifiers"]
+        key = (identifier_type, value)
+        row_id = cache.get(key)
+        if row_id is None:
+            row = self.conn.execute("SELECT id FROM identifiers WHERE identifier_type = ? AND value = ?", key).fetchone()
+            if row:
+                row_id = row[0]
+                if name:
+                    self.conn.execute("UPDATE identifiers SET name = COALESCE(name, ?) WHERE id = ?", (name, row_id))
+            else:
+                row_id = self.conn.execute(
+                    "INSERT INTO identifiers (identifier_type, value, name) VALUES (?, ?, ?)",
+                    (identifier_type, value, name)).lastrowid
+            cache[key] = row_id
+            if len(cache) > 1000000:
+                cache.clear()
+        return row_id
+
+    def reaction_id(self, source, reaction_id, smiles=None, doi=None, year=None, record=None):
+        cache = self.ids["reactions"]
+        key = (source, reaction_id)
+        row_id = cache.get(key)
+        if row_id is not None:
+            return row_id
+        row = self.conn.execute("SELECT id FROM reactions WHERE source = ? AND reaction_id = ?", key).fetchone()
+        if row:
+            row_id = row[0]
+            if row_id not in self.replaced:
+                self.conn.execute("DELETE FROM participant_categories WHERE participant IN "
+                                  "(SELECT id FROM participants WHERE reaction = ?)", (row_id,))
+                self.conn.execute("DELETE FROM participants WHERE reaction = ?", (row_id,))
+                self.conn.execute("UPDATE reactions SET smiles = ?, doi = ?, year = ?, record = ? WHERE id = ?",
+                                  (smiles, doi, year, record, row_id))
+        else:
+            row_id = self.conn.execute(
+                "INSERT INTO reactions (source, reaction_id, smiles, doi, year, record) VALUES (?, ?, ?, ?, ?, ?)",
+                (source, reaction_id, smiles, doi, year, record)).lastrowid
+        self.replaced.add(row_id)
+        cache[key] = row_id
+        if len(cache) > 100000:
+            cache.clear()
+        return row_id
+
+    def remove_reactions(self, source, reaction_ids):
+        for reaction_id in reaction_ids:
+            row = self.conn.execute("SELECT id FROM reactions WHERE source = ? AND reaction_id = ?",
+                                    (source, reaction_id)).fetchone()
+            if row is None:
+                continue
+            self.conn.execute("DELETE FROM participant_categories WHERE participant IN "
+                              "(SELECT id FROM participants WHERE reaction = ?)", row)
+            self.conn.execute("DELETE FROM participants WHERE reaction = ?", row)
+            self.conn.execute("DELETE FROM reactions WHERE id = ?", row)
+            self.ids["reactions"].pop((source, reaction_id), None)
+        self.ids["participants"].clear()
+        self.commit()
+
+    def add_participant(self, reaction, identifier, role, input_key=None, categories=(), participant=None):
+        if participant is None:
+            participant = self.conn.execute(
+                "INSERT INTO participants (reaction, identifier, role, input_key) VALUES (?, ?, ?, ?)",
+                (reaction, identifier, self._name_id("roles", role), input_key)).lastrowid
+        if categories:
+            self.conn.executemany(
+                "INSERT INTO participant_categories (participant, category) VALUES (?, ?)",
+                [(participant, self._name_id("categories", cat)) for cat in categories])
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.commit()
+        return participant
+
+    def add_ord_rows(self, rows):
+        # Rows as produced by scrape_ord.component_rows. A component that
+        # comes back under another category (as when merging outputs one
+        # category at a time) is linked to its existing participant.
+        seen = self.ids["participants"]
+        for categories, reaction_id, input_key, role_name, identifier_type, value in rows:
+            reaction = self.reaction_id("ORD", reaction_id)
+            identifier = self.identifier_id(identifier_type, value)
+            key = (reaction, identifier, role_name, input_key)
+            participant = seen.get(key)
+            if participant is not None and any(self.linked(participant, cat) for cat in categories):
+                participant = None
+            seen[key] = self.add_participant(reaction, identifier, role_name, input_key, categories, participant)
+            if len(seen) > 100000:
+                seen.clear()
+
+    def linked(self, participant, category):
+        row = self.conn.execute("SELECT 1 FROM participant_categories WHERE participant = ? AND category = ?",
+                                (participant, self._name_id("categories", category))).fetchone()
+        return row is not None
+
+    def add_crd_reaction(self, data):
+        source = data.get("source") if isinstance(data.get("source"), dict) else {}
+        reaction = self.reaction_id("CRD", data["details_url"], data.get("smiles") or None,
+                                    source.get("DOI") or None, to_year(source.get("year")),
+                                    json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+        for key, molecules in data.items():
+            if not key.endswith("_details") or not isinstance(molecules, list):
+                continue
+            for mol in molecules:
+                identifier_type, value = crd_identifier(mol)
+                identifier = self.identifier_id(identifier_type, value, mol.get("name"))
+                self.add_participant(reaction, identifier, mol.get("role") or key[:-len("_details")])
+
+    def compound_for(self, inchi_key, canonical_smiles, name):
+        # Compounds are shared by InChIKey; structures without one are shared
+        # by canonical SMILES, and unreadable identifiers get a compound each.
+        if inchi_key:
+            row = self.conn.execute("SELECT id FROM compounds WHERE inchi_key = ?", (inchi_key,)).fetchone()
+        elif canonical_smiles:
+            row = self.conn.execute("SELECT id FROM compounds WHERE inchi_key IS NULL AND canonical_smiles = ?",
+                                    (canonical_smiles,)).fetchone()
+        else:
+            row = None
+        if row is None:
+            return self.conn.execute("INSERT INTO compounds (inchi_key, canonical_smiles, name) VALUES (?, ?, ?)",
+                                     (inchi_key, canonical_smiles, name)).lastrowid
+        self.conn.execute("UPDATE compounds SET canonical_smiles = COALESCE(canonical_smiles, ?), "
+                          "name = COALESCE(name, ?) WHERE id = ?", (canonical_smiles, name, row[0]))
+        return row[0]
+
+    def resolve_compounds(self, processes=0, chunk_size=50000):
+        # Links every identifier without a compound to one: SMILES are
+        # canonicalised with RDKit (in `processes` worker processes) and
+        # deduplicated by InChIKey. Identifiers already linked are not
+        # looked at again, so this only costs time for new spellings.
+        try:
+            from common.compounds import canonicalize_all
+        except ImportError as e:
+            print(f"Compounds not resolved: {e}")
+            return 0
+        self.commit()
+        resolved = 0
+        while True:
+            rows = self.conn.execute("SELECT id, identifier_type, value, name FROM identifiers "
+                                     "WHERE compound IS NULL LIMIT ?", (chunk_size,)).fetchall()
+            if not rows:
+                break
+            smiles = [value for _, identifier_type, value, _ in rows if identifier_type == "SMILES"]
+            canonical = dict(zip(smiles, canonicalize_all(smiles, processes)))
+            updates = []
+            for row_id, identifier_type, value, name in rows:
+                if identifier_type == "SMILES":
+                    canonical_smiles, inchi_key = canonical[value]
+                elif identifier_type == "INCHI_KEY":
+                    canonical_smiles, inchi_key = None, value
+                else:
+                    canonical_smiles, inchi_key = None, None
+                if identifier_type == "NAME" and name is None:
+                    name = value
+                updates.append((self.compound_for(inchi_key, canonical_smiles, name), row_id))
+            self.conn.executemany("UPDATE identifiers SET compound = ? WHERE id = ?", updates)
+            self.commit()
+            resolved += len(updates)
+        return resolved
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def ord_categories(self):
+        return [name for name, in self.conn.execute(
+            "SELECT DISTINCT categories.name FROM participant_categories "
+            "JOIN categories ON categories.id = participant_categories.category ORDER BY categories.id")]
+
+    def iter_ord_entries(self, category):
+        cursor = self.conn.execute(
+            "SELECT reactions.reaction_id, participants.input_key, roles.name, identifiers.identifier_type, identifiers.value "
+            "FROM participant_categories "
+            "JOIN categories ON categories.id = participant_categories.category "
+            "JOIN participants ON participants.id = participant_categories.participant "
+            "JOIN reactions ON reactions.id = participants.reaction "
+            "JOIN roles ON roles.id = participants.role "
+            "JOIN identifiers ON identifiers.id = participants.identifier "
+            "WHERE categories.name = ? AND reactions.source = 'ORD' "
+            "ORDER BY participant_categories.rowid", (category,))
+        for reaction_id, input_key, role_name, identifier_type, value in cursor:
+            yield {
+                "reaction_id": reaction_id,
+                "input_key": input_key,
+                "reaction_role": role_name,
+                "identifier_type": identifier_type,
+                "value": value,
+            }
+
+    def iter_crd_records(self):
+        for record, in self.conn.execute("SELECT record FROM reactions WHERE source = 'CRD' ORDER BY id"):
+            yield json.loads(record)
+
+    def find_compounds(self, query):
+        # Compound ids for a SMILES (any spelling RDKit can read), InChIKey
+        # or name.
+        ids = {row[0] for row in self.conn.execute(
+            "SELECT compound FROM identifiers WHERE value = ? AND compound IS NOT NULL", (query,))}
+        ids.update(row[0] for row in self.conn.execute("SELECT id FROM compounds WHERE inchi_key = ?", (query,)))
+        try:
+            from common.compounds import canonical_compound
+            canonical_smiles, inchi_key = canonical_compound(query)
+        except ImportError:
+            canonical_smiles, inchi_key = None, None
+        if inchi_key:
+            ids.update(row[0] for row in self.conn.execute("SELECT id FROM compounds WHERE inchi_key = ?", (inchi_key,)))
+        if canonical_smiles:
+            ids.update(row[0] for row in self.conn.execute(
+                "SELECT id FROM compounds WHERE canonical_smiles = ?", (canonical_smiles,)))
+        return sorted(ids)
+
+    def compound_reactions(self, compound):
+        return self.conn.execute(
+            "SELECT DISTINCT reactions.source, reactions.reaction_id, roles.name FROM identifiers "
+            "JOIN participants ON participants.identifier = identifiers.id "
+            "JOIN reactions ON reactions.id = participants.reaction "
+            "JOIN roles ON roles.id = participants.role "
+            "WHERE identifiers.compound = ? ORDER BY reactions.id", (compound,)).fetchall()
+
+    def summary(self):
+        counts = {}
+        for table in ["reactions", "identifiers", "compounds", "participants", "roles", "categories"]:
+            counts[table] = self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for source, count in self.conn.execute("SELECT source, COUNT(*) FROM reactions GROUP BY source"):
+            counts[f"{source} reactions"] = count
+        for source, count in self.conn.execute(
+                "SELECT reactions.source, COUNT(DISTINCT identifiers.compound) FROM participants "
+                "JOIN reactions ON reactions.id = participants.reaction "
+                "JOIN identifiers ON identifiers.id = participants.identifier "
+                "WHERE identifiers.compound IS NOT NULL GROUP BY reactions.source"):
+            counts[f"{source} compounds"] = count
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show what a shared ORD/CRD reaction database holds.")
+    parser.add_argument("database")
+    parser.add_argument("--compound", help="List reactions using this SMILES, InChIKey or name")
+    parser.add_argument("--resolve", action="store_true",
+                        help="Canonicalise new identifiers and link them to compounds first")
+    parser.add_argument("--processes", type=int, default=0, help="Worker processes for --resolve")
+    args = parser.parse_args()
+
+    db = ReactionDB(args.database)
+    if args.resolve:
+        print(f"Resolved {db.resolve_compounds(args.processes)} identifiers.")
+    for name, count in db.summary().items():
+        print(f"{name:<20} {count}")
+    if args.compound:
+        for compound in db.find_compounds(args.compound):
+            rows = db.compound_reactions(compound)
+            print(f"\nCompound {compound}: {len(rows)} reactions")
+            for source, reaction_id, role in rows:
+                print(f"  {source} {reaction_id} ({role})")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()